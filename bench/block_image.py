@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Copyright 2020, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+""" Compare the pure Python and NumPy BlockImage line generators.
+
+Run with ``python -m bench.block_image [IMAGE]``.
+"""
+
+
+from argparse import ArgumentParser
+from timeit import repeat
+
+from PIL import Image
+
+from pansi.image import BlockImage
+
+
+def fragments(block_image):
+    for line_no in block_image.line_numbers:
+        block_image._create_line_fragments(line_no)
+
+
+def render(block_image):
+    for _ in block_image.ansi_lines():
+        pass
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=5)
+    parser.add_argument("images", nargs="*", default=["art/pansies.png", "art/hello-rainbow.png"])
+    args = parser.parse_args()
+    for filename in args.images:
+        image = Image.open(filename).convert("RGB")
+        print(filename)
+        print(f"{'size':>10}  {'stage':>9}  {'python':>10}  {'numpy':>10}  speedup")
+        for cols, lines in [(80, 24), (160, 50), (300, 80), (600, 160)]:
+            for stage, func in [("fragments", fragments), ("ansi", render)]:
+                times = {}
+                for use_numpy in (False, True):
+                    block_image = BlockImage(image, lines=lines, cols=cols, use_numpy=use_numpy)
+                    # Start each run from an empty line cache
+                    times[use_numpy] = min(repeat(lambda: (block_image._fragments.clear(), func(block_image)),
+                                                  number=1, repeat=args.number))
+                print(f"{cols:>5}x{lines:<4}  {stage:>9}  {1000 * times[False]:>8.1f}ms  "
+                      f"{1000 * times[True]:>8.1f}ms  {times[False] / times[True]:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Copyright 2020, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+""" Compare graphics protocol transmission media for a 4K image.
+
+Run with ``python -m bench.graphics [IMAGE]``.
+"""
+
+
+from argparse import ArgumentParser
+from base64 import b64decode
+from os import remove
+from time import perf_counter
+
+from PIL import Image
+
+from pansi import graphics
+
+
+def cleanup(medium, sent):
+    # Do what the terminal would otherwise do with the transmitted data
+    if medium == graphics.DIRECT:
+        return
+    payload = sent[sent.index(";") + 1:sent.index("\x1b\\")]
+    name = b64decode(payload).decode("utf-8")
+    if medium == graphics.FILE:
+        remove(name)
+    elif medium == graphics.SHARED_MEMORY:
+        from multiprocessing.shared_memory import SharedMemory
+        shm = SharedMemory(name.lstrip("/"))
+        shm.close()
+        shm.unlink()
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=3)
+    parser.add_argument("image", nargs="?", default="art/pansies.png")
+    args = parser.parse_args()
+    image = Image.open(args.image).convert("RGB").resize((3840, 2160))
+    print(f"{'medium':>8}  {'zlib':>5}  {'time':>10}  {'in-band bytes':>14}")
+    for medium, compress in [(graphics.FILE, False),
+                             (graphics.SHARED_MEMORY, False),
+                             (graphics.SHARED_MEMORY, True),
+                             (graphics.DIRECT, False),
+                             (graphics.DIRECT, True)]:
+        best = None
+        for _ in range(args.number):
+            t0 = perf_counter()
+            sent = graphics.transmit(image, medium=medium, compress=compress)
+            t1 = perf_counter()
+            cleanup(medium, sent)
+            best = t1 - t0 if best is None else min(best, t1 - t0)
+        print(f"{medium:>8}  {'yes' if compress else 'no':>5}  {1000 * best:>8.1f}ms  {len(sent):>14,}")
+
+
+if __name__ == "__main__":
+    main()
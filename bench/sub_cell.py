@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Copyright 2020, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+""" Compare half-block rendering with quadrant and sextant rendering.
+
+Run with ``python -m bench.sub_cell [IMAGE]``.
+"""
+
+
+from argparse import ArgumentParser
+from timeit import repeat
+
+from PIL import Image
+
+from pansi.image import BlockImage, SubCellImage
+
+
+def render(image, lines, cols, mode):
+    if mode == "half":
+        block_image = BlockImage(image, lines=lines, cols=cols)
+    else:
+        block_image = SubCellImage(image, lines=lines, cols=cols, mode=mode)
+    return sum(len(line) for line in block_image.ansi_lines())
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=3)
+    parser.add_argument("image", nargs="?", default="art/pansies.png")
+    args = parser.parse_args()
+    image = Image.open(args.image).convert("RGB")
+    print(f"{'size':>10}  {'mode':>8}  {'time':>10}  {'bytes':>10}")
+    for cols, lines in [(80, 24), (160, 50), (300, 80)]:
+        for mode in ["half", "quadrant", "sextant"]:
+            best = min(repeat(lambda: render(image, lines, cols, mode), number=1, repeat=args.number))
+            size = render(image, lines, cols, mode)
+            print(f"{cols:>5}x{lines:<4}  {mode:>8}  {1000 * best:>8.1f}ms  {size:>10,}")
+
+
+if __name__ == "__main__":
+    main()
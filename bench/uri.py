@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Copyright 2020, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+""" Compare URI parsing with urllib.parse.urlsplit, and with the
+partition-based parser that URI.parse replaced.
+
+Run with ``python -m bench.uri``.
+"""
+
+
+from argparse import ArgumentParser
+from timeit import repeat
+from urllib.parse import urlsplit
+
+from pansi.net import URI, _normal_form, _parse
+
+
+def partition_split(s):
+    # The parser that URI.parse replaced, kept here as a baseline
+    # (including its mishandling of "//host" with no path).
+    scheme, colon, ssp = s.partition(":")
+    if not colon:
+        scheme, ssp = None, scheme
+    apq, hash_sign, fragment = ssp.partition("#")
+    if not hash_sign:
+        fragment = None
+    hierarchical_part, question_mark, query = apq.partition("?")
+    if not question_mark:
+        query = None
+    if hierarchical_part.startswith("//"):
+        hierarchical_part = hierarchical_part[2:]
+        slash = hierarchical_part.find("/")
+        if slash:
+            authority = hierarchical_part[:slash]
+            path = hierarchical_part[slash:]
+        else:
+            authority = hierarchical_part
+            path = ""
+    else:
+        authority = None
+        path = hierarchical_part
+    return scheme, authority, path, query, fragment
+
+
+URIS = [
+    "https://images.example.com/gallery/2020/06/pansies.png",
+    "http://user@Example.COM:8080/a/./b/../thumb%7e1.jpg?size=large&format=webp#top",
+    "file:///home/someone/Pictures/holiday/beach.jpeg",
+    "//cdn.example.net/static/img/logo.svg?v=3",
+]
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=20000)
+    args = parser.parse_args()
+    # Both urlsplit and URI.parse keep recently parsed results (as
+    # does URI for normal forms, which it hashes), so the uncached
+    # functions underneath are timed too.
+    split_uncached = getattr(urlsplit, "__wrapped__", urlsplit)
+    cases = [
+        ("urlsplit (uncached)", lambda s: split_uncached(s)),
+        ("urlsplit", urlsplit),
+        ("partition baseline", partition_split),
+        ("URI.parse (uncached)", lambda s: _parse.__wrapped__(URI, s)),
+        ("URI.parse", URI.parse),
+        ("URI.parse + hash (uncached)", lambda s: tuple.__hash__(_normal_form.__wrapped__(
+            URI, *_parse.__wrapped__(URI, s)))),
+        ("URI.parse + hash", lambda s: hash(URI.parse(s))),
+    ]
+    print(f"{'':>28}  {'per URI':>10}")
+    for name, func in cases:
+        best = min(repeat(lambda: [func(s) for s in URIS], number=args.number, repeat=5))
+        print(f"{name:>28}  {1e9 * best / args.number / len(URIS):>8.0f}ns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+# Copyright 2020, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+""" Building blocks for the caches used throughout pansi.
+"""
+
+
+from collections import OrderedDict
+from os import environ, path
+
+
+def cache_directory(*names):
+    """ Return the path of a directory for cached pansi data, under the
+    user's cache directory ($XDG_CACHE_HOME, or ~/.cache).
+    """
+    base = environ.get("XDG_CACHE_HOME") or path.join(path.expanduser("~"), ".cache")
+    return path.join(base, "pansi", *names)
+
+
+class LRU:
+    """ Entries held in order of use, each with a size, and with a
+    running total of those sizes, so that the least recently used can
+    be evicted to keep within a budget.
+
+    This is not safe for use from more than one thread without a lock.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()   # key -> (value, size)
+        #: Total size of all entries.
+        self.used = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __iter__(self):
+        # Least recently used first
+        return iter(self._entries)
+
+    def get(self, key, default=None):
+        """ Return the value for a key, marking it as the most recently
+        used, or return the default if there is none.
+        """
+        try:
+            value, _ = self._entries[key]
+        except KeyError:
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def touch(self, key):
+        """ Mark a key as the most recently used, if present.
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+
+    def put(self, key, value, size):
+        """ Add or replace the entry for a key, as the most recently
+        used.
+        """
+        self.pop(key)
+        self._entries[key] = (value, size)
+        self.used += size
+
+    def pop(self, key, default=None):
+        """ Remove the entry for a key, returning its value, or the
+        default if there is none.
+        """
+        try:
+            value, size = self._entries.pop(key)
+        except KeyError:
+            return default
+        self.used -= size
+        return value
+
+    def evict(self, budget):
+        """ Remove the least recently used entries until the total size
+        is within budget, returning the (key, value) pairs removed. The
+        most recently used entry is always kept, even if it alone
+        exceeds the budget.
+        """
+        evicted = []
+        while self.used > budget and len(self._entries) > 1:
+            key, (value, size) = self._entries.popitem(last=False)
+            self.used -= size
+            evicted.append((key, value))
+        return evicted
+
+    def clear(self):
+        """ Remove all entries.
+        """
+        self._entries.clear()
+        self.used = 0
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+# Copyright 2020, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+""" Detection of terminal capabilities.
+
+Every query that pansi needs to make is written to the terminal at
+once, followed by a request for primary device attributes (DA1). All
+terminals answer DA1, and answer queries in order, so once the DA1
+reply arrives, every other reply that is coming has arrived too. A
+probe therefore costs a single round trip, however many queries it
+makes, and its results are cached for each terminal until the window
+is resized.
+"""
+
+
+from os import environ, ttyname
+from re import compile as re_compile
+from signal import SIGWINCH, getsignal, signal
+from sys import stdin, stdout
+
+from pansi import reader
+from pansi.codes import APC, CSI, DCS, ST
+
+
+# A graphics protocol query for a 1x1 image, which terminals without
+# support for the protocol ignore.
+KITTY_QUERY = f"{APC}Gi=31,s=1,v=1,a=q,t=d,f=24;AAAA{ST}"
+
+# Window size in pixels and cell size in pixels (XTWINOPS)
+SIZE_PX_QUERY = f"{CSI}14t"
+CELL_SIZE_QUERY = f"{CSI}16t"
+
+# Save the current SGR state (XTPUSHSGR), set an unusual truecolour
+# foreground, ask for the current SGR state (DECRQSS) and then restore
+# the state saved (XTPOPSGR). Terminals without truecolour support will
+# report something other than the colour set. The reset before the
+# restore means that terminals which cannot save and restore the state
+# are left with the default style, rather than with the colour set.
+TRUECOLOR_QUERY = f"{CSI}#{{{CSI}38;2;1;2;3m{DCS}$qm{ST}{CSI}0m{CSI}#}}"
+
+# Whether synchronized output (mode 2026) is recognised (DECRQM)
+SYNC_QUERY = f"{CSI}?2026$p"
+
+DA1_QUERY = f"{CSI}c"
+
+_KITTY = re_compile(r"\x1b_G([^\x1b]*)\x1b\\")
+_SIZE_PX = re_compile(r"\x1b\[4;(\d+);(\d+)t")
+_CELL_SIZE = re_compile(r"\x1b\[6;(\d+);(\d+)t")
+_DECRQSS = re_compile(r"\x1bP1\$r([^\x1b]*)\x1b\\")
+_SYNC = re_compile(r"\x1b\[\?2026;(\d)\$y")
+_DA1 = re_compile(r"\x1b\[\?([\d;]*)c")
+
+
+class Capabilities:
+    """ Results of a terminal probe.
+    """
+
+    def __init__(self, kitty_graphics=False, device_attributes=(), size_px=None, cell_size=None,
+                 truecolor=False, synchronized_output=False):
+        #: Whether the kitty graphics protocol is supported.
+        self.kitty_graphics = kitty_graphics
+        #: Attributes reported in reply to DA1.
+        self.device_attributes = tuple(device_attributes)
+        #: Size of the window in pixels, as (height, width), if known.
+        self.size_px = size_px
+        #: Size of a character cell in pixels, as (height, width), if known.
+        self.cell_size = cell_size
+        #: Whether 24-bit colour is supported.
+        self.truecolor = truecolor
+        #: Whether synchronized output (mode 2026) is supported.
+        self.synchronized_output = synchronized_output
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(kitty_graphics={self.kitty_graphics!r}, "
+                f"device_attributes={self.device_attributes!r}, size_px={self.size_px!r}, "
+                f"cell_size={self.cell_size!r}, truecolor={self.truecolor!r}, "
+                f"synchronized_output={self.synchronized_output!r})")
+
+    @property
+    def sixel(self):
+        """ Whether sixel graphics are supported.
+        """
+        return "4" in self.device_attributes
+
+    @property
+    def graphics(self):
+        """ The best available pixel graphics support: "kitty",
+        "sixel" or None.
+        """
+        if self.kitty_graphics:
+            return "kitty"
+        elif self.sixel:
+            return "sixel"
+        else:
+            return None
+
+    @classmethod
+    def parse(cls, response):
+        """ Build capabilities from the combined replies to a probe.
+        """
+        kitty = _KITTY.search(response)
+        size_px = _SIZE_PX.search(response)
+        cell_size = _CELL_SIZE.search(response)
+        decrqss = _DECRQSS.search(response)
+        sync = _SYNC.search(response)
+        da1 = _DA1.search(response)
+        truecolor = environ.get("COLORTERM") in ("truecolor", "24bit")
+        if decrqss and not truecolor:
+            # Replies vary in their choice of separators, e.g.
+            # "0;38;2;1;2;3m" or "0;38:2::1:2:3m".
+            truecolor = decrqss.group(1).replace(":", ";").replace(";;", ";").endswith("2;1;2;3m")
+        return cls(kitty_graphics=kitty is not None,
+                   device_attributes=da1.group(1).split(";") if da1 else (),
+                   size_px=tuple(map(int, size_px.groups())) if size_px else None,
+                   cell_size=tuple(map(int, cell_size.groups())) if cell_size else None,
+                   truecolor=truecolor,
+                   # Mode set (1) or reset (2), rather than unknown (0)
+                   # or permanently set or reset (3, 4)
+                   synchronized_output=sync is not None and sync.group(1) in "12")
+
+
+#: All of the queries made by a probe, in one string.
+PROBE_QUERY = "".join([KITTY_QUERY, SIZE_PX_QUERY, CELL_SIZE_QUERY, TRUECOLOR_QUERY, SYNC_QUERY, DA1_QUERY])
+
+
+def is_probe_complete(reply):
+    """ Whether a reply is the one that completes a probe (the reply to
+    DA1).
+    """
+    return _DA1.fullmatch(reply) is not None
+
+
+def probe(cin=stdin, cout=stdout, timeout=None):
+    """ Query the terminal for all of its capabilities at once. If the
+    terminal does not answer in time, it is assumed to support none of
+    them.
+    """
+    replies = reader.query(PROBE_QUERY, is_probe_complete, cin, cout, timeout)
+    return Capabilities.parse("".join(replies or ()))
+
+
+_cache = {}
+
+
+def _tty(cout):
+    try:
+        return ttyname(cout.fileno())
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def capabilities(cin=stdin, cout=stdout):
+    """ Return the capabilities of the terminal connected to the given
+    streams, probing it if they are not already known. Results are
+    kept for each terminal until the next SIGWINCH.
+    """
+    tty = _tty(cout)
+    try:
+        return _cache[tty]
+    except KeyError:
+        _watch_window_size()
+        caps = _cache[tty] = probe(cin, cout)
+        return caps
+
+
+def cached(cout=stdout):
+    """ Return the capabilities already known for the terminal
+    connected to an output stream, or None.
+    """
+    return _cache.get(_tty(cout))
+
+
+def remember(cout, caps):
+    """ Keep the results of a probe made by other means (for example,
+    asynchronously) for the terminal connected to an output stream.
+    """
+    _watch_window_size()
+    _cache[_tty(cout)] = caps
+
+
+def invalidate():
+    """ Forget the capabilities of all terminals.
+    """
+    _cache.clear()
+
+
+_watching = False
+
+
+def _watch_window_size():
+    global _watching
+    if _watching:
+        return
+    try:
+        previous = getsignal(SIGWINCH)
+
+        def on_resize(signum, frame):
+            invalidate()
+            if callable(previous):
+                previous(signum, frame)
+
+        signal(SIGWINCH, on_resize)
+    except ValueError:
+        # Signal handlers can only be set from the main thread; in
+        # other threads, the cache is simply not invalidated.
+        return
+    _watching = True
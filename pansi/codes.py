@@ -215,3 +215,172 @@ strike = CodeSet({
 
 # Reset
 x = sgr(0)
+
+
+# Attribute flags, used for compact storage of text style. Each flag
+# corresponds to one SGR attribute, listed in ATTRS alongside the SGR
+# parameters that switch it on and off.
+BOLD_ATTR = 0x001
+FAINT_ATTR = 0x002
+ITALIC_ATTR = 0x004
+UNDERLINE_ATTR = 0x008
+DOUBLE_UNDERLINE_ATTR = 0x010
+BLINK_ATTR = 0x020
+FAST_BLINK_ATTR = 0x040
+REV_ATTR = 0x080
+STRIKE_ATTR = 0x100
+
+ATTRS = [
+    (BOLD_ATTR, 1, 22),
+    (FAINT_ATTR, 2, 22),
+    (ITALIC_ATTR, 3, 23),
+    (UNDERLINE_ATTR, 4, 24),
+    (DOUBLE_UNDERLINE_ATTR, 21, 24),
+    (BLINK_ATTR, 5, 25),
+    (FAST_BLINK_ATTR, 6, 25),
+    (REV_ATTR, 7, 27),
+    (STRIKE_ATTR, 9, 29),
+]
+
+
+# Packed colour values, used for compact storage of foreground and
+# background colours as single integers. Zero denotes the terminal
+# default colour; otherwise, the top byte flags the colour as either a
+# palette index (0..255) or a 24-bit RGB value in the lower bytes.
+DEFAULT_COLOUR = 0
+INDEXED_COLOUR = 0x1000000
+RGB_COLOUR = 0x2000000
+
+
+def pack_colour(colour):
+    """ Pack a colour, given as None (default), a palette index or an
+    (r, g, b) tuple, into a single integer.
+    """
+    if colour is None:
+        return DEFAULT_COLOUR
+    elif isinstance(colour, int):
+        if 0 <= colour <= 255:
+            return INDEXED_COLOUR | colour
+        else:
+            raise ValueError(f"Palette index {colour!r} out of range")
+    else:
+        r, g, b = colour[:3]
+        return RGB_COLOUR | (r << 16) | (g << 8) | b
+
+
+def colour_params(ground, value):
+    """ Return the SGR parameters that select a packed colour value as
+    either foreground (ground=30) or background (ground=40).
+    """
+    if value & RGB_COLOUR:
+        return ground + 8, 2, (value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF
+    elif value & INDEXED_COLOUR:
+        index = value & 0xFF
+        if index < 8:
+            return ground + index,
+        elif index < 16:
+            return ground + 52 + index,
+        else:
+            return ground + 8, 5, index
+    else:
+        return ground + 9,
+
+
+def style_params(fg=DEFAULT_COLOUR, bg=DEFAULT_COLOUR, attrs=0):
+    """ Return the SGR parameters that select a style, starting from a
+    fully reset state.
+    """
+    params = [on for flag, on, _ in ATTRS if attrs & flag]
+    if fg:
+        params.extend(colour_params(30, fg))
+    if bg:
+        params.extend(colour_params(40, bg))
+    return params
+
+
+class Pen(object):
+    """ Tracker for the current SGR state of a terminal, which can
+    generate the shortest single SGR sequence that will move from
+    that state to any other.
+
+    Colours are held as packed values (see :func:`pack_colour`) and
+    attributes as a combination of attribute flags.
+    """
+
+    def __init__(self):
+        self.fg = DEFAULT_COLOUR
+        self.bg = DEFAULT_COLOUR
+        self.attrs = 0
+        self.known = True
+
+    def invalidate(self):
+        """ Mark the terminal state as unknown, for example after
+        arbitrary text has been written. The next change will start
+        with a full reset.
+        """
+        self.known = False
+
+    def change(self, fg=None, bg=None, attrs=None):
+        """ Move the pen to a new state, returning the SGR sequence
+        required to do so (or an empty string if nothing changes).
+        Any argument passed as None is left as it is.
+        """
+        if fg is None:
+            fg = self.fg
+        if bg is None:
+            bg = self.bg
+        if attrs is None:
+            attrs = self.attrs
+        if self.known:
+            if attrs == self.attrs:
+                if fg == self.fg and bg == self.bg:
+                    return ""
+                elif fg and bg:
+                    # A change of non-default colour alone can never be
+                    # done more cheaply with a reset, so skip the
+                    # comparison for this (very common) case.
+                    params = []
+                    if fg != self.fg:
+                        params.extend(colour_params(30, fg))
+                    if bg != self.bg:
+                        params.extend(colour_params(40, bg))
+                    self.fg = fg
+                    self.bg = bg
+                    return sgr(*params)
+            params = self._transition_params(fg, bg, attrs)
+            reset_params = [0] + style_params(fg, bg, attrs)
+            if len(sgr(*reset_params)) < len(sgr(*params)):
+                params = reset_params
+        else:
+            params = [0] + style_params(fg, bg, attrs)
+        self.fg = fg
+        self.bg = bg
+        self.attrs = attrs
+        self.known = True
+        return sgr(*params)
+
+    def reset(self):
+        """ Move the pen back to the default state.
+        """
+        return self.change(DEFAULT_COLOUR, DEFAULT_COLOUR, 0)
+
+    def _transition_params(self, fg, bg, attrs):
+        removed = self.attrs & ~attrs
+        added = attrs & ~self.attrs
+        params = []
+        off_params = set()
+        for flag, on, off in ATTRS:
+            if removed & flag and off not in off_params:
+                params.append(off)
+                off_params.add(off)
+        for flag, on, off in ATTRS:
+            # Some 'off' parameters cover more than one attribute (e.g.
+            # 22 switches off both bold and faint) so anything that
+            # should stay on may need to be switched back on again.
+            if added & flag or (attrs & flag and off in off_params):
+                params.append(on)
+        if fg != self.fg:
+            params.extend(colour_params(30, fg))
+        if bg != self.bg:
+            params.extend(colour_params(40, bg))
+        return params
@@ -20,13 +20,16 @@ from __future__ import print_function
 
 from logging import getLogger, Formatter, StreamHandler, \
     DEBUG, INFO, WARNING, ERROR, CRITICAL
+from logging.handlers import QueueHandler
 from os.path import expanduser, join, isfile
 from readline import read_history_file, write_history_file
 from sys import stdout
+from threading import Lock, Thread
 
 from pansi import ansi
 from six import PY2
 from six.moves import input
+from six.moves.queue import Queue, Empty, Full
 
 
 class ConsoleLogFormatter(Formatter):
@@ -66,13 +69,125 @@ class ConsoleLogFormatter(Formatter):
             return super(ConsoleLogFormatter, self).format(record)
 
 
+# What to do with a record when the queue of an AsyncLogHandler is full
+DROP = "drop"
+BLOCK = "block"
+
+
+class AsyncLogHandler(QueueHandler):
+    """ Log handler that passes records to a writer thread, so that
+    logging never waits for a slow output stream.
+
+    Records are held in a bounded queue. If the queue is full, a new
+    record is either dropped or waits for space, according to the
+    policy (DROP or BLOCK). The writer thread formats all of the
+    records waiting in the queue (up to `batch_size`) and writes them
+    to the stream at once. Once the handler is closed, records are
+    dropped, whatever the policy.
+
+    As records are formatted later, by the writer thread, any mutable
+    arguments should not be changed after they are logged.
+    """
+
+    terminator = "\n"
+
+    def __init__(self, stream=stdout, capacity=1024, policy=DROP, batch_size=256):
+        if policy not in (DROP, BLOCK):
+            raise ValueError("Unknown policy %r" % (policy,))
+        super(AsyncLogHandler, self).__init__(Queue(capacity))
+        self.stream = stream
+        self.policy = policy
+        self.batch_size = batch_size
+        #: Number of records accepted into the queue.
+        self.queued = 0
+        #: Number of records dropped because the queue was full.
+        self.dropped = 0
+        self.__count_lock = Lock()
+        self.__closed = False
+        self.__thread = Thread(target=self.__write_records, name="pansi-log-writer")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    @property
+    def pending(self):
+        """ Number of records waiting to be written.
+        """
+        return self.queue.qsize()
+
+    def prepare(self, record):
+        # Formatting is left to the writer thread
+        return record
+
+    def enqueue(self, record):
+        block = self.policy == BLOCK
+        while not self.__closed:
+            try:
+                # While waiting, look now and then for the handler
+                # being closed, after which no more space will be made.
+                self.queue.put(record, block, 0.1)
+            except Full:
+                if not block:
+                    break
+            else:
+                with self.__count_lock:
+                    self.queued += 1
+                return
+        with self.__count_lock:
+            self.dropped += 1
+
+    def __write_records(self):
+        done = False
+        while not done:
+            batch = [self.queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except Empty:
+                pass
+            text = []
+            for record in batch:
+                if record is None:
+                    done = True
+                    continue
+                try:
+                    text.append(self.format(record) + self.terminator)
+                except Exception:
+                    self.handleError(record)
+            try:
+                if text:
+                    self.stream.write("".join(text))
+                    self.stream.flush()
+            except Exception:
+                self.handleError(batch[0])
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def flush(self):
+        """ Wait until every record in the queue has been written.
+        """
+        if self.__thread.is_alive():
+            self.queue.join()
+
+    def close(self):
+        """ Write any records in the queue, then stop the writer
+        thread.
+        """
+        self.__closed = True
+        if self.__thread.is_alive():
+            self.queue.put(None)
+            self.__thread.join()
+        super(AsyncLogHandler, self).close()
+
+
 class Console(object):
     """ Basic interactive command line console.
     """
 
     prompt = "{cyan}->{_} ".format(**ansi)
 
-    def __init__(self, name, out=stdout, verbosity=None, history=None, time_format=None):
+    def __init__(self, name, out=stdout, verbosity=None, history=None, time_format=None,
+                 async_log=False, log_capacity=1024, log_policy=DROP):
         self.name = name
         self.__out = out
         self.__history = history or expanduser(join("~", ".%s.history" % name))
@@ -84,7 +199,10 @@ class Console(object):
             self.__formatter = ConsoleLogFormatter("%(message)s")
         else:
             self.__formatter = ConsoleLogFormatter("%(asctime)s  %(message)s", time_format)
-        self.__handler = StreamHandler(self.__out)
+        if async_log:
+            self.__handler = AsyncLogHandler(self.__out, capacity=log_capacity, policy=log_policy)
+        else:
+            self.__handler = StreamHandler(self.__out)
         self.__handler.setFormatter(self.__formatter)
         self.__log = getLogger(self.name)
         self.__log.addHandler(self.__handler)
@@ -97,6 +215,13 @@ class Console(object):
             self.__log.removeHandler(self.__handler)
         except ValueError:
             pass
+        self.__handler.close()
+
+    @property
+    def log_handler(self):
+        """ The handler that writes log records to the console output.
+        """
+        return self.__handler
 
     @property
     def verbosity(self):
@@ -120,6 +245,8 @@ class Console(object):
         sep = kwargs.get("sep", " ")
         end = kwargs.get("end", "\n")
         if self.verbosity >= 0:
+            # Anything already logged goes first
+            self.__handler.flush()
             print(*values, sep=sep, end=end, file=self.__out)
 
     def debug(self, msg, *args, **kwargs):
@@ -163,6 +290,7 @@ class Console(object):
     def exit(self):
         self.__looping = False
         self.__log.removeHandler(self.__handler)
+        self.__handler.close()
 
     def read(self):
         """ Get input.
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+# Copyright 2020, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+""" Support for the kitty terminal graphics protocol.
+
+https://sw.kovidgoyal.net/kitty/graphics-protocol/
+"""
+
+
+from base64 import b64encode
+from hashlib import blake2b
+from io import BytesIO
+from os import environ, ttyname
+from sys import stdout
+from tempfile import NamedTemporaryFile
+from zlib import compress as zlib_compress
+
+from pansi.cache import LRU
+from pansi.codes import APC, ST
+
+
+# Transmission media
+FILE = "file"
+SHARED_MEMORY = "shm"
+DIRECT = "direct"
+
+#: Maximum size of each base64 chunk in a direct transmission.
+CHUNK_SIZE = 4096
+
+
+def command(payload="", **keys):
+    """ Build a single graphics protocol command.
+    """
+    control = ",".join(f"{key}={value}" for key, value in keys.items())
+    if payload:
+        return f"{APC}G{control};{payload}{ST}"
+    else:
+        return f"{APC}G{control}{ST}"
+
+
+def is_local():
+    """ Best guess as to whether the terminal runs on this machine, and
+    so can read files and shared memory that we create.
+    """
+    return not any(key in environ for key in ("SSH_CONNECTION", "SSH_CLIENT", "SSH_TTY"))
+
+
+def raw_data(image):
+    """ Return the raw pixel data for an image, along with the
+    matching format key (24 for RGB, 32 for RGBA).
+    """
+    if image.mode == "RGBA":
+        return image.tobytes(), 32
+    else:
+        return image.convert("RGB").tobytes(), 24
+
+
+def transmit(image, medium=None, compress=None, **keys):
+    """ Build the command (or sequence of commands) that transmits an
+    image to the terminal and, unless other keys say otherwise,
+    displays it at the cursor.
+
+    The medium can be FILE (a PNG in a temporary file), SHARED_MEMORY
+    (raw pixels in a POSIX shared memory object) or DIRECT (raw pixels
+    sent in-band as chunked base64). By default, shared memory is used
+    for a local terminal, and compressed direct transmission is used
+    otherwise. The terminal deletes the temporary file or shared memory
+    object once read.
+    """
+    if medium is None:
+        medium = SHARED_MEMORY if is_local() else DIRECT
+    if compress is None:
+        compress = medium == DIRECT
+    keys.setdefault("a", "T")
+    if medium == FILE:
+        return _transmit_file(image, keys)
+    elif medium == SHARED_MEMORY:
+        return _transmit_shared_memory(image, compress, keys)
+    elif medium == DIRECT:
+        return _transmit_direct(image, compress, keys)
+    else:
+        raise ValueError(f"Unknown transmission medium {medium!r}")
+
+
+def _transmit_file(image, keys):
+    data = BytesIO()
+    image.save(data, format="PNG")
+    # Terminals will only delete temporary files with this string in
+    # their name, which otherwise would be left behind.
+    with NamedTemporaryFile(prefix="pansi-tty-graphics-protocol-", suffix=".png", delete=False) as f:
+        f.write(data.getvalue())
+    payload = b64encode(f.name.encode("utf-8")).decode("ascii")
+    return command(payload, f=100, t="t", **keys)
+
+
+def _transmit_shared_memory(image, compress, keys):
+    from multiprocessing import resource_tracker
+    from multiprocessing.shared_memory import SharedMemory
+    data, fmt = raw_data(image)
+    if compress:
+        data = zlib_compress(data)
+        keys["o"] = "z"
+    shm = SharedMemory(create=True, size=len(data))
+    try:
+        shm.buf[:len(data)] = data
+    finally:
+        shm.close()
+    # The terminal unlinks the object after reading it, so it must not
+    # be cleaned up (or complained about) at exit by this process.
+    resource_tracker.unregister(shm._name, "shared_memory")
+    payload = b64encode(shm._name.encode("utf-8")).decode("ascii")
+    return command(payload, f=fmt, s=image.width, v=image.height, t="s", S=len(data), **keys)
+
+
+def _transmit_direct(image, compress, keys):
+    data, fmt = raw_data(image)
+    if compress:
+        data = zlib_compress(data)
+        keys["o"] = "z"
+    payload = b64encode(data).decode("ascii")
+    chunks = [payload[i:i + CHUNK_SIZE] for i in range(0, len(payload), CHUNK_SIZE)] or [""]
+    last = len(chunks) - 1
+    out = [command(chunks[0], f=fmt, s=image.width, v=image.height, t="d", m=int(last > 0), **keys)]
+    for i in range(1, len(chunks)):
+        out.append(command(chunks[i], m=int(i < last)))
+    return "".join(out)
+
+
+class ImageRegistry:
+    """ Cache of the images held in the memory of a terminal.
+
+    Each distinct image (by content) is transmitted only once, under
+    an image ID assigned by the registry. Showing the same image again
+    only requires a placement command. Once the total size of the
+    images held exceeds the memory budget, the least recently shown
+    images are deleted from the terminal.
+
+    Note that the terminal may also evict images of its own accord, in
+    which case placements of those images will fail silently.
+    """
+
+    #: Default memory budget, in bytes of decoded image data.
+    budget = 256 * 1024 * 1024
+
+    def __init__(self, budget=None, medium=None, compress=None):
+        if budget is not None:
+            self.budget = budget
+        self.medium = medium
+        self.compress = compress
+        self._images = LRU()            # content key -> image id
+        self._next_id = 1
+
+    def __len__(self):
+        return len(self._images)
+
+    def __contains__(self, image):
+        return self.key(image) in self._images
+
+    @property
+    def used(self):
+        return self._images.used
+
+    @classmethod
+    def key(cls, image):
+        digest = blake2b(image.tobytes(), digest_size=16)
+        digest.update(f"{image.mode}:{image.width}x{image.height}".encode("ascii"))
+        return digest.hexdigest()
+
+    def show(self, image, **keys):
+        """ Build the commands required to display an image at the
+        cursor, transmitting it first if the terminal does not already
+        hold a copy.
+        """
+        key = self.key(image)
+        image_id = self._images.get(key)
+        if image_id is None:
+            image_id = self._next_id
+            self._next_id = self._next_id % 0xFFFFFFFF + 1
+            size = image.width * image.height * 4
+            out = [transmit(image, medium=self.medium, compress=self.compress, a="t", i=image_id, q=2)]
+            self._images.put(key, image_id, size)
+            out.extend(command(a="d", d="I", i=evicted_id, q=2)
+                       for _, evicted_id in self._images.evict(self.budget))
+        else:
+            out = []
+        out.append(command(a="p", i=image_id, q=2, **keys))
+        return "".join(out)
+
+    def clear(self):
+        """ Build the command that deletes every image held by the
+        terminal, and forget them all.
+        """
+        self._images.clear()
+        return command(a="d", d="A", q=2)
+
+
+_registries = {}
+
+
+def registry(out=stdout):
+    """ Return the image registry for the terminal connected to the
+    given output stream, creating one if necessary.
+    """
+    try:
+        tty = ttyname(out.fileno())
+    except (AttributeError, OSError, ValueError):
+        tty = None
+    try:
+        return _registries[tty]
+    except KeyError:
+        reg = _registries[tty] = ImageRegistry()
+        return reg
@@ -18,43 +18,60 @@
 
 from argparse import ArgumentParser
 from array import array
-from base64 import b64encode
+from bisect import bisect_left, bisect_right
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 from fcntl import ioctl
+from glob import glob
+from hashlib import blake2b
+from heapq import heappop, heappush
 from io import BytesIO
+from itertools import accumulate
 from math import ceil
-from os import path
-from sys import stdin, stdout
-from termios import TIOCGWINSZ, tcgetattr, TCSADRAIN, tcsetattr
-from tty import setcbreak
-from uuid import uuid4
+from os import makedirs, path, replace, scandir, unlink, utime
+from queue import Queue, Empty, Full
+from sys import getsizeof, stderr, stdin, stdout
+from tempfile import NamedTemporaryFile
+from termios import TIOCGWINSZ
+from threading import Event, Lock, Thread
+from time import monotonic, sleep
 
-from PIL import Image
+from PIL import Image, ImageSequence
 
-from pansi.net import download, URI
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from pansi import graphics, net, palette, reader, sixel
+from pansi.cache import LRU, cache_directory
+from pansi.capabilities import capabilities
+from pansi.codes import Pen, pack_colour, cur, DEFAULT_COLOUR, REV_ATTR
+from pansi.net import download, Stream, URI
 
 
 class Terminal:
 
     @classmethod
-    def query(cls, query, terminator):
-        original_settings = tcgetattr(stdin)
-        try:
-            setcbreak(stdin.fileno())
-            stdout.write(query)
-            stdout.flush()
-            response = []
-            while True:
-                char = stdin.read(1)
-                response.append(char)
-                if char == terminator:
-                    break
-            return "".join(response)
-        finally:
-            tcsetattr(stdin, TCSADRAIN, original_settings)
+    def query(cls, query, terminator, timeout=None):
+        """ Send a query and return the response, up to and including
+        the sequence that ends with the terminator. Returns an empty
+        string if no such response arrives before the timeout.
+        """
+        replies = reader.query(query, lambda reply: reply.endswith(terminator), timeout=timeout)
+        return "".join(replies or ())
 
     @classmethod
     def supports_graphics_protocol(cls):
-        return cls.query("\x1B_Gi=31,s=1,v=1,a=q,t=d,f=24;AAAA\x1B\\\x1B[c", "c").startswith("\x1B_G")
+        return capabilities().kitty_graphics
+
+    @classmethod
+    def graphics_support(cls):
+        """ Detect the best available pixel graphics support, returning
+        "kitty" for the graphics protocol, "sixel" for sixel support
+        (as reported by primary device attributes) or None.
+        """
+        return capabilities().graphics
 
     def __init__(self):
         buf = array('H', [0, 0, 0, 0])
@@ -67,8 +84,10 @@ class Terminal:
             self._get_terminal_pixel_size()
 
     def _get_terminal_pixel_size(self):
-        response = self.query("\x1b[14t", "t")
-        _, self.pixel_height, self.pixel_width = map(int, response[2:-1].split(";"))
+        size_px = capabilities().size_px
+        if size_px is None:
+            raise OSError("Terminal did not report its size in pixels")
+        self.pixel_height, self.pixel_width = size_px
 
     @property
     def cell_width(self):
@@ -102,25 +121,73 @@ class Terminal:
 class TerminalImage:
 
     @classmethod
-    def load(cls, uri):
+    def load(cls, uri, http_cache=None):
+        """ Load an image from a local path or a file or HTTP(S) URI.
+
+        Remote images are loaded through the given
+        :class:`pansi.net.HTTPCache` (by default, the shared one).
+        If `http_cache` is False, they are downloaded every time.
+        """
         if ":" in uri:
             uri = URI.parse(uri)
         else:
             uri = URI(scheme="file", path=path.abspath(uri))
         if uri.scheme == "file":
-            return cls(Image.open(uri.path))
+            return cls(Image.open(uri.path), uri=uri)
         elif uri.scheme in ("http", "https"):
-            return cls(Image.open(download(uri)))
+            if http_cache is None:
+                http_cache = net.http_cache()
+            if http_cache:
+                image, content_key = http_cache.image(uri)
+                loaded = cls(image, uri=uri)
+                loaded._content_key = content_key
+                return loaded
+            # Decode while the body arrives. Only animations need the
+            # data afterwards; for anything else, the connection goes
+            # straight back to the pool.
+            body = download(uri, stream=True)
+            image = Image.open(body)
+            loaded = cls(image, uri=uri)
+            if not getattr(image, "is_animated", False):
+                image.load()
+                loaded._content_key = body.hexdigest()
+                body.close()
+            return loaded
         else:
             raise ValueError(f"Unsupported URI scheme {uri.scheme!r}")
 
     def __init__(self, image, uri=None):
         self.image = image
         self.uri = uri
+        self._content_key = None
 
     def _derived(self, new_image):
         return self.__class__(new_image, uri=self.uri)
 
+    def content_key(self):
+        """ Hash of the image content. Where possible, this is taken
+        from the encoded file data, so that the image need not be
+        decoded.
+        """
+        if self._content_key is None:
+            digest = blake2b(digest_size=16)
+            fp = getattr(self.image, "fp", None)
+            if self.uri is not None and self.uri.scheme == "file":
+                with open(self.uri.path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        digest.update(chunk)
+            elif isinstance(fp, BytesIO):
+                digest.update(fp.getbuffer())
+            elif isinstance(fp, Stream) and not fp.closed:
+                # Already hashed as it arrived
+                self._content_key = fp.hexdigest()
+                return self._content_key
+            else:
+                digest.update(self.image.tobytes())
+                digest.update(f"{self.image.mode}:{self.image.width}x{self.image.height}".encode("ascii"))
+            self._content_key = digest.hexdigest()
+        return self._content_key
+
     @property
     def width(self):
         return self.image.width
@@ -129,44 +196,80 @@ class TerminalImage:
     def height(self):
         return self.image.height
 
-    def print_pixels(self):
-        data = BytesIO()
-        self.image.save(data, format="PNG")
-        # TODO: Windows support
-        filename = f"/tmp/{uuid4()}.png"  # would use mkstemp here, but the mode isn't programmable :/
-        with open(filename, "wb") as f:
-            f.write(data.getvalue())
-        payload = b64encode(filename.encode("utf-8")).decode("ascii")
-        print(f"\x1B_Gf=100,t=t,a=T;{payload}\x1B\\")
-
-    def print_blocks(self, screen):
-        width, height = self.image.size
+    def print_pixels(self, medium=None, compress=None, cache=False):
+        """ Print using the graphics protocol. See
+        :func:`pansi.graphics.transmit` for the available transmission
+        media. If `cache` is set, the image is held by the terminal
+        and only transmitted the first time it is printed.
+        """
+        if cache:
+            print(graphics.registry().show(self.image))
+        else:
+            print(graphics.transmit(self.image, medium=medium, compress=compress))
+
+    def print_sixels(self, dither=False):
+        """ Print as sixel graphics.
+        """
+        print(sixel.encode(self.image, dither=dither))
+
+    def block_size(self, screen, size=None):
+        """ Number of lines and columns taken up by this image (or by
+        an image of the given pixel size) when drawn as blocks.
+        """
+        width, height = size or self.image.size
         lines = int(ceil(height / screen.cell_height))
         cols = int(ceil(width / screen.cell_width))
-        image = BlockImage(self.image, lines=lines, cols=cols)
-        for line in image.ansi_lines():
+        return lines, cols
+
+    def print_blocks(self, screen, depth=palette.TRUECOLOR, dither=None, mode="half", workers=None):
+        """ Print as coloured blocks. If a number of `workers` is given
+        (and the mode is "half"), lines are rendered in parallel by
+        that many worker processes.
+        """
+        if workers and mode == "half":
+            with ParallelRenderer(workers) as renderer:
+                ansi_lines = self.block_lines(screen, depth, dither, mode, renderer)
+        else:
+            ansi_lines = self.block_lines(screen, depth, dither, mode)
+        for line in ansi_lines:
             print(line)
 
+    def block_lines(self, screen, depth=palette.TRUECOLOR, dither=None, mode="half", renderer=None):
+        """ Render as coloured blocks, returning an iterable of lines.
+        Half blocks are rendered by the given :class:`ParallelRenderer`,
+        if any.
+        """
+        lines, cols = self.block_size(screen)
+        if mode == "half":
+            image = BlockImage(self.image, lines=lines, cols=cols, depth=depth, dither=dither)
+            if renderer is not None:
+                return renderer.ansi_lines(image)
+        else:
+            image = SubCellImage(self.image, lines=lines, cols=cols, mode=mode)
+        return image.ansi_lines()
+
     def resize(self, size, resample=None, box=None, reducing_gap=None):
         return self._derived(self.image.resize(size, resample, box, reducing_gap))
 
-    def to_fit(self, terminal, reserved_lines=1):
+    def fit_size(self, terminal, reserved_lines=1):
+        """ Pixel size at which this image fits the terminal. Only the
+        image header is needed to work this out.
+        """
         width, height = self.width, self.height
         aspect_ratio = width / height
         max_height = terminal.pixel_height - (reserved_lines * terminal.cell_height)
-        resize = False
         if height > max_height:
             height = max_height
             width = height * aspect_ratio
-            resize = True
         if width > terminal.pixel_width:
             width = terminal.pixel_width
             height = width / aspect_ratio
-            resize = True
-        if resize:
-            width = int(round(width))
-            height = int(round(height))
-            return self.resize((width, height))
+        return int(round(width)), int(round(height))
+
+    def to_fit(self, terminal, reserved_lines=1):
+        size = self.fit_size(terminal, reserved_lines)
+        if size != self.image.size:
+            return self.resize(size)
         else:
             return self
 
@@ -192,29 +295,143 @@ class Fragment:
             self.ch[:] = ()
             self.fg = self.bg = None
 
+
+def slice_fragments(fragments, start, end, ends=None):
+    """ Cut a line of fragments down to the cells from column 'start'
+    up to (but not including) column 'end'. Every cell in a fragment
+    is drawn with the same pair of colours, so fragments can be split
+    at any point. If known, the running totals of fragment lengths can
+    be passed as 'ends', to save walking the line.
+    """
+    if ends is None:
+        ends = list(accumulate(len(text) for text, _, _ in fragments))
+    if not fragments or (start <= 0 and end >= ends[-1]):
+        return fragments
+    if start >= end:
+        return []
+    first = bisect_right(ends, start)
+    last = bisect_left(ends, end, first)
+    sliced = fragments[first:last + 1]
+    if sliced:
+        text, fg, bg = sliced[0]
+        x = ends[first] - len(text)
+        if x < start:
+            sliced[0] = (text[start - x:], fg, bg)
+        text, fg, bg = sliced[-1]
+        if ends[last if last < len(ends) else -1] > end:
+            x = ends[last] - len(text)
+            sliced[-1] = (text[:end - x], fg, bg)
+    return sliced
+
+
+class LineCache:
+    """ Least recently used cache of line fragments, bounded by an
+    estimate of the memory that those fragments occupy. Safe for use
+    from more than one thread.
+    """
+
+    # Approximate size of a fragment tuple and its colour tuples, not
+    # counting the text itself.
+    fragment_overhead = 200
+
+    def __init__(self, budget):
+        self.budget = budget
+        self._lines = LRU()             # key -> (fragments, ends)
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._lines)
+
+    def __contains__(self, key):
+        return key in self._lines
+
+    @property
+    def used(self):
+        return self._lines.used
+
     @classmethod
-    def to_ansi_text(cls, frag):
-        text, fg, bg = frag
-        style = []
-        if fg:
-            style.append(f"\x1b[38;2;{fg[0]};{fg[1]};{fg[2]}m")
-        if bg:
-            style.append(f"\x1b[48;2;{bg[0]};{bg[1]};{bg[2]}m")
-        return "".join(style) + text
+    def size_of(cls, fragments):
+        return sum(getsizeof(text) + cls.fragment_overhead for text, _, _ in fragments)
+
+    def get(self, key):
+        """ Return the fragments cached for a key, along with the
+        running totals of their lengths, or (None, None) if there are
+        none.
+        """
+        with self._lock:
+            return self._lines.get(key, (None, None))
+
+    def put(self, key, fragments):
+        """ Cache the fragments for a key, returning the running totals
+        of their lengths.
+        """
+        ends = list(accumulate(len(text) for text, _, _ in fragments))
+        size = self.size_of(fragments) + getsizeof(ends)
+        with self._lock:
+            self._lines.put(key, (fragments, ends), size)
+            self._lines.evict(self.budget)
+        return ends
+
+    def clear(self):
+        with self._lock:
+            self._lines.clear()
 
 
 class BlockImage:
 
     blocks_per_char = 2
 
-    def __init__(self, image, lines, cols):
+    #: Whether to use NumPy (if installed) to generate lines.
+    use_numpy = True
+
+    #: Default memory budget for cached line fragments, in bytes.
+    cache_budget = 16 * 1024 * 1024
+
+    #: Number of lines either side of the viewport to render in the
+    #: background after each scroll or zoom.
+    prefetch_lines = 8
+
+    def __init__(self, image, lines, cols, use_numpy=None, depth=palette.TRUECOLOR, dither=None,
+                 cache_budget=None):
+        self.depth = depth
+        self.dither = dither
+        if use_numpy is None:
+            use_numpy = self.use_numpy
+        self._use_numpy = use_numpy and numpy is not None
+        self._source = image
+        self._base_size = (lines, cols)
+        self.scale = 1
+        self._offset = (0, 0)
+        self._fragments = LineCache(self.cache_budget if cache_budget is None else cache_budget)
+        self._lock = Lock()
+        self._prefetcher = None
+        self._prefetching = None
+        self._load(lines, cols)
+        #: Size of the visible area, as (lines, cols).
+        self.view = (self.lines, self.width)
+
+    def _load(self, lines, cols):
         self.lines = int(ceil(lines))
         self.width = cols
         self.height = self.blocks_per_char * lines
-        self.pixels = image.resize((self.width, self.height)).getdata()
+        resized = self._source.resize((self.width, self.height))
+        if resized.mode not in ("RGB", "RGBA"):
+            # Pixels are read as colour triples (or quadruples)
+            resized = resized.convert("RGB")
+        if self.depth == palette.TRUECOLOR:
+            self._colours = None
+        else:
+            # Reducing colours before working out fragments, rather
+            # than after, also means that more neighbouring cells share
+            # colours, so fragments are longer and output is shorter.
+            resized, self._colours = palette.reduce(resized, self.depth, self.dither)
+        self._image = resized
+        self.pixels = resized.getdata()
         self.line_numbers = range(int(ceil(self.lines)))
-        self._offset = (0, 0)
-        self._fragments = {}
+        if self._use_numpy:
+            self._init_arrays(resized)
+        else:
+            self._array = None
 
     @property
     def offset(self):
@@ -222,33 +439,204 @@ class BlockImage:
 
     @offset.setter
     def offset(self, value):
-        new_x, new_y = value
-        old_x, old_y = self._offset
-        if new_x != old_x:
-            self._fragments.clear()
-        self._offset = (new_x, new_y)
+        # Cached lines always span the full width of the image, so
+        # moving in either direction leaves them valid.
+        self._offset = tuple(value)
+
+    def scroll_to(self, x, y):
+        """ Move the top left corner of the viewport to cell (x, y),
+        keeping the viewport within the bounds of the image, and start
+        rendering the lines around it in the background.
+        """
+        view_lines, view_cols = self.view
+        x = max(0, min(x, self.width - view_cols))
+        y = max(0, min(y, self.lines - view_lines))
+        self._offset = (x, y)
+        self.prefetch()
+
+    def pan(self, dx=0, dy=0):
+        """ Move the viewport by a number of cells in each direction.
+        """
+        x, y = self._offset
+        self.scroll_to(x + dx, y + dy)
+
+    def zoom(self, scale):
+        """ Resample the image at a scale relative to its original
+        size, keeping the same point at the centre of the viewport.
+        Lines cached at other scales are kept, subject to the memory
+        budget, so zooming back out is cheap.
+        """
+        view_lines, view_cols = self.view
+        x, y = self._offset
+        centre_x = (x + view_cols / 2) / self.width
+        centre_y = (y + view_lines / 2) / self.lines
+        base_lines, base_cols = self._base_size
+        with self._lock:
+            self.scale = scale
+            self._load(max(1, round(base_lines * scale)), max(1, round(base_cols * scale)))
+        self.scroll_to(round(centre_x * self.width - view_cols / 2),
+                       round(centre_y * self.lines - view_lines / 2))
+
+    def prefetch(self, lines=None):
+        """ Render, on a worker thread, those lines just above and
+        below the viewport that are not already cached, nearest first.
+        Any prefetch still waiting to start is cancelled. Returns a
+        future for the new prefetch, or None if there is nothing to do.
+        """
+        if lines is None:
+            lines = self.prefetch_lines
+        top = self._offset[1]
+        bottom = top + self.view[0]
+        wanted = []
+        for n in range(lines):
+            wanted.extend(line_no for line_no in (bottom + n, top - 1 - n)
+                          if line_no in self.line_numbers and self._key(line_no) not in self._fragments)
+        if self._prefetching is not None:
+            self._prefetching.cancel()
+        if not wanted:
+            self._prefetching = None
+            return None
+        if self._prefetcher is None:
+            self._prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pansi-prefetch")
+        self._prefetching = self._prefetcher.submit(self._fill, (self.width, self.height), wanted)
+        return self._prefetching
+
+    def _fill(self, size, line_nos):
+        for line_no in line_nos:
+            # The lock keeps a zoom from swapping out the pixel data
+            # while a line is being worked out.
+            with self._lock:
+                if (self.width, self.height) != size:
+                    return
+                key = self._key(line_no)
+                if key not in self._fragments:
+                    self._fragments.put(key, self._create_line_fragments(line_no))
+
+    def close(self):
+        """ Stop the prefetch worker, if any.
+        """
+        if self._prefetching is not None:
+            self._prefetching.cancel()
+        if self._prefetcher is not None:
+            self._prefetcher.shutdown(wait=True)
+            self._prefetcher = self._prefetching = None
 
     def ansi_lines(self):
-        for line_no in self.line_numbers:
-            yield "".join(map(Fragment.to_ansi_text, self._get_line(line_no))) + "\x1b[0m"
+        for n in range(self.view[0]):
+            yield self._encode_line(self._get_line(n))
+
+    def _encode_line(self, fragments, pen=None):
+        # Unless a pen is passed in, each line starts from, and is
+        # returned to, the default pen state; in between, only those
+        # grounds that change from one fragment to the next are
+        # emitted. A fragment with no bg (or fg) doesn't care about
+        # that ground, so it is left as is.
+        reset = pen is None
+        if reset:
+            pen = Pen()
+        colours = self._colours
+        out = []
+        for text, fg, bg in fragments:
+            if colours is None:
+                out.append(pen.change(fg=pack_colour(fg) if fg else None,
+                                      bg=pack_colour(bg) if bg else None))
+            elif self.depth == palette.MONO:
+                # Draw 'on' pixels in the default foreground colour and
+                # 'off' pixels in the default background colour, using
+                # reverse video when the fragment foreground is 'off'.
+                out.append(pen.change(fg=DEFAULT_COLOUR, bg=DEFAULT_COLOUR,
+                                      attrs=0 if colours[fg[:3]] else REV_ATTR))
+            else:
+                out.append(pen.change(fg=pack_colour(colours[fg[:3]]) if fg else None,
+                                      bg=pack_colour(colours[bg[:3]]) if bg else None))
+            out.append(text)
+        if reset:
+            out.append("\x1b[0m")
+        return "".join(out)
+
+    def changed_cells(self, previous, max_gap=0):
+        """ Generate (line, start, end) column ranges covering the cells
+        whose colours differ from those of a previous image of the same
+        size. Unchanged gaps of up to `max_gap` cells are absorbed into
+        the surrounding range.
+        """
+        if self._array is not None and previous._array is not None:
+            changed = ((self._top_keys != previous._top_keys) |
+                       (self._bottom_keys != previous._bottom_keys))
+            rows = [numpy.flatnonzero(changed[line_no]).tolist() for line_no in self.line_numbers]
+        else:
+            rows = []
+            step = self.blocks_per_char * self.width
+            lower = (self.blocks_per_char - 1) * self.width
+            for line_no in self.line_numbers:
+                hi = step * line_no
+                lo = hi + lower
+                rows.append([col for col in range(self.width)
+                             if self.pixels[hi + col] != previous.pixels[hi + col] or
+                             self.pixels[lo + col] != previous.pixels[lo + col]])
+        for line_no, cols in enumerate(rows):
+            start = end = None
+            for col in cols:
+                if start is None:
+                    start = col
+                elif col - end > max_gap:
+                    yield line_no, start, end
+                    start = col
+                end = col + 1
+            if start is not None:
+                yield line_no, start, end
+
+    def _key(self, line_no):
+        # Lines are cached against the scaled size of the image too,
+        # so that a zoom cannot pick up lines from another scale.
+        return self.width, self.height, line_no
 
     def _get_line(self, n):
         line_no = n + self._offset[1]  # convert relative line number 'n' to real line number
         if line_no in self.line_numbers:
-            try:
-                value = self._fragments[line_no]
-            except KeyError:
-                value = self._fragments[line_no] = self._create_line_fragments(line_no)
-            return value
+            key = self._key(line_no)
+            fragments, ends = self._fragments.get(key)
+            if fragments is None:
+                fragments = self._create_line_fragments(line_no)
+                ends = self._fragments.put(key, fragments)
+            x = self._offset[0]
+            return slice_fragments(fragments, x, x + self.view[1], ends)
         else:
             return []
 
-    def _create_line_fragments(self, line_no):
-        hi = self.blocks_per_char * self.width * line_no + self._offset[0]
+    def _init_arrays(self, image):
+        # Pack each pixel into a single integer key, split the keys
+        # into top and bottom rows, and mark every cell at which the
+        # (top, bottom) pair differs from that of the cell before it.
+        # Each line can then be processed as a series of runs of
+        # identical cells, rather than one cell at a time.
+        a = numpy.asarray(image)
+        if a.ndim == 2:
+            a = a[:, :, numpy.newaxis]
+        keys = numpy.zeros(a.shape[:2], dtype=numpy.uint64)
+        for channel in range(a.shape[2]):
+            keys |= a[:, :, channel].astype(numpy.uint64) << numpy.uint64(8 * channel)
+        self._array = a
+        self._top_keys = keys[0::2]
+        self._bottom_keys = keys[1::2]
+        self._breaks = numpy.zeros(self._top_keys.shape, dtype=bool)
+        self._breaks[:, 1:] = ((self._top_keys[:, 1:] != self._top_keys[:, :-1]) |
+                               (self._bottom_keys[:, 1:] != self._bottom_keys[:, :-1]))
+
+    def _create_line_fragments(self, line_no, start=None, end=None):
+        # Cells are taken from columns 'start' to 'end', defaulting to
+        # the full width of the image.
+        if start is None:
+            start = 0
+        if end is None:
+            end = self.width
+        if self._array is not None:
+            return self._create_line_fragments_from_arrays(line_no, start, end)
+        hi = self.blocks_per_char * self.width * line_no
         lo = hi + ((self.blocks_per_char - 1) * self.width)
         fragments = []
         frag = Fragment()
-        for offset in range(self.width - self._offset[0]):
+        for offset in range(start, end):
             c0 = self.pixels[hi + offset]   # colour of top pixel
             c1 = self.pixels[lo + offset]   # colour of bottom pixel
             if frag.fg is None:
@@ -291,25 +679,961 @@ class BlockImage:
             fragments.append(trailing)
         return fragments
 
+    def _create_line_fragments_from_arrays(self, line_no, x0, x1):
+        # This follows the same palette state machine as the pure
+        # Python version above, but works on runs of identical cells
+        # and compares packed integer keys instead of colour tuples.
+        # Repeats of a cell never break a fragment, and always produce
+        # the same character as the first cell in the run.
+        if x0 >= x1:
+            return []
+        breaks = self._breaks[line_no, x0:x1].copy()
+        breaks[0] = True
+        starts = numpy.flatnonzero(breaks)
+        lengths = numpy.diff(numpy.append(starts, len(breaks))).tolist()
+        top_keys = self._top_keys[line_no, x0:x1][starts].tolist()
+        bottom_keys = self._bottom_keys[line_no, x0:x1][starts].tolist()
+        row = self.blocks_per_char * line_no
+        top_colours = self._array[row, x0:x1][starts].tolist()
+        bottom_colours = self._array[row + self.blocks_per_char - 1, x0:x1][starts].tolist()
+        fragments = []
+        text = []
+        fg = bg = None              # packed keys of the fragment palette
+        fg_colour = bg_colour = None
+        for n, c0, c1, rgb0, rgb1 in zip(lengths, top_keys, bottom_keys, top_colours, bottom_colours):
+            if fg is None:
+                # palette contains zero colours
+                if c0 == c1:
+                    ch = "█"
+                    fg, fg_colour = c0, rgb0
+                else:
+                    ch = "▀"
+                    fg, fg_colour, bg, bg_colour = c0, rgb0, c1, rgb1
+            elif bg is None:
+                # palette contains one colour
+                if c0 == c1 == fg:
+                    ch = "█"
+                elif c0 == fg:
+                    ch = "▀"
+                    bg, bg_colour = c1, rgb1
+                elif c1 == fg:
+                    ch = "▄"
+                    bg, bg_colour = c0, rgb0
+                elif c0 == c1:
+                    ch = " "
+                    bg, bg_colour = c0, rgb0
+                else:
+                    fragments.append(("".join(text), tuple(fg_colour), None))
+                    text = []
+                    ch = "▀"
+                    fg, fg_colour, bg, bg_colour = c0, rgb0, c1, rgb1
+            else:
+                # palette contains two colours
+                if c0 == c1 == fg:
+                    ch = "█"
+                elif c0 == fg and c1 == bg:
+                    ch = "▀"
+                elif c1 == fg and c0 == bg:
+                    ch = "▄"
+                elif c0 == c1 == bg:
+                    ch = " "
+                else:
+                    fragments.append(("".join(text), tuple(fg_colour), tuple(bg_colour)))
+                    text = []
+                    bg = bg_colour = None
+                    if c0 == c1:
+                        ch = "█"
+                        fg, fg_colour = c0, rgb0
+                    else:
+                        ch = "▀"
+                        fg, fg_colour, bg, bg_colour = c0, rgb0, c1, rgb1
+            text.append(ch * n)
+        if text:
+            fragments.append(("".join(text), tuple(fg_colour), bg_colour and tuple(bg_colour)))
+        return fragments
+
+
+class ParallelRenderer:
+    """ Renders block images across a pool of worker processes.
+
+    Each image is cut into bands of lines, which are rendered by the
+    workers in parallel. Rather than being pickled for each band, the
+    (resized and colour reduced) pixels of each image are placed in a
+    shared memory object, from which each worker reads just the rows
+    of its own band. Lines come back in their original order.
+    """
+
+    #: Number of lines in each band handed to a worker.
+    band_lines = 32
+
+    def __init__(self, workers=None, band_lines=None):
+        from concurrent.futures import ProcessPoolExecutor
+        self.workers = workers
+        if band_lines is not None:
+            self.band_lines = band_lines
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def ansi_lines(self, block_image):
+        """ Return all lines of a block image, rendered in parallel.
+        """
+        for lines in self.render([block_image]):
+            return lines
+
+    def render(self, block_images):
+        """ Generate a list of lines for each of a number of block
+        images, in order. Bands from all of the images are queued
+        together, so that workers are kept busy across images.
+        """
+        from multiprocessing.shared_memory import SharedMemory
+        shared = []
+        jobs = []
+        try:
+            for block_image in block_images:
+                image = block_image._image
+                data = image.tobytes()
+                palette_data = image.getpalette()
+                shm = SharedMemory(create=True, size=max(len(data), 1))
+                shm.buf[:len(data)] = data
+                shared.append(shm)
+                # Bytes per row, which need not be a whole number of
+                # bytes per pixel (e.g. mode "1")
+                stride = len(data) // image.height if image.height else 0
+                bands = []
+                for top in range(0, block_image.lines, self.band_lines):
+                    bottom = min(top + self.band_lines, block_image.lines)
+                    bands.append(self._executor.submit(
+                        _render_band, shm.name, image.mode, palette_data, image.width, stride, top, bottom,
+                        block_image.blocks_per_char, block_image.depth, block_image._use_numpy))
+                jobs.append(bands)
+            for bands in jobs:
+                yield [line for band in bands for line in band.result()]
+        finally:
+            for band in (band for bands in jobs for band in bands):
+                band.cancel()
+            for shm in shared:
+                shm.close()
+                shm.unlink()
+
+
+def _render_band(name, mode, palette_data, width, stride, top, bottom, blocks_per_char, depth, use_numpy):
+    # Runs in a worker process. Only the rows for this band are copied
+    # out of shared memory. The pixels are already at their final size
+    # and colours, so building the block image resamples nothing.
+    from multiprocessing.shared_memory import SharedMemory
+    # Worker processes share the parent's resource tracker, which is
+    # told when the parent unlinks the object.
+    shm = SharedMemory(name=name)
+    try:
+        rows = blocks_per_char * (bottom - top)
+        start = stride * blocks_per_char * top
+        data = bytes(shm.buf[start:start + stride * rows])
+    finally:
+        shm.close()
+    image = Image.frombytes(mode, (width, rows), data)
+    if palette_data:
+        image.putpalette(palette_data)
+    block_image = BlockImage(image, lines=bottom - top, cols=width, use_numpy=use_numpy)
+    if depth != palette.TRUECOLOR:
+        # Quantizing is not quite idempotent, so rather than reducing
+        # again, only the lookup of palette indexes is restored.
+        block_image.depth = depth
+        block_image._colours = palette.palette(depth)
+    return list(block_image.ansi_lines())
+
+
+# Glyphs for each 2x2 quadrant pattern, with bits set (from least
+# significant) for top left, top right, bottom left and bottom right.
+QUADRANT_GLYPHS = " ▘▝▀▖▌▞▛▗▚▐▜▄▙▟█"
+
+# Glyphs for each 2x3 sextant pattern, with bits set (from least
+# significant) for top left, top right, middle left, middle right,
+# bottom left and bottom right. Unicode encodes the sextants in order,
+# except for those that already exist as block elements.
+SEXTANT_GLYPHS = "".join(
+    {0: " ", 21: "▌", 42: "▐", 63: "█"}.get(p) or chr(0x1FB00 + p - 1 - (p > 21) - (p > 42))
+    for p in range(64))
+
+
+class SubCellImage:
+    """ Image drawn using sub-cell block glyphs: either 2x2 quadrants
+    or 2x3 sextants per character cell.
+
+    Each cell can only show two colours, so the pixels of each cell are
+    split into the two groups that minimise the total squared colour
+    error, with each group drawn in its mean colour. This is done for
+    every cell at once by testing all possible splits with NumPy.
+    """
+
+    modes = {
+        "quadrant": (2, 2, QUADRANT_GLYPHS),
+        "sextant": (2, 3, SEXTANT_GLYPHS),
+    }
+
+    def __init__(self, image, lines, cols, mode="quadrant"):
+        if numpy is None:
+            raise ImportError("Sub-cell rendering requires NumPy")
+        self.lines = int(ceil(lines))
+        self.width = cols
+        self.mode = mode
+        cell_width, cell_height, self.glyphs = self.modes[mode]
+        resized = image.convert("RGB").resize((cols * cell_width, self.lines * cell_height))
+        # Rearrange pixels into (line, col, pixel, channel) order, with
+        # the pixels of each cell in glyph bit order
+        a = numpy.asarray(resized, dtype=numpy.float64)
+        a = a.reshape(self.lines, cell_height, cols, cell_width, 3).transpose(0, 2, 1, 3, 4)
+        self._cells = a.reshape(self.lines, cols, cell_width * cell_height, 3)
+        self.line_numbers = range(self.lines)
+        self._patterns, self._fg, self._bg = self._split(self._cells)
+
+    @classmethod
+    def _split(cls, cells):
+        n = cells.shape[2]
+        # Every split of n pixels into two groups, with the first pixel
+        # always in the foreground group to avoid testing each twice.
+        # The solid pattern goes first, so that it wins any ties.
+        patterns = numpy.arange(2 ** (n - 1))[::-1] * 2 + 1
+        masks = ((patterns[:, numpy.newaxis] >> numpy.arange(n)) & 1).astype(numpy.float64)
+        fg_counts = masks.sum(axis=1)                           # (P,)
+        bg_counts = n - fg_counts
+        totals = cells.sum(axis=2)                              # (L, C, 3)
+        fg_sums = numpy.einsum("pn,lcnk->lcpk", masks, cells)   # (L, C, P, 3)
+        bg_sums = totals[:, :, numpy.newaxis, :] - fg_sums
+        # Total error is the sum of squares less what each group's mean
+        # accounts for; the sum of squares is the same for every split,
+        # so only the second part needs comparing.
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            explained = ((fg_sums ** 2).sum(axis=3) / fg_counts +
+                         numpy.where(bg_counts > 0, (bg_sums ** 2).sum(axis=3) / bg_counts, 0))
+        best = explained.argmax(axis=2)                         # (L, C)
+        chosen = best[:, :, numpy.newaxis, numpy.newaxis]
+        fg = numpy.take_along_axis(fg_sums, chosen, axis=2)[:, :, 0] / fg_counts[best][:, :, numpy.newaxis]
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            bg = numpy.take_along_axis(bg_sums, chosen, axis=2)[:, :, 0] / bg_counts[best][:, :, numpy.newaxis]
+        full = bg_counts[best] == 0
+        bg[full] = -1
+        return patterns[best], numpy.rint(fg).astype(int), numpy.rint(numpy.nan_to_num(bg, nan=-1)).astype(int)
+
+    def ansi_lines(self):
+        for line_no in self.line_numbers:
+            yield self._encode_line(line_no)
+
+    def _encode_line(self, line_no):
+        pen = Pen()
+        out = []
+        glyphs = self.glyphs
+        patterns = self._patterns[line_no].tolist()
+        fgs = self._fg[line_no].tolist()
+        bgs = self._bg[line_no].tolist()
+        for pattern, fg, bg in zip(patterns, fgs, bgs):
+            if bg[0] < 0:
+                # Solid cell, so the background colour doesn't matter
+                out.append(pen.change(fg=pack_colour(fg)))
+            else:
+                out.append(pen.change(fg=pack_colour(fg), bg=pack_colour(bg)))
+            out.append(glyphs[pattern])
+        out.append("\x1b[0m")
+        return "".join(out)
+
+
+class BlockDelta:
+    """ Encoder for a sequence of equally-sized block images, which
+    emits only the cells that have changed since the previous frame.
+
+    The first frame (and any frame of a different size) is drawn in
+    full. After that, each changed run of cells is drawn after moving
+    the cursor there directly. If an origin (1-based row and column) is
+    given, moves are absolute; otherwise, the image is assumed to start
+    in column 1 and vertical moves are made relative to the last line
+    of the image, where the cursor is left after every frame.
+    """
+
+    #: Longest run of unchanged cells that will be rewritten rather
+    #: than skipped over with a cursor movement.
+    max_gap = 3
+
+    def __init__(self, origin=None):
+        self.origin = origin
+        self.previous = None
+
+    def encode(self, block_image):
+        previous = self.previous
+        self.previous = block_image
+        if (previous is None or previous.lines != block_image.lines or
+                previous.width != block_image.width):
+            return self._encode_full(block_image, previous)
+        last = block_image.lines - 1
+        pen = Pen()
+        out = []
+        row = last
+        for line_no, start, end in block_image.changed_cells(previous, self.max_gap):
+            if self.origin:
+                out.append(cur.pos(self.origin[0] + line_no, self.origin[1] + start))
+            else:
+                if line_no < row:
+                    out.append(cur.up(row - line_no))
+                elif line_no > row:
+                    out.append(cur.down(line_no - row))
+                out.append(cur.hpos(start + 1))
+            row = line_no
+            out.append(block_image._encode_line(block_image._create_line_fragments(line_no, start, end), pen))
+        if out:
+            out.append(pen.reset())
+            if row != last:
+                if self.origin:
+                    out.append(cur.pos(self.origin[0] + last, self.origin[1] + block_image.width))
+                else:
+                    out.append(cur.down(last - row))
+        return "".join(out)
+
+    def _encode_full(self, block_image, previous=None):
+        if self.origin:
+            row, col = self.origin
+            return "".join(cur.pos(row + line_no, col) + line
+                           for line_no, line in enumerate(block_image.ansi_lines()))
+        elif previous is None:
+            return "\n".join(block_image.ansi_lines())
+        else:
+            home = cur.prevln(previous.lines - 1) if previous.lines > 1 else "\r"
+            return home + "\n".join(block_image.ansi_lines())
+
+
+# Marks a frame not yet taken from the decoding queue
+_PENDING = object()
+
+
+class Player:
+    """ Player for animated images and other frame sequences.
+
+    Frames are decoded and rendered ahead of time on a background
+    thread, and shown at the times given by their durations. If the
+    player falls behind the clock, a frame is dropped when the one
+    after it is already decoded and due. If decoding itself falls
+    behind, every frame is shown, as soon as it is ready. Each frame
+    is drawn over the last by moving the cursor back up to the top of
+    the image, rather than by scrolling.
+
+    If an `encode` function is given, it is called on each rendered
+    frame at the time of showing, and is responsible for positioning
+    the cursor itself.
+    """
+
+    #: Maximum number of frames decoded ahead of the one on screen.
+    buffer_frames = 8
+
+    #: Frame duration (in milliseconds) used when none is given.
+    default_duration = 100
+
+    @classmethod
+    def open(cls, image, lines, cols, loop=False, delta=False, **kwargs):
+        """ Create a player for an animated image (e.g. GIF, APNG or
+        WebP), scaling each frame to the given number of lines and
+        columns. With `delta` set, only the cells that change from one
+        frame to the next are redrawn.
+        """
+
+        def frames():
+            while True:
+                for frame in ImageSequence.Iterator(image):
+                    duration = frame.info.get("duration") or cls.default_duration
+                    yield frame.convert("RGB"), duration
+                if not loop:
+                    break
+
+        if delta:
+            # Deltas depend on which frame was shown last, so they can
+            # only be encoded at the time of showing.
+            def render(frame):
+                return BlockImage(frame, lines=lines, cols=cols)
+
+            kwargs["encode"] = BlockDelta().encode
+        else:
+            def render(frame):
+                return "\n".join(BlockImage(frame, lines=lines, cols=cols).ansi_lines())
+
+        return cls(frames(), render, **kwargs)
+
+    def __init__(self, frames, render, encode=None, out=stdout, clock=monotonic, sleep=sleep):
+        self.frames = frames
+        self.render = render
+        self.encode = encode
+        self.out = out
+        self.clock = clock
+        self.sleep = sleep
+        self.frames_shown = 0
+        self.frames_dropped = 0
+        self.elapsed = 0.0
+        self._queue = Queue(self.buffer_frames)
+        self._stopped = Event()
+
+    @property
+    def fps(self):
+        """ Achieved frame rate, counting only frames actually shown.
+        """
+        if self.elapsed:
+            return self.frames_shown / self.elapsed
+        else:
+            return 0.0
+
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+            except Full:
+                continue
+            else:
+                return True
+        return False
+
+    def _decode(self):
+        try:
+            for frame, duration in self.frames:
+                if not self._put((self.render(frame), duration / 1000)):
+                    return
+        finally:
+            self._put(None)
+
+    def _next(self):
+        while True:
+            try:
+                return self._queue.get(timeout=0.1)
+            except Empty:
+                if self._stopped.is_set():
+                    return None
+
+    def play(self):
+        """ Play all frames, returning once the last has been shown
+        for its full duration (or on KeyboardInterrupt).
+        """
+        decoder = Thread(target=self._decode, daemon=True)
+        decoder.start()
+        start = self.clock()
+        due = start
+        height = None
+        try:
+            item = self._next()
+            while item is not None:
+                rendered, duration = item
+                following = _PENDING
+                now = self.clock()
+                if now >= due + duration:
+                    try:
+                        following = self._queue.get_nowait()
+                    except Empty:
+                        pass
+                if following is not _PENDING and following is not None:
+                    # The next frame is ready and already due, so skip
+                    # this one
+                    self.frames_dropped += 1
+                else:
+                    if now < due:
+                        self.sleep(due - now)
+                    if self.encode:
+                        # The encoder takes care of cursor positioning
+                        self.out.write(self.encode(rendered))
+                        height = 1
+                    else:
+                        if height:
+                            self.out.write(cur.prevln(height - 1) if height > 1 else "\r")
+                        self.out.write(rendered)
+                        height = rendered.count("\n") + 1
+                    self.out.flush()
+                    self.frames_shown += 1
+                due += duration
+                item = self._next() if following is _PENDING else following
+            now = self.clock()
+            if now < due:
+                self.sleep(due - now)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._stopped.set()
+            self.elapsed = self.clock() - start
+            if height:
+                self.out.write("\n")
+                self.out.flush()
+
+
+def _raw_row_reader(image):
+    # If an (unloaded) image is stored as uncompressed rows, as in PPM,
+    # BMP and uncompressed TIFF files (in one strip or several, or in
+    # tiles), return a function that reads a range of rows straight
+    # from the file as an image strip. Otherwise, return None.
+    tiles = getattr(image, "tile", None)
+    if not tiles or getattr(image, "fp", None) is None or image.mode not in ("L", "RGB", "RGBA"):
+        return None
+    width, height = image.size
+    raw = []
+    for codec, extents, offset, args in tiles:
+        if codec != "raw":
+            return None
+        x0, y0, x1, y1 = extents
+        if isinstance(args, str):
+            args = (args,)
+        rawmode, stride, orientation = (tuple(args) + (0, 1))[:3]
+        if not stride:
+            stride = len(Image.new(image.mode, (x1 - x0, 1)).tobytes("raw", rawmode))
+        raw.append(((x0, y0, x1, y1), offset, rawmode, stride, orientation))
+    # Tiles must cover the image exactly once
+    if sum((x1 - x0) * (y1 - y0) for (x0, y0, x1, y1), *_ in raw) != width * height:
+        return None
+
+    def read(top, bottom):
+        strip = Image.new(image.mode, (width, bottom - top))
+        for (x0, y0, x1, y1), offset, rawmode, stride, orientation in raw:
+            first = max(top, y0)
+            last = min(bottom, y1)
+            if first >= last:
+                continue
+            # Bottom-up tiles store their last row first
+            start = y1 - last if orientation < 0 else first - y0
+            image.fp.seek(offset + start * stride)
+            data = image.fp.read((last - first) * stride)
+            strip.paste(Image.frombytes(image.mode, (x1 - x0, last - first), data, "raw",
+                                        rawmode, stride, orientation), (x0, first - top))
+        return strip
+
+    return read
+
+
+def stream_block_lines(image, cols, lines=None, strip_lines=16, **kwargs):
+    """ Generate the ANSI lines of a block image, without decoding the
+    whole image at full size where the format allows it.
+
+    The image (a filename, file object or unloaded Pillow image) is
+    scaled to the given number of columns and, unless otherwise given,
+    the number of lines that keeps its aspect ratio. It is processed in
+    horizontal strips of `strip_lines` lines. Any other keyword
+    arguments are passed on to :class:`BlockImage`.
+
+    How much memory this takes depends on the format. Uncompressed
+    images (PPM, BMP and uncompressed TIFF, whether in strips or
+    tiles) are read from file one strip at a time, so only a strip is
+    ever held. JPEG images are decoded in full, but at the smallest
+    DCT scale (down to 1/8) that is no smaller than the output. All
+    other formats, including PNG, WebP, GIF and compressed TIFF, are
+    decoded in full at their full size, since Pillow cannot decode
+    them in part; only then are they reduced.
+    """
+    if not isinstance(image, Image.Image):
+        with Image.open(image) as opened:
+            yield from stream_block_lines(opened, cols, lines, strip_lines, **kwargs)
+        return
+    width, height = image.size
+    if lines is None:
+        lines = max(1, round(cols * height / width / BlockImage.blocks_per_char))
+    out_height = BlockImage.blocks_per_char * lines
+    read = _raw_row_reader(image)
+    if read is None:
+        image.draft("RGB", (cols, out_height))
+        factor = min(image.width // cols, image.height // out_height)
+        if factor > 1:
+            image = image.reduce(factor)
+        else:
+            image.load()
+        width, height = image.size
 
-def print_image(image, force_blocks=False):
+        def read(top, bottom):
+            return image.crop((0, top, width, bottom))
+
+    scale = height / out_height
+    for first in range(0, lines, strip_lines):
+        n = min(strip_lines, lines - first)
+        y0 = BlockImage.blocks_per_char * first * scale
+        y1 = BlockImage.blocks_per_char * (first + n) * scale
+        top = int(y0)
+        bottom = min(height, int(ceil(y1)))
+        strip = read(top, bottom).convert("RGB")
+        strip = strip.resize((cols, BlockImage.blocks_per_char * n), Image.Resampling.BOX,
+                             box=(0, y0 - top, width, y1 - top))
+        yield from BlockImage(strip, lines=n, cols=cols, **kwargs).ansi_lines()
+
+
+class RenderCache:
+    """ On-disk cache of rendered output, keyed by the content of the
+    image, the size it is rendered at and the way it is rendered, so
+    that showing an unchanged image again only requires reading a file.
+
+    Entries are written atomically, so the cache can be shared by
+    several processes. The total size of the files stored is bounded by
+    the budget; beyond that, the least recently used are deleted.
+    """
+
+    #: Default budget, in bytes of rendered output.
+    budget = 64 * 1024 * 1024
+
+    def __init__(self, directory=None, budget=None):
+        if directory is None:
+            directory = cache_directory("render")
+        self.directory = directory
+        if budget is not None:
+            self.budget = budget
+        self._lock = Lock()
+        self._index = LRU()             # filename -> None, sized by file
+        self._indexed = False
+
+    @property
+    def used(self):
+        """ Total size of the files stored, in bytes.
+        """
+        return self._index.used
+
+    def _path(self, content_key, size, mode):
+        digest = blake2b(f"{content_key}:{size[0]}x{size[1]}:{mode}".encode("utf-8"), digest_size=16)
+        return path.join(self.directory, digest.hexdigest())
+
+    def _load_index(self):
+        # Called with the lock held
+        if self._indexed:
+            return
+        entries = []
+        try:
+            with scandir(self.directory) as it:
+                for entry in it:
+                    # Entries are named by a 32 digit hex digest, unlike
+                    # temporary files still being written.
+                    if len(entry.name) == 32:
+                        try:
+                            st = entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((st.st_mtime, entry.path, st.st_size))
+        except OSError:
+            pass
+        for _, filename, size in sorted(entries):
+            self._index.put(filename, None, size)
+        self._indexed = True
+
+    def get(self, content_key, size, mode):
+        """ Return the cached output for an image, or None.
+        """
+        filename = self._path(content_key, size, mode)
+        try:
+            with open(filename, encoding="utf-8") as f:
+                text = f.read()
+        except OSError:
+            return None
+        with self._lock:
+            self._load_index()
+            self._index.touch(filename)
+        try:
+            utime(filename)
+        except OSError:
+            pass
+        return text
+
+    def put(self, content_key, size, mode, text):
+        """ Store the output for an image.
+        """
+        makedirs(self.directory, exist_ok=True)
+        filename = self._path(content_key, size, mode)
+        data = text.encode("utf-8")
+        with NamedTemporaryFile(dir=self.directory, delete=False) as f:
+            try:
+                f.write(data)
+            except BaseException:
+                unlink(f.name)
+                raise
+        replace(f.name, filename)
+        with self._lock:
+            self._load_index()
+            self._index.put(filename, None, len(data))
+            for evicted, _ in self._index.evict(self.budget):
+                try:
+                    unlink(evicted)
+                except OSError:
+                    pass
+
+
+# States reported to ImageLoader progress callbacks
+LOADING = "loading"
+LOADED = "loaded"
+FAILED = "failed"
+
+
+class ImageLoader:
+    """ Loader for many images at once.
+
+    Images are fetched and decoded by a bounded pool of threads, with a
+    limit on the number loaded from any one host at the same time.
+    Remote images share the pooled connections of :mod:`pansi.net`
+    and, unless told otherwise, its HTTP cache.
+    """
+
+    #: Default number of images loaded at the same time.
+    workers = 8
+
+    #: Default number of images loaded from the same host at the same
+    #: time.
+    per_host = 4
+
+    #: Default limit on the number of images either loading or loaded
+    #: but not yet taken, or None for twice the number of workers.
+    max_pending = None
+
+    def __init__(self, workers=None, per_host=None, max_pending=None, http_cache=None):
+        if workers is not None:
+            self.workers = workers
+        if per_host is not None:
+            self.per_host = per_host
+        if max_pending is not None:
+            self.max_pending = max_pending
+        self.http_cache = http_cache
+
+    @classmethod
+    def host(cls, source):
+        """ The host from which a source is loaded, or None for local
+        files and images already in memory.
+        """
+        if isinstance(source, str) and ":" in source:
+            uri = URI.parse(source)
+            if uri.scheme in ("http", "https"):
+                return uri.authority
+        return None
+
+    def load_one(self, source):
+        """ Load and decode a single image, from a path or URI (or
+        already loaded).
+        """
+        if isinstance(source, TerminalImage):
+            return source
+        elif isinstance(source, Image.Image):
+            return TerminalImage(source)
+        image = TerminalImage.load(source, http_cache=self.http_cache)
+        if not getattr(image.image, "is_animated", False):
+            image.image.load()
+        return image
+
+    def load(self, sources, ordered=True, progress=None):
+        """ Load a number of images, generating (source, result) pairs,
+        where each result is a :class:`TerminalImage` or the exception
+        raised while loading it. Results come in the order of the
+        sources or, if `ordered` is false, as soon as each is ready.
+
+        If given, `progress(index, source, state)` is called as each
+        image starts loading (LOADING) and again once it has LOADED or
+        FAILED. Calls are made from the thread iterating through the
+        results, before the corresponding result is generated, so they
+        can safely draw (for example) placeholders on the terminal.
+
+        Images not yet started when iteration stops are never loaded.
+        Nor are more than :attr:`max_pending` images loading, or loaded
+        but not yet taken, at any one time; more are started only as
+        results are taken.
+        """
+        sources = list(sources)
+        hosts = [self.host(source) for source in sources]
+        max_pending = self.max_pending or 2 * self.workers
+        events = Queue()
+        ready = []      # heap of indexes of sources that can be started
+        waiting = {}    # host -> deque of indexes of sources to start later
+        futures = []
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pansi-load")
+
+        def work(index):
+            events.put((index, LOADING, None))
+            try:
+                result, state = self.load_one(sources[index]), LOADED
+            except Exception as error:
+                result, state = error, FAILED
+            events.put((index, state, result))
+
+        def start_more(pending):
+            # Start the earliest sources that can be started, up to the
+            # limit. All scheduling happens in the calling thread.
+            while pending < max_pending and ready:
+                futures.append(executor.submit(work, heappop(ready)))
+                pending += 1
+            return pending
+
+        # Each host has at most per_host sources either ready or being
+        # loaded; another becomes ready as each finishes.
+        admitted = Counter()
+        for index, host in enumerate(hosts):
+            if host is None or admitted[host] < self.per_host:
+                admitted[host] += 1
+                ready.append(index)     # in order, so already a heap
+            else:
+                waiting.setdefault(host, deque()).append(index)
+        results = {}
+        next_index = 0
+        pending = start_more(0)
+        try:
+            for _ in range(2 * len(sources)):
+                index, state, result = events.get()
+                if progress is not None:
+                    progress(index, sources[index], state)
+                if state == LOADING:
+                    continue
+                host = hosts[index]
+                if waiting.get(host):
+                    heappush(ready, waiting[host].popleft())
+                if not ordered:
+                    yield sources[index], result
+                    pending = start_more(pending - 1)
+                    continue
+                results[index] = result
+                while next_index in results:
+                    yield sources[next_index], results.pop(next_index)
+                    next_index += 1
+                    pending = start_more(pending - 1)
+        finally:
+            ready.clear()
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+
+def expand_sources(args, lines=stdin):
+    """ Expand a list of command line image arguments into a list of
+    image sources. Glob patterns are expanded (for local paths only),
+    and a "-", or no arguments at all, reads further sources from the
+    given lines, one per line.
+    """
+    sources = []
+    for arg in args or ["-"]:
+        if arg == "-":
+            sources.extend(line.strip() for line in lines if line.strip())
+        elif ":" not in arg and any(ch in arg for ch in "*?["):
+            sources.extend(sorted(glob(arg)) or [arg])
+        else:
+            sources.append(arg)
+    return sources
+
+
+def print_image(image, force_blocks=False, animate=False, medium=None, force_sixels=False,
+                depth=palette.TRUECOLOR, dither=None, mode="half", stream=False, workers=None,
+                cache=None):
+    """ Print an image in the best available way. Returns the player
+    if the image was animated.
+    """
+    players = print_images([image], force_blocks=force_blocks, animate=animate, medium=medium,
+                           force_sixels=force_sixels, depth=depth, dither=dither, mode=mode,
+                           stream=stream, workers=workers, cache=cache)
+    return players[0] if players else None
+
+
+def print_images(images, force_blocks=False, animate=False, medium=None, force_sixels=False,
+                 depth=palette.TRUECOLOR, dither=None, mode="half", stream=False, workers=None,
+                 cache=None, errors=None):
+    """ Print a number of images in turn, querying the terminal only
+    once for all of them. Images are loaded concurrently (see
+    :class:`ImageLoader`), ahead of being printed. Block and sixel
+    output is looked up in, and saved to, the given
+    :class:`RenderCache` (if any).
+
+    If an `errors` stream is given, failure to print one image is
+    reported there and the rest are still printed. Returns the list of
+    players for any animated images.
+    """
     screen = Terminal()
-    if isinstance(image, Image.Image):
+    if stream:
+        support = None
+    elif force_blocks:
+        support = None
+    elif force_sixels:
+        support = "sixel"
+    elif stdin.isatty():
+        support = Terminal.graphics_support()
+    else:
+        # The terminal can't reply if stdin is redirected (for example,
+        # to read a list of images), so stick to blocks.
+        support = None
+    renderer = ParallelRenderer(workers) if workers and mode == "half" and not stream else None
+    if stream:
+        loaded = ((image, image) for image in images)
+    else:
+        # Later images load while earlier ones are printed
+        loaded = ImageLoader().load(images)
+    players = []
+    try:
+        for image, result in loaded:
+            try:
+                if isinstance(result, Exception):
+                    raise result
+                player = _print_one(result, screen, support, animate, medium, depth, dither, mode,
+                                    stream, renderer, cache)
+            except Exception as error:
+                if errors is None:
+                    raise
+                print(f"{image}: {error}", file=errors)
+            else:
+                if player is not None:
+                    players.append(player)
+    finally:
+        loaded.close()
+        if renderer is not None:
+            renderer.close()
+    return players
+
+
+def _print_one(image, screen, support, animate, medium, depth, dither, mode, stream, renderer, cache):
+    if stream:
+        # Fill the width of the terminal, however long that makes it
+        for line in stream_block_lines(image, screen.char_width, depth=depth, dither=dither):
+            print(line)
+        return None
+    if isinstance(image, TerminalImage):
+        term_image = image
+    elif isinstance(image, Image.Image):
         term_image = TerminalImage(image)
     else:
         term_image = TerminalImage.load(image)
-    if force_blocks or not Terminal.supports_graphics_protocol():
-        term_image.to_fit(screen).print_blocks(screen)
+    if animate and getattr(term_image.image, "is_animated", False):
+        lines, cols = term_image.to_fit(screen).block_size(screen)
+        player = Player.open(term_image.image, lines, cols, delta=True)
+        player.play()
+        return player
+    if support == "kitty":
+        term_image.to_fit(screen).print_pixels(medium=medium)
+        return None
+    size = term_image.fit_size(screen)
+    if support == "sixel":
+        render_mode = "sixel"
     else:
-        term_image.to_fit(screen).print_pixels()
+        size = term_image.block_size(screen, size)
+        render_mode = f"{mode}:{depth}:{dither}"
+    text = None if cache is None else cache.get(term_image.content_key(), size, render_mode)
+    if text is None:
+        fitted = term_image.to_fit(screen)
+        if support == "sixel":
+            text = sixel.encode(fitted.image)
+        else:
+            text = "\n".join(fitted.block_lines(screen, depth, dither, mode, renderer))
+        if cache is not None:
+            cache.put(term_image.content_key(), size, render_mode, text)
+    print(text)
+    return None
 
 
 def main():
     parser = ArgumentParser()
+    parser.add_argument("-A", "--animate", action="store_true")
     parser.add_argument("-B", "--force-blocks", action="store_true")
-    parser.add_argument("image")
+    parser.add_argument("-M", "--medium", choices=[graphics.FILE, graphics.SHARED_MEMORY, graphics.DIRECT])
+    parser.add_argument("-S", "--force-sixels", action="store_true")
+    parser.add_argument("-d", "--depth", type=int, choices=palette.DEPTHS, default=palette.TRUECOLOR)
+    parser.add_argument("--dither", choices=[palette.ORDERED, palette.FLOYD_STEINBERG])
+    parser.add_argument("-m", "--mode", choices=["half"] + list(SubCellImage.modes), default="half")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("-j", "--workers", type=int, help="render blocks using this many processes")
+    parser.add_argument("--cache-dir", help="directory for cached output")
+    parser.add_argument("--no-cache", action="store_true", help="do not cache rendered output")
+    parser.add_argument("images", nargs="*", metavar="image",
+                        help="path, URI or glob pattern; '-' (or none) reads a list from stdin")
     args = parser.parse_args()
-    print_image(args.image, force_blocks=args.force_blocks)
+    cache = None if args.no_cache else RenderCache(args.cache_dir)
+    print_images(expand_sources(args.images), force_blocks=args.force_blocks, animate=args.animate,
+                 medium=args.medium, force_sixels=args.force_sixels, depth=args.depth, dither=args.dither,
+                 mode=args.mode, stream=args.stream, workers=args.workers, cache=cache, errors=stderr)
 
 
 if __name__ == '__main__':
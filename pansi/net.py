@@ -16,63 +16,720 @@
 # limitations under the License.
 
 
-from io import BytesIO
+""" HTTP downloads and URIs.
 
-from urllib3 import PoolManager as HTTP
+All downloads share a single pool of keep-alive connections, so that
+loading many images from the same server only pays for one connection
+(and one TLS handshake) per concurrent request. Images are loaded
+through a shared :class:`HTTPCache`, so that each is only downloaded
+again once it has changed.
+"""
 
 
-def download(uri, method="GET", expected_status=200):
-    http = HTTP()
-    rs = http.request(method, str(uri))
-    if rs.status == expected_status:
-        return BytesIO(rs.data)
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from glob import escape as glob_escape, glob
+from hashlib import blake2b
+from io import BytesIO, RawIOBase, SEEK_CUR, SEEK_END, SEEK_SET
+from json import dump as json_dump, load as json_load
+from os import makedirs, path, replace, stat, unlink, utime
+from operator import itemgetter
+from re import DOTALL, compile as re_compile
+from sys import intern
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
+from threading import Lock
+from time import time
+
+from PIL import Image
+from urllib3 import PoolManager, Timeout
+
+from pansi.cache import LRU, cache_directory
+
+
+#: Size of each chunk read from a streamed response.
+CHUNK_SIZE = 64 * 1024
+
+
+class Client:
+    """ HTTP client with a pool of persistent connections.
+    """
+
+    #: Default maximum number of connections kept open to each host.
+    pool_size = 8
+
+    #: Default maximum number of hosts with pooled connections.
+    num_pools = 16
+
+    #: Default connection timeout, in seconds.
+    connect_timeout = 10.0
+
+    #: Default read timeout, in seconds.
+    read_timeout = 30.0
+
+    #: Default number of retries for a failed request.
+    retries = 3
+
+    def __init__(self, pool_size=None, num_pools=None, connect_timeout=None, read_timeout=None,
+                 retries=None):
+        if pool_size is not None:
+            self.pool_size = pool_size
+        if num_pools is not None:
+            self.num_pools = num_pools
+        if connect_timeout is not None:
+            self.connect_timeout = connect_timeout
+        if read_timeout is not None:
+            self.read_timeout = read_timeout
+        if retries is not None:
+            self.retries = retries
+        # A thread that needs a connection while all of them are in use
+        # waits for one (block=True), rather than opening another that
+        # would be thrown away afterwards.
+        self.pool = PoolManager(num_pools=self.num_pools, maxsize=self.pool_size, block=True,
+                                timeout=Timeout(connect=self.connect_timeout, read=self.read_timeout),
+                                retries=self.retries)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """ Close all pooled connections.
+        """
+        self.pool.clear()
+
+    def request(self, method, uri, headers=None, stream=False):
+        """ Make a request and return the urllib3 response, whatever
+        its status. If `stream` is set, the body is left unread.
+        """
+        return self.pool.request(method, str(uri), headers=headers, preload_content=not stream)
+
+    def download(self, uri, method="GET", expected_status=200, stream=False, headers=None):
+        """ Make a request and return the response body as a file-like
+        object.
+
+        By default, the whole body is read into memory. If `stream` is
+        set, the body is instead read from the connection as it is
+        consumed; the response returned should be closed once read,
+        which returns the connection to the pool.
+        """
+        rs = self.request(method, uri, headers=headers, stream=stream)
+        if rs.status != expected_status:
+            if stream:
+                rs.drain_conn()
+                rs.release_conn()
+            raise RuntimeError(f"{method} {uri} -> {rs.status}")
+        if stream:
+            return Stream(rs)
+        else:
+            return BytesIO(rs.data)
+
+
+class Stream(RawIOBase):
+    """ Body of a streamed response, as a seekable file.
+
+    Data is read from the connection only as far as it is needed, and
+    kept so that earlier parts can be read again. This allows Pillow to
+    identify an image from its first few bytes, and to decode it as the
+    rest arrives, without the whole body being downloaded first. Up to
+    :attr:`spool_size` bytes are kept in memory; beyond that, the data
+    is kept in a temporary file.
+    """
+
+    #: Default number of bytes kept in memory before spilling to disk.
+    spool_size = 4 * 1024 * 1024
+
+    def __init__(self, response, chunk_size=CHUNK_SIZE, spool_size=None):
+        super().__init__()
+        self.response = response
+        self.chunk_size = chunk_size
+        if spool_size is not None:
+            self.spool_size = spool_size
+        self.buffer = SpooledTemporaryFile(max_size=self.spool_size)
+        self.position = 0
+        #: Number of bytes read from the connection so far.
+        self.received = 0
+        self.complete = False
+        self._digest = blake2b(digest_size=16)
+
+    @property
+    def headers(self):
+        return self.response.headers
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def _fill(self, end=None):
+        # Read from the connection until the buffer holds at least
+        # `end` bytes (or the whole body), returning the buffer size.
+        buffer = self.buffer
+        buffer.seek(0, SEEK_END)
+        while not self.complete and (end is None or self.received < end):
+            chunk = self.response.read(self.chunk_size)
+            if chunk:
+                buffer.write(chunk)
+                self._digest.update(chunk)
+                self.received += len(chunk)
+            else:
+                self.complete = True
+                self.response.release_conn()
+        return self.received
+
+    def readinto(self, b):
+        self._fill(self.position + len(b))
+        self.buffer.seek(self.position)
+        n = self.buffer.readinto(b)
+        self.position += n
+        return n
+
+    def seek(self, offset, whence=SEEK_SET):
+        if whence == SEEK_SET:
+            position = offset
+        elif whence == SEEK_CUR:
+            position = self.position + offset
+        elif whence == SEEK_END:
+            position = self._fill() + offset
+        else:
+            raise ValueError(f"Invalid whence {whence!r}")
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+        self.position = position
+        return position
+
+    def tell(self):
+        return self.position
+
+    def hexdigest(self):
+        """ Return a hash of the whole body, reading the rest of it
+        first if necessary. This matches the hash of the same data
+        held in a file (see :meth:`pansi.image.TerminalImage.content_key`).
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed stream")
+        self._fill()
+        return self._digest.hexdigest()
+
+    def close(self):
+        """ Close the stream. If the whole body has been read, the
+        connection has already gone back to the pool; otherwise, it is
+        closed, rather than the rest of the body being read.
+        """
+        if not self.closed:
+            if not self.complete:
+                self.response.close()
+                self.response.release_conn()
+            self.buffer.close()
+        super().close()
+
+
+class HTTPCache:
+    """ On-disk cache of HTTP responses, with an in-memory tier of
+    decoded images.
+
+    Each body is stored along with its validators (ETag and
+    Last-Modified) and an expiry time taken from the max-age in its
+    Cache-Control header (or from its Expires header). Until it
+    expires, an entry is served straight from disk. After that, it is
+    revalidated with a conditional request, so that an unchanged body
+    is not transferred again.
+
+    The total size of the bodies stored is bounded by the disk budget;
+    beyond that, the least recently used entries are deleted. Entries
+    are written atomically, so the cache can be shared by several
+    processes, although each keeps its own view of what was used most
+    recently.
+    """
+
+    #: Default disk budget, in bytes of response bodies.
+    budget = 256 * 1024 * 1024
+
+    #: Default memory budget for decoded images, in bytes of pixel data.
+    memory_budget = 64 * 1024 * 1024
+
+    def __init__(self, directory=None, budget=None, memory_budget=None, client=None):
+        if directory is None:
+            directory = cache_directory("http")
+        self.directory = directory
+        if budget is not None:
+            self.budget = budget
+        if memory_budget is not None:
+            self.memory_budget = memory_budget
+        self._client = client
+        self._lock = Lock()
+        self._index = LRU()             # key -> None, sized by body
+        self._indexed = False
+        self._images = LRU()            # key -> (meta, image)
+        #: Number of requests served without contacting the server.
+        self.hits = 0
+        #: Number of requests answered by the server with 304 Not Modified.
+        self.revalidations = 0
+        #: Number of bodies downloaded.
+        self.misses = 0
+
+    @property
+    def client(self):
+        return client() if self._client is None else self._client
+
+    @property
+    def used(self):
+        """ Total size of the bodies stored, in bytes.
+        """
+        return self._index.used
+
+    @property
+    def memory_used(self):
+        """ Total size of the decoded images kept, in bytes.
+        """
+        return self._images.used
+
+    @classmethod
+    def normalize(cls, uri):
+        """ Return the form of a URI used to identify it in the cache:
+        its normal form, without a fragment.
+        """
+        if not isinstance(uri, URI):
+            uri = URI.parse(str(uri))
+        uri = uri.normalized()
+        return str(URI(uri.scheme, uri.authority, uri.path, uri.query))
+
+    def _key(self, uri):
+        return blake2b(self.normalize(uri).encode("utf-8"), digest_size=16).hexdigest()
+
+    def _path(self, key, extension):
+        return path.join(self.directory, f"{key}.{extension}")
+
+    def _load_index(self):
+        # Called with the lock held
+        if self._indexed:
+            return
+        entries = []
+        for filename in glob(path.join(glob_escape(self.directory), "*.json")):
+            try:
+                with open(filename, encoding="utf-8") as f:
+                    meta = json_load(f)
+                entries.append((stat(filename).st_mtime, path.basename(filename)[:-5], meta["size"]))
+            except (OSError, ValueError, KeyError):
+                continue
+        for _, key, size in sorted(entries):
+            self._index.put(key, None, size)
+        self._indexed = True
+
+    def _read_meta(self, key):
+        try:
+            with open(self._path(key, "json"), encoding="utf-8") as f:
+                return json_load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, key, meta):
+        with NamedTemporaryFile("w", encoding="utf-8", dir=self.directory, delete=False) as f:
+            json_dump(meta, f)
+        replace(f.name, self._path(key, "json"))
+
+    def _touch(self, key):
+        with self._lock:
+            self._load_index()
+            self._index.touch(key)
+        try:
+            utime(self._path(key, "json"))
+        except OSError:
+            pass
+
+    def _remove(self, key):
+        # Called with the lock held
+        self._index.pop(key)
+        for extension in ("json", "body"):
+            try:
+                unlink(self._path(key, extension))
+            except OSError:
+                pass
+
+    def _added(self, key, size):
+        with self._lock:
+            self._load_index()
+            self._index.put(key, None, size)
+            for evicted, _ in self._index.evict(self.budget):
+                self._remove(evicted)
+
+    @classmethod
+    def _expiry(cls, headers, now):
+        directives = {}
+        for directive in headers.get("Cache-Control", "").split(","):
+            name, _, value = directive.strip().partition("=")
+            directives[name.lower()] = value.strip('"')
+        if "no-store" in directives:
+            return None
+        if "no-cache" in directives:
+            return now
+        try:
+            return now + max(int(directives["max-age"]) - int(headers.get("Age", 0)), 0)
+        except (KeyError, ValueError):
+            pass
+        try:
+            return parsedate_to_datetime(headers["Expires"]).timestamp()
+        except (KeyError, TypeError, ValueError):
+            return now
+
+    def open(self, uri):
+        """ Return the body of a response as an open (binary) file,
+        along with its cache metadata.
+        """
+        key = self._key(uri)
+        makedirs(self.directory, exist_ok=True)
+        meta = self._read_meta(key)
+        now = time()
+        if meta is not None:
+            try:
+                body = open(self._path(key, "body"), "rb")
+            except OSError:
+                meta = None
+        if meta is not None:
+            if now < meta["expires"]:
+                self.hits += 1
+                self._touch(key)
+                return body, meta
+            headers = {}
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+            if not headers:
+                body.close()
+                meta = None
+        else:
+            headers = None
+        try:
+            rs = self.client.request("GET", uri, headers=headers, stream=True)
+        except BaseException:
+            if meta is not None:
+                body.close()
+            raise
+        try:
+            if rs.status == 304 and meta is not None:
+                self.revalidations += 1
+                expires = self._expiry(rs.headers, now)
+                if expires is not None:
+                    meta["expires"] = expires
+                    meta["etag"] = rs.headers.get("ETag", meta.get("etag"))
+                    self._write_meta(key, meta)
+                    self._touch(key)
+                return body, meta
+            if meta is not None:
+                body.close()
+            if rs.status != 200:
+                raise RuntimeError(f"GET {uri} -> {rs.status}")
+            self.misses += 1
+            return self._store(key, uri, rs, now)
+        finally:
+            rs.drain_conn()
+            rs.release_conn()
+
+    def _store(self, key, uri, rs, now):
+        digest = blake2b(digest_size=16)
+        size = 0
+        with NamedTemporaryFile(dir=self.directory, delete=False) as f:
+            try:
+                for chunk in rs.stream(CHUNK_SIZE):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+            except BaseException:
+                unlink(f.name)
+                raise
+        meta = {"uri": self.normalize(uri),
+                "etag": rs.headers.get("ETag"),
+                "last_modified": rs.headers.get("Last-Modified"),
+                "expires": self._expiry(rs.headers, now),
+                "size": size,
+                "digest": digest.hexdigest()}
+        body = open(f.name, "rb")
+        if meta["expires"] is None:
+            # Not to be stored, so only kept for as long as it is open
+            unlink(f.name)
+            return body, meta
+        replace(f.name, self._path(key, "body"))
+        self._write_meta(key, meta)
+        self._added(key, size)
+        return body, meta
+
+    def download(self, uri):
+        """ Return the body of a response as an open (binary) file.
+        """
+        body, _ = self.open(uri)
+        return body
+
+    def image(self, uri):
+        """ Return the image at a URI, decoded, along with a hash of its
+        encoded data (as used by
+        :meth:`pansi.image.TerminalImage.content_key`).
+
+        Still images are kept in memory, so should not be modified;
+        animated images are read from disk as they are played.
+        """
+        key = self._key(uri)
+        with self._lock:
+            meta, image = self._images.get(key, (None, None))
+            if meta is not None and time() < meta["expires"]:
+                self.hits += 1
+                return image, meta["digest"]
+        body, new_meta = self.open(uri)
+        if image is not None and new_meta["digest"] == meta["digest"]:
+            body.close()
+        else:
+            image = Image.open(body)
+            if getattr(image, "is_animated", False):
+                return image, new_meta["digest"]
+            try:
+                image.load()
+            finally:
+                body.close()
+        if new_meta["expires"] is not None:
+            self._keep_image(key, new_meta, image)
+        return image, new_meta["digest"]
+
+    def _keep_image(self, key, meta, image):
+        size = image.width * image.height * len(image.getbands())
+        with self._lock:
+            self._images.put(key, (meta, image), size)
+            self._images.evict(self.memory_budget)
+
+    def clear(self):
+        """ Delete every entry.
+        """
+        with self._lock:
+            self._load_index()
+            for key in list(self._index):
+                self._remove(key)
+            self._images.clear()
+
+
+_client = None
+_client_lock = Lock()
+
+
+def client():
+    """ Return the shared client, creating it if necessary.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = Client()
+        return _client
+
+
+def configure(**settings):
+    """ Replace the shared client with one using the given settings
+    (see :class:`Client`), closing the connections of the old one.
+    """
+    global _client
+    with _client_lock:
+        old, _client = _client, Client(**settings)
+    if old is not None:
+        old.close()
+    return _client
+
+
+_http_cache = None
+_http_cache_lock = Lock()
+
+
+def http_cache():
+    """ Return the shared HTTP cache, creating it if necessary.
+    """
+    global _http_cache
+    with _http_cache_lock:
+        if _http_cache is None:
+            _http_cache = HTTPCache()
+        return _http_cache
+
+
+def configure_cache(**settings):
+    """ Replace the shared HTTP cache with one using the given settings
+    (see :class:`HTTPCache`).
+    """
+    global _http_cache
+    with _http_cache_lock:
+        _http_cache = HTTPCache(**settings)
+        return _http_cache
+
+
+def download(uri, method="GET", expected_status=200, stream=False, headers=None):
+    """ Download from a URI using the shared client. See
+    :meth:`Client.download`.
+    """
+    return client().download(uri, method, expected_status, stream, headers)
+
+
+# Splits a URI reference into scheme, authority, path, query and
+# fragment in a single match (RFC 3986, appendix B).
+_URI = re_compile(r"(?:([^:/?#]+):)?(?://([^/?#]*))?([^?#]*)(?:\?([^#]*))?(?:#(.*))?", DOTALL)
+
+# A percent-encoded octet, or a character that must be percent-encoded
+# (including a "%" that does not start an encoded octet).
+_ESCAPE = re_compile(r"%([0-9A-Fa-f]{2})|[^A-Za-z0-9\-._~!$&'()*+,;=:@/?\[\]]")
+
+# Any character that means that a string is not already normalized,
+# including the "%" of an encoded octet.
+_NOT_NORMAL = re_compile(r"[^A-Za-z0-9\-._~!$&'()*+,;=:@/?\[\]]")
+
+_UNRESERVED = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~")
+
+_DEFAULT_PORTS = {"http": "80", "https": "443"}
+
+#: Number of parsed URIs kept for reuse.
+PARSE_CACHE_SIZE = 4096
+
+
+def _normalize_escape(match):
+    octet = match.group(1)
+    if octet is None:
+        return "".join(f"%{b:02X}" for b in match.group(0).encode("utf-8"))
+    ch = chr(int(octet, 16))
+    if ch in _UNRESERVED:
+        return ch
     else:
-        raise RuntimeError(f"{method} {uri} -> {rs.status}")
+        return f"%{octet.upper()}"
+
+
+def _normalize_escapes(s):
+    # Decode percent-encoded unreserved characters, put the hex digits
+    # of other encoded octets in upper case, and encode characters
+    # that are not allowed to appear unencoded.
+    if s is None or _NOT_NORMAL.search(s) is None:
+        return s
+    return _ESCAPE.sub(_normalize_escape, s)
+
+
+def _remove_dot_segments(path):
+    # RFC 3986, section 5.2.4
+    if "/." not in path and not path.startswith("."):
+        return path
+    segments = path.split("/")
+    out = []
+    for segment in segments:
+        if segment == ".":
+            continue
+        elif segment == "..":
+            if out and out != [""]:
+                out.pop()
+        else:
+            out.append(segment)
+    if segments[-1] in (".", ".."):
+        out.append("")
+    return "/".join(out)
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse(cls, s):
+    return _new(cls, _URI.match(s).groups())
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _normal_form(cls, scheme, authority, path, query, fragment):
+    if scheme is not None:
+        scheme = intern(scheme.lower())
+    if authority is not None:
+        userinfo, at, host_port = authority.rpartition("@")
+        host, colon, port = host_port.rpartition(":")
+        if not colon or "]" in port:
+            # No port, just an IPv6 address
+            host, port = host_port, ""
+        if port == _DEFAULT_PORTS.get(scheme):
+            port = ""
+        # Shared by many URIs, so interned to save memory and make
+        # comparisons faster
+        authority = intern("".join([_normalize_escapes(userinfo), at, _normalize_escapes(host.lower()),
+                                    ":" if port else "", port]))
+    path = _normalize_escapes(path)
+    if scheme is not None or authority is not None:
+        path = _remove_dot_segments(path)
+    if not path and authority is not None and scheme in _DEFAULT_PORTS:
+        path = "/"
+    return _new(cls, (scheme, authority, path, _normalize_escapes(query), _normalize_escapes(fragment)))
 
 
-class URI:
+_new = tuple.__new__
+_tuple_eq = tuple.__eq__
+_tuple_hash = tuple.__hash__
+
+
+class URI(tuple):
+    """ A URI reference, as an immutable (scheme, authority, path,
+    query, fragment) tuple.
+
+    URIs compare equal (and hash the same) if their normal forms (see
+    :meth:`normalized`) are the same, so they can be used directly as
+    dictionary keys. Normal forms are only worked out when first
+    needed, so parsing does no more than split the string.
+    """
+
+    # Without __slots__, so that the hash can be kept once worked out.
+    # The components themselves are read-only.
+
+    scheme = property(itemgetter(0))
+    authority = property(itemgetter(1))
+    path = property(itemgetter(2))
+    query = property(itemgetter(3))
+    fragment = property(itemgetter(4))
 
     @classmethod
     def parse(cls, s):
-        scheme, colon, ssp = s.partition(":")
-        if not colon:
-            scheme, ssp = None, scheme
-        apq, hash_sign, fragment = ssp.partition("#")
-        if not hash_sign:
-            fragment = None
-        hierarchical_part, question_mark, query = apq.partition("?")
-        if not question_mark:
-            query = None
-        if hierarchical_part.startswith("//"):
-            hierarchical_part = hierarchical_part[2:]
-            slash = hierarchical_part.find("/")
-            if slash:
-                authority = hierarchical_part[:slash]
-                path = hierarchical_part[slash:]
-            else:
-                authority = hierarchical_part
-                path = ""
-        else:
-            authority = None
-            path = hierarchical_part
-        return cls(scheme, authority, path, query, fragment)
+        """ Parse a URI reference. Parsing the same string again
+        returns the same object.
+        """
+        return _parse(cls, s)
 
-    def __init__(self, scheme=None, authority=None, path="", query=None, fragment=None):
-        self.scheme = scheme
-        self.authority = authority
-        self.path = path
-        self.query = query
-        self.fragment = fragment
+    def __new__(cls, scheme=None, authority=None, path="", query=None, fragment=None):
+        return _new(cls, (scheme, authority, path, query, fragment))
+
+    def __reduce__(self):
+        return self.__class__, tuple(self)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}.parse({str(self)!r})"
 
     def __str__(self):
-        if self.authority is None:
-            s = [self.path]
-        else:
-            s = ["//", self.authority, self.path]
-        if self.query is not None:
-            s.extend(["?", self.query])
-        if self.fragment is not None:
-            s.extend(["#", self.fragment])
-        if self.scheme is not None:
-            s = [self.scheme, ":"] + s
+        scheme, authority, path, query, fragment = self
+        s = []
+        if scheme is not None:
+            s.extend([scheme, ":"])
+        if authority is not None:
+            s.extend(["//", authority])
+        s.append(path)
+        if query is not None:
+            s.extend(["?", query])
+        if fragment is not None:
+            s.extend(["#", fragment])
         return "".join(s)
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, URI):
+            return NotImplemented
+        return _tuple_eq(_normal_form(URI, *self), _normal_form(URI, *other))
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = _tuple_hash(_normal_form(URI, *self))
+            return self._hash
+
+    def normalized(self):
+        """ Return the normal form of this URI (RFC 3986, section
+        6.2.2): scheme and host in lower case, percent-encoding
+        normalized, dot segments removed from the path, and any default
+        port or empty path of an HTTP(S) URI made explicit or removed.
+        Recently worked out normal forms are kept, in a cache of the
+        same size as that of :meth:`parse`.
+        """
+        return _normal_form(self.__class__, *self)
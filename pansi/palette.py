@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+# Copyright 2020, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+""" Terminal colour palettes, and reduction of images to them.
+"""
+
+
+from PIL import Image, ImageChops
+
+
+# Colour depths, in bits
+TRUECOLOR = 24
+XTERM_256 = 8
+XTERM_16 = 4
+MONO = 1
+
+DEPTHS = (TRUECOLOR, XTERM_256, XTERM_16, MONO)
+
+# Dithering methods
+ORDERED = "ordered"
+FLOYD_STEINBERG = "floyd-steinberg"
+
+# The sixteen system colours, as set by default in xterm. Other
+# terminals use slightly different values, but they are close enough
+# for choosing the nearest.
+SYSTEM_COLOURS = [
+    (0, 0, 0), (205, 0, 0), (0, 205, 0), (205, 205, 0),
+    (0, 0, 238), (205, 0, 205), (0, 205, 205), (229, 229, 229),
+    (127, 127, 127), (255, 0, 0), (0, 255, 0), (255, 255, 0),
+    (92, 92, 255), (255, 0, 255), (0, 255, 255), (255, 255, 255),
+]
+
+# Levels of each channel in the 6x6x6 colour cube (indexes 16..231)
+CUBE_LEVELS = (0, 95, 135, 175, 215, 255)
+
+# Levels of the greyscale ramp (indexes 232..255)
+GREY_LEVELS = tuple(range(8, 248, 10))
+
+# Ordered dithering threshold map (4x4 Bayer matrix)
+BAYER_4X4 = [
+    [0, 8, 2, 10],
+    [12, 4, 14, 6],
+    [3, 11, 1, 9],
+    [15, 7, 13, 5],
+]
+
+
+def xterm_colours():
+    """ Return the RGB values for all 256 xterm palette indexes.
+    """
+    colours = list(SYSTEM_COLOURS)
+    colours.extend((r, g, b) for r in CUBE_LEVELS for g in CUBE_LEVELS for b in CUBE_LEVELS)
+    colours.extend((v, v, v) for v in GREY_LEVELS)
+    return colours
+
+
+def palette(depth):
+    """ Return a dictionary of RGB value to palette index for the
+    colours available at a given depth. At 256 colours, the system
+    colours are left out since their exact values vary between
+    terminals. In monochrome, the two 'colours' are the terminal's
+    default background (None) and foreground (-1).
+    """
+    if depth == XTERM_256:
+        colours = xterm_colours()
+        return {colours[i]: i for i in range(16, 256)}
+    elif depth == XTERM_16:
+        return {colour: i for i, colour in enumerate(SYSTEM_COLOURS)}
+    elif depth == MONO:
+        return {(0, 0, 0): None, (255, 255, 255): -1}
+    else:
+        raise ValueError(f"No palette for colour depth {depth!r}")
+
+
+# Typical distance between neighbouring palette colours, used to set
+# the strength of ordered dithering.
+_spread = {XTERM_256: 40, XTERM_16: 128, MONO: 255}
+
+
+def reduce(image, depth, dither=None):
+    """ Reduce an RGB image to the colours available at a given depth,
+    optionally dithering, and return the reduced (RGB) image along
+    with the dictionary of RGB value to palette index.
+    """
+    colours = palette(depth)
+    flat = [channel for colour in colours for channel in colour]
+    # Pad out to a full palette with copies of the first colour, which
+    # still map back to the same index.
+    flat.extend(flat[:3] * (256 - len(colours)))
+    palette_image = Image.new("P", (1, 1))
+    palette_image.putpalette(flat)
+    image = image.convert("RGB")
+    if dither == ORDERED:
+        image = _ordered_offset(image, _spread[depth])
+    elif dither not in (None, FLOYD_STEINBERG):
+        raise ValueError(f"Unknown dithering method {dither!r}")
+    reduced = image.quantize(palette=palette_image,
+                             dither=Image.Dither.FLOYDSTEINBERG if dither == FLOYD_STEINBERG else Image.Dither.NONE)
+    return reduced.convert("RGB"), colours
+
+
+def _ordered_offset(image, spread):
+    # Nudge each pixel up or down by up to half the spread, according
+    # to its position in a tiled threshold map, so that nearest colour
+    # matching then produces an ordered dither pattern.
+    tile = Image.new("L", (4, 4))
+    tile.putdata([(2 * v + 1) * spread // 32 for row in BAYER_4X4 for v in row])
+    thresholds = Image.new("L", image.size)
+    for y in range(0, image.height, 4):
+        for x in range(0, image.width, 4):
+            thresholds.paste(tile, (x, y))
+    thresholds = Image.merge("RGB", [thresholds] * 3)
+    return ImageChops.add(image, thresholds, offset=-(spread // 2))
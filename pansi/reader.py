@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+# Copyright 2020, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+""" Reading of terminal input, and of replies to queries.
+
+Input is read from the raw file descriptor in bulk, whatever is
+available, and split into control sequences and text by an incremental
+parser. Queries wait for their replies only until a deadline, so that a
+terminal which ignores a query (or does not exist) cannot hang the
+program.
+"""
+
+
+from codecs import getincrementaldecoder
+from os import read as os_read
+from select import select
+from sys import stdin, stdout
+from termios import error as TermiosError, tcgetattr, tcsetattr, TCSADRAIN
+from time import monotonic
+from tty import setcbreak
+
+
+#: Default time to wait for a reply to a query, in seconds.
+QUERY_TIMEOUT = 1.0
+
+#: Maximum number of bytes taken by each read.
+READ_SIZE = 4096
+
+#: Time to wait after ESC for the rest of an escape sequence, before
+#: taking it to be the escape key on its own, in seconds.
+ESCAPE_TIMEOUT = 0.05
+
+# Parser states
+_GROUND = 0
+_ESCAPE = 1
+_CSI = 2
+_SS3 = 3
+_STRING = 4
+_STRING_ESCAPE = 5
+
+# Characters that introduce control strings, after ESC: DCS, SOS, OSC,
+# PM and APC. These run until ST (or BEL, as used by many terminals to
+# end OSC).
+_STRING_INTRODUCERS = "PX]^_"
+
+
+class SequenceParser:
+    """ Incremental parser that splits terminal input into complete
+    control sequences and runs of text. Input can be fed in pieces of
+    any size; a sequence split across pieces is held back until the
+    rest of it arrives.
+    """
+
+    def __init__(self):
+        self._state = _GROUND
+        self._current = []
+
+    @property
+    def pending(self):
+        """ The incomplete sequence held back so far, if any.
+        """
+        return "".join(self._current)
+
+    def reset(self):
+        """ Give up on any incomplete sequence, returning it.
+        """
+        pending = self.pending
+        self._current.clear()
+        self._state = _GROUND
+        return pending
+
+    def feed(self, data):
+        """ Parse more input, returning a list of the sequences and
+        runs of text that it completes.
+        """
+        out = []
+        current = self._current
+        state = self._state
+        i = 0
+        n = len(data)
+        while i < n:
+            if state == _GROUND:
+                # Take a whole run of text at once
+                esc = data.find("\x1b", i)
+                if esc == -1:
+                    out.append(data[i:])
+                    break
+                if esc > i:
+                    out.append(data[i:esc])
+                current.append("\x1b")
+                state = _ESCAPE
+                i = esc + 1
+                continue
+            ch = data[i]
+            i += 1
+            if state == _ESCAPE:
+                current.append(ch)
+                if ch == "[":
+                    state = _CSI
+                elif ch == "O":
+                    state = _SS3
+                elif ch in _STRING_INTRODUCERS:
+                    state = _STRING
+                elif ch == "\x1b":
+                    # A lone ESC, followed by the start of another
+                    current.pop()
+                    out.append("".join(current))
+                    current[:] = ["\x1b"]
+                else:
+                    out.append("".join(current))
+                    current.clear()
+                    state = _GROUND
+            elif state == _CSI:
+                current.append(ch)
+                if "\x40" <= ch <= "\x7e":
+                    out.append("".join(current))
+                    current.clear()
+                    state = _GROUND
+            elif state == _SS3:
+                current.append(ch)
+                out.append("".join(current))
+                current.clear()
+                state = _GROUND
+            elif state == _STRING:
+                if ch == "\x1b":
+                    state = _STRING_ESCAPE
+                else:
+                    current.append(ch)
+                    if ch == "\x07":
+                        out.append("".join(current))
+                        current.clear()
+                        state = _GROUND
+            else:  # _STRING_ESCAPE
+                if ch == "\\":
+                    current.append("\x1b\\")
+                    out.append("".join(current))
+                    current.clear()
+                    state = _GROUND
+                else:
+                    # ESC cancels the string, and starts a new sequence
+                    out.append("".join(current))
+                    current[:] = ["\x1b"]
+                    state = _ESCAPE
+                    i -= 1
+        self._state = state
+        return out
+
+
+class Event:
+    """ Base class for input events.
+    """
+
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, name) == getattr(other, name)
+                                                 for name in self.__slots__)
+
+    def __hash__(self):
+        return hash(tuple(getattr(self, name) for name in self.__slots__))
+
+    def __repr__(self):
+        args = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{self.__class__.__name__}({args})"
+
+
+class Key(Event):
+    """ A key press. The name is the character typed (for example,
+    "a" or "A"), or the name of a special key, such as "enter", "up" or
+    "f1". Ctrl+letter keys are reported as the letter with `ctrl` set.
+    """
+
+    __slots__ = ("name", "shift", "alt", "ctrl", "seq")
+
+    def __init__(self, name, shift=False, alt=False, ctrl=False, seq=None):
+        self.name = name
+        self.shift = shift
+        self.alt = alt
+        self.ctrl = ctrl
+        self.seq = name if seq is None else seq
+
+    def __eq__(self, other):
+        # Different terminals send different sequences for the same key
+        return (isinstance(other, Key) and (self.name, self.shift, self.alt, self.ctrl) ==
+                (other.name, other.shift, other.alt, other.ctrl))
+
+    def __hash__(self):
+        return hash((self.name, self.shift, self.alt, self.ctrl))
+
+
+class Mouse(Event):
+    """ A mouse event, reported in SGR (1006) mode. The action is one
+    of "press", "release", "move" or "scroll". Buttons are numbered
+    from 1 (left); for scrolling, 4 is up and 5 is down. Lines and
+    columns count from 1.
+    """
+
+    __slots__ = ("action", "button", "line", "col", "shift", "alt", "ctrl")
+
+    def __init__(self, action, button, line, col, shift=False, alt=False, ctrl=False):
+        self.action = action
+        self.button = button
+        self.line = line
+        self.col = col
+        self.shift = shift
+        self.alt = alt
+        self.ctrl = ctrl
+
+
+class Paste(Event):
+    """ Text pasted in bracketed paste mode.
+    """
+
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class Resize(Event):
+    """ A change in the size of the terminal, in lines and columns.
+    """
+
+    __slots__ = ("lines", "cols")
+
+    def __init__(self, lines, cols):
+        self.lines = lines
+        self.cols = cols
+
+
+class Reply(Event):
+    """ Any other control sequence, such as a reply to a query.
+    """
+
+    __slots__ = ("seq",)
+
+    def __init__(self, seq):
+        self.seq = seq
+
+
+# Names of keys sent as single control characters
+_CONTROL_KEYS = {"\r": "enter", "\n": "enter", "\t": "tab", "\x7f": "backspace", "\x08": "backspace",
+                 "\x1b": "escape", "\x00": "space"}
+
+# Names of keys sent as CSI (or SS3) sequences with a final letter
+_LETTER_KEYS = {"A": "up", "B": "down", "C": "right", "D": "left", "E": "begin", "F": "end", "H": "home",
+                "P": "f1", "Q": "f2", "R": "f3", "S": "f4"}
+
+# Names of keys sent as "CSI number ~" sequences
+_TILDE_KEYS = {1: "home", 2: "insert", 3: "delete", 4: "end", 5: "page-up", 6: "page-down", 7: "home",
+               8: "end", 11: "f1", 12: "f2", 13: "f3", 14: "f4", 15: "f5", 17: "f6", 18: "f7", 19: "f8",
+               20: "f9", 21: "f10", 23: "f11", 24: "f12"}
+
+PASTE_START = "\x1b[200~"
+PASTE_END = "\x1b[201~"
+
+
+class InputDecoder:
+    """ Incremental decoder of terminal input into events.
+
+    Input can be fed as bytes (which are decoded as UTF-8, allowing for
+    characters split between reads) or as text. Incomplete sequences
+    are held back until the rest arrives; if nothing more arrives
+    within :data:`ESCAPE_TIMEOUT`, :meth:`flush` should be called to
+    take what there is as it stands, so that a bare ESC is reported as
+    the escape key.
+    """
+
+    def __init__(self):
+        self._utf8 = getincrementaldecoder("utf-8")("replace")
+        self._parser = SequenceParser()
+        self._paste = None
+
+    @property
+    def pending(self):
+        """ Whether an incomplete escape sequence is being held back.
+        """
+        return bool(self._parser.pending)
+
+    def feed(self, data):
+        """ Decode more input, returning a list of the events that it
+        completes.
+        """
+        if isinstance(data, bytes):
+            data = self._utf8.decode(data)
+        events = []
+        for seq in self._parser.feed(data):
+            if self._paste is not None:
+                # Pasted text is taken as it is, escapes and all
+                if seq == PASTE_END:
+                    events.append(Paste("".join(self._paste)))
+                    self._paste = None
+                else:
+                    self._paste.append(seq)
+            elif seq == PASTE_START:
+                self._paste = []
+            elif seq.startswith("\x1b"):
+                events.append(self._decode_sequence(seq))
+            else:
+                events.extend(map(self._decode_char, seq))
+        return events
+
+    def flush(self):
+        """ Take any incomplete sequence as it stands, returning a list
+        of events for it.
+        """
+        pending = self._parser.reset()
+        if not pending:
+            return []
+        elif self._paste is not None:
+            self._paste.append(pending)
+            return []
+        elif pending == "\x1b":
+            return [Key("escape", seq=pending)]
+        elif len(pending) == 2:
+            # ESC followed by "[", "O" or "P" (etc) typed with Alt
+            return [Key(pending[1], alt=True, seq=pending)]
+        else:
+            return [Reply(pending)]
+
+    @classmethod
+    def _decode_char(cls, ch, alt=False):
+        seq = f"\x1b{ch}" if alt else ch
+        try:
+            return Key(_CONTROL_KEYS[ch], alt=alt, seq=seq)
+        except KeyError:
+            if ch < " ":
+                return Key(chr(ord(ch) + 0x60), alt=alt, ctrl=True, seq=seq)
+            else:
+                return Key(ch, alt=alt, seq=seq)
+
+    @classmethod
+    def _decode_sequence(cls, seq):
+        if seq.startswith("\x1b["):
+            return cls._decode_csi(seq)
+        elif seq.startswith("\x1bO") and len(seq) == 3 and seq[2] in _LETTER_KEYS:
+            return Key(_LETTER_KEYS[seq[2]], seq=seq)
+        elif len(seq) == 2:
+            return cls._decode_char(seq[1], alt=True)
+        elif seq == "\x1b":
+            # Followed directly by another escape sequence
+            return Key("escape", seq=seq)
+        else:
+            return Reply(seq)
+
+    @classmethod
+    def _decode_csi(cls, seq):
+        params, final = seq[2:-1], seq[-1]
+        if params.startswith("<") and final in "Mm":
+            return cls._decode_mouse(seq, params[1:], final)
+        try:
+            args = [int(arg) if arg else 1 for arg in params.split(";")] if params else []
+        except ValueError:
+            return Reply(seq)
+        if final == "t" and len(args) >= 3 and args[0] == 48:
+            # In-band resize notification (mode 2048)
+            return Resize(args[1], args[2])
+        if final == "~" and args and args[0] in _TILDE_KEYS:
+            name = _TILDE_KEYS[args[0]]
+            modifiers = args[1] if len(args) > 1 else 1
+        elif final == "Z" and not params:
+            return Key("tab", shift=True, seq=seq)
+        elif final in _LETTER_KEYS and (len(args) == 0 or (len(args) == 2 and args[0] == 1)):
+            if final == "R" and args:
+                # Indistinguishable from a cursor position report
+                return Reply(seq)
+            name = _LETTER_KEYS[final]
+            modifiers = args[1] if args else 1
+        else:
+            return Reply(seq)
+        bits = modifiers - 1
+        return Key(name, shift=bool(bits & 1), alt=bool(bits & 2), ctrl=bool(bits & 4), seq=seq)
+
+    @classmethod
+    def _decode_mouse(cls, seq, params, final):
+        try:
+            b, col, line = map(int, params.split(";"))
+        except ValueError:
+            return Reply(seq)
+        shift, alt, ctrl = bool(b & 4), bool(b & 8), bool(b & 16)
+        if b & 64:
+            action, button = "scroll", 4 + (b & 3)
+        elif b & 32:
+            # Button 0 means that no button is held
+            action, button = "move", ((b & 3) + 1) % 4
+        elif final == "m":
+            action, button = "release", (b & 3) + 1
+        else:
+            action, button = "press", (b & 3) + 1
+        return Mouse(action, button, line, col, shift=shift, alt=alt, ctrl=ctrl)
+
+
+def query(request, done, cin=stdin, cout=stdout, timeout=None):
+    """ Write a request to the terminal, then read replies until one
+    for which `done(reply)` is true, returning the list of replies up
+    to and including that one. If that reply has not arrived by the
+    time the timeout (default :data:`QUERY_TIMEOUT`) expires, the query
+    is taken to be unsupported, and None is returned.
+
+    Where input is not a terminal, it is read without changing modes.
+    Where input has no file descriptor (for example, when testing), it
+    is read a character at a time, without a timeout.
+    """
+    if timeout is None:
+        timeout = QUERY_TIMEOUT
+    try:
+        original_settings = tcgetattr(cin)
+    except (AttributeError, OSError, TermiosError, ValueError):
+        original_settings = None
+    try:
+        if original_settings is not None:
+            setcbreak(cin.fileno())
+        cout.write(request)
+        cout.flush()
+        return read_replies(done, cin, monotonic() + timeout)
+    finally:
+        if original_settings is not None:
+            tcsetattr(cin, TCSADRAIN, original_settings)
+
+
+# Input other than replies read while waiting for the replies to a
+# query, kept for the next reader of each file descriptor.
+_unread = {}
+
+
+def unread(cin):
+    """ Take any input, other than replies, that was read from a
+    stream while waiting for replies.
+    """
+    try:
+        return _unread.pop(cin.fileno(), "")
+    except (AttributeError, OSError, ValueError):
+        return ""
+
+
+def _is_reply(seq):
+    """ Whether a sequence read from the terminal is a reply, rather
+    than typed (or pasted) input.
+    """
+    return (seq.startswith("\x1b") and seq not in (PASTE_START, PASTE_END)
+            and isinstance(InputDecoder._decode_sequence(seq), Reply))
+
+
+def read_replies(done, cin=stdin, deadline=None):
+    """ Read replies from the terminal, as for :func:`query`, until the
+    given deadline (as a :func:`time.monotonic` time). Any other input
+    read in the meantime, whether the replies arrive or not, is kept
+    for the next reader (see :func:`unread`).
+    """
+    if deadline is None:
+        deadline = monotonic() + QUERY_TIMEOUT
+    try:
+        fd = cin.fileno()
+    except (AttributeError, OSError, ValueError):
+        fd = None
+    parser = SequenceParser()
+    decoder = getincrementaldecoder("utf-8")("replace")
+    replies = []
+    kept = []
+    pasting = False
+    data = unread(cin)
+    try:
+        while True:
+            sequences = parser.feed(data)
+            for i, seq in enumerate(sequences):
+                if seq == PASTE_START:
+                    pasting = True
+                elif seq == PASTE_END:
+                    pasting = False
+                elif not pasting and _is_reply(seq):
+                    replies.append(seq)
+                    if done(seq):
+                        kept.extend(sequences[i + 1:])
+                        return replies
+                    continue
+                kept.append(seq)
+            if fd is None:
+                data = cin.read(1)
+                if not data:
+                    return None
+            else:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return None
+                ready, _, _ = select([fd], [], [], remaining)
+                if not ready:
+                    return None
+                chunk = os_read(fd, READ_SIZE)
+                if not chunk:
+                    return None
+                data = decoder.decode(chunk)
+    finally:
+        rest = "".join(kept) + parser.pending
+        if rest and fd is not None:
+            _unread[fd] = rest
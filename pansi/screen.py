@@ -16,13 +16,231 @@
 # limitations under the License.
 
 
+import asyncio
+from array import array
+from collections import deque
 from fcntl import ioctl
+from os import close, pipe, read as os_read, set_blocking, write as os_write
+from select import select
+from signal import SIGWINCH, getsignal, signal
 from sys import stdin, stdout
 from termios import tcgetattr, tcsetattr, TCSAFLUSH, TIOCGWINSZ
+from time import monotonic, sleep
 from tty import setcbreak
+from unicodedata import east_asian_width
 
+from pansi import capabilities, reader
 from pansi.codes import ESC, CSI, cur, x, bold, faint, italic, rev, blink, strike, underline, BLACK, bg, RED, GREEN, \
-    YELLOW, BLUE, MAGENTA, CYAN, WHITE, black, red, green, yellow, blue, magenta, cyan, white
+    YELLOW, BLUE, MAGENTA, CYAN, WHITE, black, red, green, yellow, blue, magenta, cyan, white, \
+    pack_colour, DEFAULT_COLOUR, Pen
+from pansi.reader import Key, Reply, Resize
+
+
+# Synchronized update markers (mode 2026), between which a terminal
+# holds back drawing so that a frame appears all at once.
+SYNC_START = f"{CSI}?2026h"
+SYNC_END = f"{CSI}?2026l"
+
+#: Codepoint held by the second cell of a wide character in a
+#: :class:`Grid`. This lies outside the range of Unicode, and so can
+#: never be written in its own right.
+CONTINUATION = 0x110000
+
+_SPACE = ord(" ")
+
+
+def _is_wide(codepoint):
+    return codepoint != CONTINUATION and codepoint > 0x7F and east_asian_width(chr(codepoint)) in ("W", "F")
+
+
+def _cells(text):
+    # Codepoints of text laid out in cells, with wide characters
+    # followed by a continuation cell
+    cells = array("I")
+    for ch in text:
+        cells.append(ord(ch))
+        if east_asian_width(ch) in ("W", "F"):
+            cells.append(CONTINUATION)
+    return cells
+
+
+class Grid:
+    """ Rectangular grid of character cells, each holding a single
+    character and the style with which that character is drawn. A wide
+    character takes up two cells, the second marked as a continuation
+    of the first.
+
+    Cells are stored in parallel, flat arrays (planes) of codepoints,
+    packed foreground and background colours (see
+    :func:`pansi.codes.pack_colour`) and attribute flags. A codepoint
+    of zero marks a cell whose content is unknown. Rows that have been
+    written to since the last call to :meth:`clean` are flagged in a
+    dirty bitmap, so that comparison with another grid only needs to
+    look at those rows, and does so with bulk slice comparisons.
+    """
+
+    #: Longest run of unchanged cells that will be rewritten rather
+    #: than skipped over with a cursor movement.
+    max_gap = 3
+
+    #: Number of cells compared at a time when narrowing down which
+    #: parts of a changed row differ.
+    block_size = 32
+
+    def __init__(self, lines, cols, fill=" "):
+        self.lines = lines
+        self.cols = cols
+        size = lines * cols
+        self.chars = array("I", [ord(fill) if fill else 0]) * size
+        self.fgs = array("I", [DEFAULT_COLOUR]) * size
+        self.bgs = array("I", [DEFAULT_COLOUR]) * size
+        self.attrs = array("H", [0]) * size
+        self.dirty = bytearray(b"\x01" * lines)
+
+    @property
+    def planes(self):
+        return self.chars, self.fgs, self.bgs, self.attrs
+
+    def put(self, line, col, text, fg=None, bg=None, attrs=0):
+        """ Write text into the grid, starting at the given (zero-based)
+        line and column. Colours may be given as palette indexes or
+        (r, g, b) tuples, and attributes as a combination of flags
+        from :mod:`pansi.codes`. Text that runs off either edge is
+        clipped.
+
+        Wide (East Asian) characters occupy two cells, the second of
+        which holds :data:`CONTINUATION`. Where clipping, or writing
+        over one half of a wide character already in the grid, would
+        leave only half of a wide character, the other half is replaced
+        by a space.
+        """
+        if not 0 <= line < self.lines:
+            return
+        text = str(text)
+        if text.isascii():
+            cells = array("I", map(ord, text))
+        else:
+            cells = _cells(text)
+        if col < 0:
+            cells = cells[-col:]
+            col = 0
+        cells = cells[:self.cols - col]
+        if not cells:
+            return
+        if cells[0] == CONTINUATION:
+            cells[0] = _SPACE
+        if _is_wide(cells[-1]):
+            # The second half fell off the right edge
+            cells[-1] = _SPACE
+        n = len(cells)
+        chars = self.chars
+        row = line * self.cols
+        start = row + col
+        end = start + n
+        if col > 0 and chars[start] == CONTINUATION:
+            chars[start - 1] = _SPACE
+        if end < row + self.cols and chars[end] == CONTINUATION:
+            chars[end] = _SPACE
+        chars[start:end] = cells
+        self.fgs[start:end] = array("I", [pack_colour(fg)]) * n
+        self.bgs[start:end] = array("I", [pack_colour(bg)]) * n
+        self.attrs[start:end] = array("H", [attrs]) * n
+        self.dirty[line] = 1
+
+    def fill(self, ch=" "):
+        size = self.lines * self.cols
+        self.chars[:] = array("I", [ord(ch) if ch else 0]) * size
+        self.fgs[:] = array("I", [DEFAULT_COLOUR]) * size
+        self.bgs[:] = array("I", [DEFAULT_COLOUR]) * size
+        self.attrs[:] = array("H", [0]) * size
+        self.touch()
+
+    def touch(self):
+        """ Mark every row as dirty.
+        """
+        self.dirty[:] = b"\x01" * self.lines
+
+    def clean(self):
+        self.dirty[:] = bytes(self.lines)
+
+    def dirty_lines(self):
+        return [line for line, flag in enumerate(self.dirty) if flag]
+
+    def copy_from(self, other, lines=None):
+        """ Copy cell contents from another grid of the same size,
+        optionally limited to a subset of lines.
+        """
+        cols = self.cols
+        for line in (range(self.lines) if lines is None else lines):
+            start = line * cols
+            end = start + cols
+            for plane, other_plane in zip(self.planes, other.planes):
+                plane[start:end] = other_plane[start:end]
+
+    def _same(self, previous, start, end):
+        return all(plane[start:end] == old_plane[start:end]
+                   for plane, old_plane in zip(self.planes, previous.planes))
+
+    def changes(self, previous, lines=None):
+        """ Generate a sequence of (line, start, end) column ranges that
+        describe where this grid differs from a previous one. Unchanged
+        gaps shorter than a cursor movement sequence are absorbed into
+        the surrounding run, since rewriting them is cheaper than
+        jumping over them.
+        """
+        if lines is None:
+            lines = self.dirty_lines()
+        cols = self.cols
+        block_size = self.block_size
+        planes = list(zip(self.planes, previous.planes))
+        for line in lines:
+            row = line * cols
+            if self._same(previous, row, row + cols):
+                continue
+            start = end = None
+            for block in range(0, cols, block_size):
+                block_end = min(block + block_size, cols)
+                if self._same(previous, row + block, row + block_end):
+                    continue
+                for col in range(block, block_end):
+                    i = row + col
+                    if any(plane[i] != old_plane[i] for plane, old_plane in planes):
+                        if start is None:
+                            start = col
+                        elif col - end > self.max_gap:
+                            yield line, start, end
+                            start = col
+                        end = col + 1
+            if start is not None:
+                yield line, start, end
+
+
+def _chain_resize_handler(callback):
+    # Install a SIGWINCH handler that calls back, then calls whatever
+    # handler was there before. Returns a function that takes it out
+    # again: the earlier handler is put back only if no other has since
+    # been installed over this one (which would then be lost, along
+    # with everything that it chains to); otherwise, this one stays in
+    # the chain, but no longer calls back. Raises ValueError outside
+    # the main thread, where handlers cannot be set.
+    previous = getsignal(SIGWINCH)
+    active = True
+
+    def on_resize(signum, frame):
+        if active:
+            callback()
+        if callable(previous):
+            previous(signum, frame)
+
+    def remove():
+        nonlocal active
+        active = False
+        # A handler installed other than from Python cannot be put back
+        if getsignal(SIGWINCH) is on_resize and previous is not None:
+            signal(SIGWINCH, previous)
+
+    signal(SIGWINCH, on_resize)
+    return remove
 
 
 class Screen:
@@ -38,56 +256,168 @@ class Screen:
         self.cbreak = cbreak
         self.cursor = cursor
         self.original_mode = None
+        self.front = None
+        self.back = None
+        self.pen = Pen()
+        self.pen.invalidate()
+        #: Time to wait after ESC for the rest of an escape sequence.
+        self.escape_timeout = reader.ESCAPE_TIMEOUT
+        self._decoder = reader.InputDecoder()
+        self._events = deque()
+        self._resized = False
+        self._wake = None
+        self._remove_resize_handler = None
+        #: Whether to wrap frames in synchronized update markers. If
+        #: None, this is done when the (already known) capabilities of
+        #: the terminal say that it supports them.
+        self.synchronized = None
+        self._output = []
+        self._deferred = False
 
     def __enter__(self):
+        self._watch_resize()
         if not self.cursor:
             self.hide_cursor()
         self.show()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self._unwatch_resize()
         self.hide()
         self.show_cursor()
 
-    def _read_ss3(self, seq):
-        while True:
-            ch = self.cin.read(1)
-            seq += ch
-            if 0x40 <= ord(ch) <= 0x7E:
-                break
-        return seq
+    def read_event(self, timeout=None):
+        """ Wait for, and return, the next input event: a
+        :class:`pansi.reader.Key`, :class:`~pansi.reader.Mouse`,
+        :class:`~pansi.reader.Paste`, :class:`~pansi.reader.Resize` or
+        :class:`~pansi.reader.Reply`. Returns None if no event arrives
+        before the timeout (if any) expires, or at the end of input.
+
+        Input is read in bulk, so several events may arrive at once;
+        any beyond the first are kept for later calls. While the screen
+        is in use as a context manager, resize events are raised for
+        SIGWINCH as well as for in-band notifications.
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        events = self._events
+        if not events:
+            events.extend(self._decoder.feed(reader.unread(self.cin)))
+        while not events:
+            if self._resized:
+                self._resized = False
+                return Resize(*self.size)
+            wait = None if deadline is None else max(0.0, deadline - monotonic())
+            if self._decoder.pending:
+                # Wait only a moment for the rest of an escape sequence
+                wait = self.escape_timeout if wait is None else min(wait, self.escape_timeout)
+            data = self._read_input(wait)
+            if data:
+                events.extend(self._decoder.feed(data))
+            elif data is not None or self._decoder.pending:
+                # At the end of input, or out of time for the rest of
+                # an escape sequence, take what there is.
+                events.extend(self._decoder.flush())
+                if data is not None and not events:
+                    return None
+            elif deadline is not None and monotonic() >= deadline:
+                return None
+        return events.popleft()
 
-    def _read_csi(self, seq):
+    def read_key(self):
+        """ Wait for, and return, the next key press, as a
+        :class:`pansi.reader.Key`. Any other events in the meantime are
+        discarded; use :meth:`read_event` to receive those too.
+        """
         while True:
-            ch = self.cin.read(1)
-            seq += ch
-            if 0x40 <= ord(ch) <= 0x7E:
-                break
-        return seq
-
-    def _read_esc(self, seq):
-        ch = self.cin.read(1)
-        seq += ch
-        if ch == "[":
-            return self._read_csi(seq)
-        elif ch == "O":
-            return self._read_ss3(seq)
+            event = self.read_event()
+            if event is None:
+                raise EOFError("End of input")
+            elif isinstance(event, Key):
+                return event
+
+    def _read_input(self, timeout):
+        # Returns whatever input is available (empty at the end of
+        # input) or None if there is none before the timeout, or the
+        # wait is interrupted by a resize.
+        try:
+            fd = self.cin.fileno()
+        except (AttributeError, OSError, ValueError):
+            # Not a real stream (for example, when testing)
+            return self.cin.read(reader.READ_SIZE)
+        fds = [fd] if self._wake is None else [fd, self._wake[0]]
+        ready, _, _ = select(fds, [], [], timeout)
+        if self._wake is not None and self._wake[0] in ready:
+            os_read(self._wake[0], reader.READ_SIZE)
+        if fd in ready:
+            return os_read(fd, reader.READ_SIZE)
         else:
-            raise OSError(f"Unknown input sequence {seq!r}")
+            return None
+
+    def _watch_resize(self):
+        # Install a SIGWINCH handler that flags the resize and wakes up
+        # any wait for input, through a pipe. Handlers can only be set
+        # from the main thread; elsewhere, resizes are not reported.
+        if self._wake is not None:
+            return
+        r, w = pipe()
+        set_blocking(w, False)
+
+        def on_resize():
+            self._resized = True
+            try:
+                os_write(w, b"\0")
+            except OSError:
+                pass
 
-    def read_key(self):
-        seq = ""
-        ch = self.cin.read(1)
-        seq += ch
-        if ch == ESC:
-            return self._read_esc(seq)
-        else:
-            return seq
+        try:
+            self._remove_resize_handler = _chain_resize_handler(on_resize)
+        except ValueError:
+            close(r)
+            close(w)
+            return
+        self._wake = (r, w)
+
+    def _unwatch_resize(self):
+        if self._wake is None:
+            return
+        self._remove_resize_handler()
+        self._remove_resize_handler = None
+        for fd in self._wake:
+            close(fd)
+        self._wake = None
+
+    def read_response(self, timeout=None):
+        """ Read the next control sequence sent by the terminal, as an
+        (args, function) pair, waiting only until the timeout (default
+        :data:`pansi.reader.QUERY_TIMEOUT`) expires.
+        """
+        if timeout is None:
+            timeout = reader.QUERY_TIMEOUT
+        replies = reader.read_replies(lambda reply: reply.startswith(ESC), self.cin, monotonic() + timeout)
+        if replies is None:
+            raise OSError("No response from terminal")
+        return self._parse_response(replies[-1])
+
+    def query(self, request, function, timeout=None):
+        """ Send a request to the terminal and return the (args,
+        function) pair from the reply ending with the given function
+        character. Other input arriving in the meantime is kept for
+        :meth:`read_event`.
+        """
+        self._send_output()
+        replies = reader.query(request, lambda reply: reply.startswith(CSI) and reply.endswith(function),
+                               self.cin, self.cout, timeout)
+        if replies is None:
+            raise OSError(f"No response from terminal to {request!r}")
+        return self._parse_response(replies[-1])
 
-    def read_response(self):
-        seq = self.read_key()
-        if seq.startswith(f"{ESC}["):
-            args = tuple(map(int, seq[2:-1].split(";")))
+    @classmethod
+    def _parse_response(cls, seq):
+        if seq.startswith(CSI):
+            try:
+                args = tuple(map(int, seq[2:-1].split(";")))
+            except ValueError:
+                raise OSError(f"Unexpected response {seq!r}")
             function = seq[-1]
             return args, function
         else:
@@ -95,29 +425,21 @@ class Screen:
 
     @property
     def size_px(self):
-        self.cout.write(f"{CSI}14t")
-        self.cout.flush()
-        args, function = self.read_response()
-        if function == "t":
-            if args[0] == 4:
-                return args[1:]
-            else:
-                raise OSError(f"Unexpected response {function!r} {args[0]!r}")
-        else:
-            raise OSError(f"Unexpected response {function!r}")
+        """ Size of the screen in pixels, as (height, width).
+        """
+        size_px = capabilities.capabilities(self.cin, self.cout).size_px
+        if size_px is None:
+            raise OSError("Terminal did not report its size in pixels")
+        return size_px
 
     @property
     def cell_size(self):
-        self.cout.write(f"{CSI}16t")
-        self.cout.flush()
-        args, function = self.read_response()
-        if function == "t":
-            if args[0] == 6:
-                return args[1:]
-            else:
-                raise OSError(f"Unexpected response {function!r} {args[0]!r}")
-        else:
-            raise OSError(f"Unexpected response {function!r}")
+        """ Size of a character cell in pixels, as (height, width).
+        """
+        cell_size = capabilities.capabilities(self.cin, self.cout).cell_size
+        if cell_size is None:
+            raise OSError("Terminal did not report its cell size")
+        return cell_size
 
     @property
     def size(self):
@@ -143,28 +465,104 @@ class Screen:
 
     @property
     def cur_pos(self):
-        self.cout.write(f"{CSI}6n")
-        self.cout.flush()
-        args, function = self.read_response()
-        if function == "R":
-            return args
-        else:
-            raise OSError(f"Unexpected response {function!r}")
+        args, _ = self.query(f"{CSI}6n", "R")
+        return args
 
     @cur_pos.setter
     def cur_pos(self, row_column):
         row, column = row_column
-        self.cout.write(f"{CSI}{row};{column}H")
+        self._output.append(f"{CSI}{row};{column}H")
+
+    @property
+    def buffer(self):
+        """ Back buffer into which the next frame is drawn, created on
+        first use to match the current screen size.
+        """
+        if self.back is None:
+            self.resize(*self.size)
+        return self.back
+
+    def resize(self, lines, cols):
+        """ Recreate the front and back buffers for a new screen size.
+        The front buffer content is unknown at this point, so the next
+        call to :meth:`present` will repaint every cell.
+        """
+        self.back = Grid(lines, cols)
+        self.front = Grid(lines, cols, fill=None)
+
+    def present(self):
+        """ Draw the back buffer to the terminal, emitting only those
+        cells that differ from what is already on screen, and send it
+        with any other buffered output as a single frame. While a
+        :class:`FrameScheduler` is running, this is left to its next
+        frame.
+        """
+        self.buffer  # create the buffers, if not already there
+        if not self._deferred:
+            self._frame()
+
+    def _render_changes(self):
+        back = self.back
+        front = self.front
+        chars, fgs, bgs, attrs = back.planes
+        pen = self.pen
+        out = []
+        row = column = None
+        cols = back.cols
+        for line, start, end in back.changes(front):
+            offset = line * cols
+            # A wide character is drawn whole, from its first cell, and
+            # moves the cursor past both
+            if chars[offset + start] == CONTINUATION:
+                start -= 1
+            if end < cols and chars[offset + end] == CONTINUATION:
+                end += 1
+            if line != row:
+                out.append(cur.pos(line + 1, start + 1))
+            elif start != column:
+                out.append(cur.hpos(start + 1))
+            for i in range(offset + start, offset + end):
+                if chars[i] != CONTINUATION:
+                    out.append(pen.change(fgs[i], bgs[i], attrs[i]))
+                    out.append(chr(chars[i]))
+            row, column = line, end
+        if out:
+            # Leave the terminal in the default style, so that neither
+            # erasing (which fills with the current background) nor
+            # other output picks up the style of the last cell.
+            out.append(pen.reset())
+        front.copy_from(back, back.dirty_lines())
+        back.clean()
+        return "".join(out)
+
+    def invalidate(self):
+        """ Forget what is on screen, forcing the next call to
+        :meth:`present` to repaint every cell.
+        """
+        if self.front is not None:
+            self.front.fill(None)
+            self.back.touch()
 
     def cursor_forward_tab(self, stops=1):
-        self.cout.write(f"{CSI}{stops}I")
+        self._output.append(f"{CSI}{stops}I")
+
+    def _reset_pen(self):
+        # Undo any style left by drawing cells. Where the pen state is
+        # unknown, it was set by text written directly, and so is left
+        # as it is.
+        if self.pen.known:
+            self._output.append(self.pen.reset())
 
     def clear(self):
-        self.cout.write(f"{CSI}H{CSI}2J")
+        self._reset_pen()
+        self._output.append(f"{CSI}H{CSI}2J")
+        if self.front is not None:
+            self.front.fill()
+            self.back.touch()
 
     def show(self):
-        self.cout.write(f"{CSI}?1049h")
-        self.cout.flush()
+        self._output.append(f"{CSI}?1049h")
+        self.flush()
         self.original_mode = tcgetattr(self.cout)
         setcbreak(self.cout)
         # self.keypad_on()
@@ -172,16 +570,16 @@ class Screen:
     def hide(self):
         # self.keypad_off()
         tcsetattr(self.cout, TCSAFLUSH, self.original_mode)
-        self.cout.write(f"{CSI}?1049l")
-        self.cout.flush()
+        self._output.append(f"{CSI}?1049l")
+        self.flush()
 
     def show_cursor(self):
-        self.cout.write(f"{CSI}?25h")
-        self.cout.flush()
+        self._output.append(f"{CSI}?25h")
+        self.flush()
 
     def hide_cursor(self):
-        self.cout.write(f"{CSI}?25l")
-        self.cout.flush()
+        self._output.append(f"{CSI}?25l")
+        self.flush()
 
     # def keypad_on(self):
     #     self.cout.write(f"{CSI}?1h{ESC}=")
@@ -192,11 +590,366 @@ class Screen:
     #     self.cout.flush()
 
     def write(self, *values):
-        for value in values:
-            self.cout.write(str(value))
+        """ Add text to the output buffer, to be sent on the next
+        :meth:`flush`.
+        """
+        self._reset_pen()
+        # Arbitrary text may contain SGR sequences, so the pen state
+        # can no longer be relied upon.
+        self.pen.invalidate()
+        self._output.extend(map(str, values))
 
     def flush(self):
+        """ Send all buffered output to the terminal, in a single write.
+        While a :class:`FrameScheduler` is running, output is instead
+        held until its next frame.
+        """
+        if not self._deferred:
+            self._send_output()
+
+    def _send_output(self):
+        if self._output:
+            data = "".join(self._output)
+            self._output.clear()
+            self._send(data)
+
+    def _send(self, data):
+        # Write with as few system calls as possible: usually one. Any
+        # text written to the stream by other means goes first.
+        try:
+            fd = self.cout.fileno()
+        except (AttributeError, OSError, ValueError):
+            self.cout.write(data)
+            self.cout.flush()
+            return
         self.cout.flush()
+        view = memoryview(data.encode(getattr(self.cout, "encoding", None) or "utf-8"))
+        while view:
+            view = view[os_write(fd, view):]
+
+    def _frame(self):
+        # Gather everything written since the last frame, along with
+        # any changes to the back buffer, and send them all at once.
+        # Returns False, without writing, if there is nothing to send.
+        if self.back is not None:
+            changes = self._render_changes()
+            if changes:
+                self._output.append(changes)
+        if not self._output:
+            return False
+        data = "".join(self._output)
+        self._output.clear()
+        if self._synchronized():
+            data = f"{SYNC_START}{data}{SYNC_END}"
+        self._send(data)
+        return True
+
+    def _synchronized(self):
+        if self.synchronized is None:
+            caps = capabilities.cached(self.cout)
+            return caps is not None and caps.synchronized_output
+        return self.synchronized
+
+
+class FrameScheduler:
+    """ Render loop that writes frames to a screen at a capped rate.
+
+    Each frame gathers everything written to the screen since the last
+    one, along with all changes to its back buffer, and sends them in a
+    single write, wrapped in synchronized update markers where the
+    terminal supports them. Frames in which nothing changed are skipped
+    altogether. While the loop runs, calls to :meth:`Screen.flush` and
+    :meth:`Screen.present` only add to the next frame.
+    """
+
+    def __init__(self, screen, fps=60, clock=monotonic, sleep=sleep):
+        self.screen = screen
+        self.fps = fps
+        self.clock = clock
+        self.sleep = sleep
+        self.frames_written = 0
+        self.frames_skipped = 0
+
+    def frame(self):
+        """ Write a frame now, if anything has changed. Returns whether
+        a frame was written.
+        """
+        if self.screen._frame():
+            self.frames_written += 1
+            return True
+        else:
+            self.frames_skipped += 1
+            return False
+
+    def run(self, render, frames=None):
+        """ Call `render(screen)` once per frame, until it returns
+        False (or for the given number of frames), writing a frame
+        after each call. If rendering falls behind, frames are not
+        bunched up to catch up.
+
+        Before starting, the terminal is probed (once) to find out
+        whether it supports synchronized updates, unless the screen has
+        already been told.
+        """
+        screen = self.screen
+        if screen.synchronized is None:
+            screen.synchronized = capabilities.capabilities(screen.cin, screen.cout).synchronized_output
+        interval = 1 / self.fps
+        next_time = self.clock()
+        screen._deferred = True
+        try:
+            n = 0
+            while frames is None or n < frames:
+                n += 1
+                if render(screen) is False:
+                    break
+                self.frame()
+                next_time += interval
+                delay = next_time - self.clock()
+                if delay > 0:
+                    self.sleep(delay)
+                else:
+                    next_time = self.clock()
+        finally:
+            screen._deferred = False
+        self.frame()
+
+
+class AsyncScreen(Screen):
+    """ A screen driven by an asyncio event loop.
+
+    Input is read whenever the loop sees the input file descriptor
+    become readable, decoded into events and either handed to any query
+    waiting for a reply or queued for :meth:`events`. Output is not
+    flushed by each call to :meth:`flush` or :meth:`present`; instead,
+    these request a frame, and a scheduler task flushes (and presents
+    the back buffer) at most once every :attr:`frame_interval` seconds.
+
+    Use as ``async with AsyncScreen() as screen: ...``, or call
+    :meth:`attach` and :meth:`detach` from within a running loop.
+    """
+
+    #: Minimum time between frames, in seconds.
+    frame_interval = 1 / 60
+
+    def __init__(self, cout=stdout, cin=stdin, cbreak=True, cursor=False):
+        super().__init__(cout=cout, cin=cin, cbreak=cbreak, cursor=cursor)
+        self._loop = None
+        self._queue = None
+        self._waiters = []              # (done, replies, future) for each pending query
+        self._escape_handle = None
+        self._frame_requested = None
+        self._frame_task = None
+        self._drained = []
+        self._attached = False
+
+    async def __aenter__(self):
+        self.attach()
+        self.__enter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.__exit__(exc_type, exc_val, exc_tb)
+        await self.detach()
+
+    def attach(self):
+        """ Start reading input and scheduling frames on the running
+        event loop.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._frame_requested = asyncio.Event()
+        self._loop.add_reader(self.cin.fileno(), self._on_readable)
+        self._frame_task = self._loop.create_task(self._frames())
+        self._attached = True
+        # Input already read by an earlier (blocking) query
+        self._dispatch(self._decoder.feed(reader.unread(self.cin)))
+
+    async def detach(self):
+        """ Stop reading input, and write out any final frame.
+        """
+        if not self._attached:
+            return
+        self._attached = False
+        self._loop.remove_reader(self.cin.fileno())
+        if self._escape_handle is not None:
+            self._escape_handle.cancel()
+        if self._frame_requested.is_set():
+            self._draw()
+        self._frame_task.cancel()
+        try:
+            await self._frame_task
+        except asyncio.CancelledError:
+            pass
+        self._queue.put_nowait(None)
+
+    def _watch_resize(self):
+        # Rather than through loop.add_signal_handler, which replaces
+        # any other handler for good, resizes are handed to the loop
+        # from a handler chained in the same way as for a normal screen.
+        if self._remove_resize_handler is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+            self._remove_resize_handler = _chain_resize_handler(
+                lambda: loop.call_soon_threadsafe(self._on_resize))
+        except (RuntimeError, ValueError):
+            pass
+
+    def _unwatch_resize(self):
+        if self._remove_resize_handler is None:
+            return
+        self._remove_resize_handler()
+        self._remove_resize_handler = None
+
+    def _on_resize(self):
+        capabilities.invalidate()
+        self._queue.put_nowait(Resize(*self.size))
+
+    def _on_readable(self):
+        data = os_read(self.cin.fileno(), reader.READ_SIZE)
+        if self._escape_handle is not None:
+            self._escape_handle.cancel()
+            self._escape_handle = None
+        if not data:
+            # End of input
+            self._loop.remove_reader(self.cin.fileno())
+            self._dispatch(self._decoder.flush())
+            self._queue.put_nowait(None)
+            return
+        self._dispatch(self._decoder.feed(data))
+        if self._decoder.pending:
+            self._escape_handle = self._loop.call_later(self.escape_timeout, self._on_escape_timeout)
+
+    def _on_escape_timeout(self):
+        self._escape_handle = None
+        self._dispatch(self._decoder.flush())
+
+    def _dispatch(self, events):
+        for event in events:
+            if isinstance(event, Reply) and self._waiters:
+                done, replies, future = self._waiters[0]
+                replies.append(event.seq)
+                if done(event.seq):
+                    self._waiters.pop(0)
+                    if not future.done():
+                        future.set_result(replies)
+            else:
+                self._queue.put_nowait(event)
+
+    async def next_event(self, timeout=None):
+        """ Wait for, and return, the next input event, or None if
+        there is none before the timeout (if any) expires, or at the
+        end of input.
+        """
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def events(self):
+        """ Generate input events as they arrive, until the end of
+        input.
+        """
+        while True:
+            event = await self._queue.get()
+            if event is None:
+                return
+            yield event
+
+    async def request(self, request, done, timeout=None):
+        """ Send a request to the terminal, and wait for replies until
+        one for which `done(reply)` is true, returning the list of
+        replies up to and including that one. Returns None if that
+        reply does not arrive before the timeout (default
+        :data:`pansi.reader.QUERY_TIMEOUT`) expires.
+        """
+        if timeout is None:
+            timeout = reader.QUERY_TIMEOUT
+        waiter = (done, [], self._loop.create_future())
+        self._waiters.append(waiter)
+        # Requests go out straight away, not with the next frame
+        self._output.append(request)
+        self._send_output()
+        try:
+            return await asyncio.wait_for(waiter[2], timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    async def query_async(self, request, function, timeout=None):
+        """ Send a request to the terminal and return the (args,
+        function) pair from the CSI reply ending with the given
+        function character. This is the asynchronous form of
+        :meth:`query`, which blocks.
+        """
+        replies = await self.request(request, lambda reply: reply.startswith(CSI) and reply.endswith(function),
+                                     timeout)
+        if replies is None:
+            raise OSError(f"No response from terminal to {request!r}")
+        return self._parse_response(replies[-1])
+
+    async def cursor_position(self, timeout=None):
+        """ Return the (line, column) position of the cursor.
+        """
+        args, _ = await self.query_async(f"{CSI}6n", "R", timeout)
+        return args
+
+    async def probe(self, timeout=None):
+        """ Return the capabilities of the terminal, probing it if they
+        are not already known. Once known, they are also available to
+        :attr:`size_px`, :attr:`cell_size` and the rest of pansi without
+        blocking.
+        """
+        caps = capabilities.cached(self.cout)
+        if caps is None:
+            replies = await self.request(capabilities.PROBE_QUERY, capabilities.is_probe_complete, timeout)
+            caps = capabilities.Capabilities.parse("".join(replies or ()))
+            capabilities.remember(self.cout, caps)
+        return caps
+
+    def flush(self):
+        """ Request a frame, in which output will be flushed.
+        """
+        self._request_frame()
+
+    def present(self):
+        """ Request a frame, in which the back buffer will be drawn to
+        the terminal.
+        """
+        self.buffer  # create the buffers now, to be drawn later
+        self._request_frame()
+
+    async def drain(self):
+        """ Wait until any requested frame has been written.
+        """
+        if self._frame_requested is not None and self._frame_requested.is_set():
+            future = self._loop.create_future()
+            self._drained.append(future)
+            await future
+
+    def _request_frame(self):
+        if self._frame_requested is None:
+            # Not attached to a loop, so behave as a normal screen
+            self._draw()
+        else:
+            self._frame_requested.set()
+
+    def _draw(self):
+        self._frame()
+
+    async def _frames(self):
+        while True:
+            await self._frame_requested.wait()
+            self._frame_requested.clear()
+            self._draw()
+            drained, self._drained = self._drained, []
+            for future in drained:
+                if not future.done():
+                    future.set_result(None)
+            await asyncio.sleep(self.frame_interval)
 
 
 def test_card(screen: Screen):
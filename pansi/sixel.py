@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+# Copyright 2020, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+""" Sixel graphics encoder.
+
+Sixel data describes an image in horizontal bands, six pixels high.
+Within each band, each colour in turn is drawn as a row of characters
+(one per column) whose low six bits mark which of the six pixels in
+that column take that colour.
+"""
+
+
+from re import compile as re_compile
+
+from PIL import Image
+
+from pansi.codes import DCS, ST
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+#: Maximum number of colour registers used.
+MAX_COLOURS = 256
+
+# Character for each combination of six bits
+_SIXELS = bytes(range(63, 127)) + bytes(192)
+
+# Runs of four or more identical sixels are worth compressing
+_RUN = re_compile(rb"(.)\1{3,}")
+
+
+def _compress(data):
+    # Trailing empty sixels need not be drawn at all
+    data = data.rstrip(b"?")
+    return _RUN.sub(lambda m: b"!%d%s" % (len(m.group(0)), m.group(1)), data)
+
+
+def quantize(image, colours=MAX_COLOURS, dither=False):
+    """ Reduce an image to a palette image of (at most) the given
+    number of colours, returning the image and a list of its (r, g, b)
+    palette entries.
+    """
+    image = image.convert("RGB")
+    quantized = image.quantize(colors=colours, method=Image.Quantize.FASTOCTREE,
+                               dither=Image.Dither.FLOYDSTEINBERG if dither else Image.Dither.NONE)
+    palette = quantized.getpalette()[:3 * colours]
+    return quantized, [tuple(palette[i:i + 3]) for i in range(0, len(palette), 3)]
+
+
+def encode(image, colours=MAX_COLOURS, dither=False, use_numpy=True):
+    """ Encode an image as a complete sixel sequence.
+    """
+    quantized, palette = quantize(image, colours, dither)
+    width, height = quantized.size
+    out = [f"{DCS}0;1;0q\"1;1;{width};{height}".encode("ascii")]
+    for _, n in sorted(quantized.getcolors(MAX_COLOURS), key=lambda count_index: count_index[1]):
+        r, g, b = palette[n]
+        out.append(b"#%d;2;%d;%d;%d" % (n, r * 100 // 255, g * 100 // 255, b * 100 // 255))
+    if use_numpy and numpy is not None:
+        bands = _bands_from_array(quantized)
+    else:
+        bands = _bands(quantized)
+    first = True
+    for band in bands:
+        if not first:
+            out.append(b"-")
+        first = False
+        out.append(b"$".join(b"#%d%s" % (colour, _compress(sixels)) for colour, sixels in band))
+    out.append(ST.encode("ascii"))
+    return b"".join(out).decode("ascii")
+
+
+def _bands(image):
+    width, height = image.size
+    pixels = image.getdata()
+    for top in range(0, height, 6):
+        masks = {}
+        for bit, y in enumerate(range(top, min(top + 6, height))):
+            value = 1 << bit
+            row = y * width
+            for x in range(width):
+                colour = pixels[row + x]
+                try:
+                    masks[colour][x] |= value
+                except KeyError:
+                    mask = masks[colour] = bytearray(width)
+                    mask[x] = value
+        yield [(colour, bytes(mask).translate(_SIXELS)) for colour, mask in sorted(masks.items())]
+
+
+def _bands_from_array(image):
+    # For each band, accumulate the bit value of every pixel into a
+    # (colour, column) table in a single pass, rather than testing the
+    # band once for each colour.
+    a = numpy.asarray(image).astype(numpy.intp)
+    width, height = image.size
+    columns = numpy.arange(width)
+    for top in range(0, height, 6):
+        band = a[top:top + 6]
+        weights = numpy.repeat(1 << numpy.arange(len(band)), width)
+        index = (band * width + columns).ravel()
+        table = numpy.bincount(index, weights, minlength=MAX_COLOURS * width)
+        table = table.reshape(-1, width).astype(numpy.uint8)
+        used = numpy.flatnonzero(table.any(axis=1))
+        sixels = table[used] + 63
+        yield [(colour, row.tobytes()) for colour, row in zip(used.tolist(), sixels)]
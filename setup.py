@@ -37,7 +37,7 @@ with open(path_join(dirname(__file__), "README.rst")) as f:
                               ".. image :: {}/raw/master/art/".format(source_url))
 
 
-packages = find_packages(exclude=("demo", "docs", "test"))
+packages = find_packages(exclude=("bench", "demo", "docs", "test"))
 package_metadata = {
     "name": __package__,
     "version": __version__,
@@ -63,6 +63,9 @@ package_metadata = {
         "urllib3",
     ],
     "extras_require": {
+        "numpy": [
+            "numpy",
+        ],
     },
     "license": __license__,
     "classifiers": [
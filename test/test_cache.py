@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Copyright 2020, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+from pansi.cache import LRU, cache_directory
+
+
+def test_least_recently_used_entries_are_evicted():
+    lru = LRU()
+    for key in "abc":
+        lru.put(key, key.upper(), 10)
+    assert lru.get("a") == "A"
+    assert lru.evict(20) == [("b", "B")]
+    assert list(lru) == ["c", "a"]
+    assert lru.used == 20
+
+
+def test_replacing_an_entry_replaces_its_size():
+    lru = LRU()
+    lru.put("a", 1, 10)
+    lru.put("a", 2, 4)
+    assert (len(lru), lru.used, lru.get("a")) == (1, 4, 2)
+
+
+def test_most_recently_used_entry_is_always_kept():
+    lru = LRU()
+    lru.put("a", 1, 10)
+    lru.put("b", 2, 100)
+    assert lru.evict(50) == [("a", 1)]
+    assert "b" in lru and lru.used == 100
+
+
+def test_cache_directory_follows_xdg(monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", "/tmp/xdg")
+    assert cache_directory("http") == "/tmp/xdg/pansi/http"
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Copyright 2020, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+from io import StringIO
+from os import close, fdopen, getpid, kill, pipe
+from signal import SIGWINCH
+
+from pytest import fixture
+
+from pansi.capabilities import Capabilities, capabilities, invalidate, probe
+from pansi.screen import Screen
+
+
+KITTY_REPLY = "\x1b_Gi=31;OK\x1b\\"
+SIZE_PX_REPLY = "\x1b[4;600;800t"
+CELL_SIZE_REPLY = "\x1b[6;20;10t"
+TRUECOLOR_REPLY = "\x1bP1$r0;38:2::1:2:3m\x1b\\"
+SYNC_REPLY = "\x1b[?2026;2$y"
+DA1_REPLY = "\x1b[?62;4;22c"
+
+
+@fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.delenv("COLORTERM", raising=False)
+    invalidate()
+    yield
+    invalidate()
+
+
+def test_parse_full_reply():
+    c = Capabilities.parse(KITTY_REPLY + SIZE_PX_REPLY + CELL_SIZE_REPLY + TRUECOLOR_REPLY + SYNC_REPLY + DA1_REPLY)
+    assert c.kitty_graphics
+    assert c.device_attributes == ("62", "4", "22")
+    assert c.size_px == (600, 800)
+    assert c.cell_size == (20, 10)
+    assert c.truecolor
+    assert c.synchronized_output
+    assert c.sixel
+    assert c.graphics == "kitty"
+
+
+def test_parse_minimal_reply():
+    c = Capabilities.parse("\x1bP0$r\x1b\\" + "\x1b[?1;2c")
+    assert not c.kitty_graphics
+    assert c.size_px is None
+    assert c.cell_size is None
+    assert not c.truecolor
+    assert not c.synchronized_output
+    assert c.graphics is None
+
+
+def test_parse_semicolon_truecolor_reply():
+    assert Capabilities.parse("\x1bP1$r0;38;2;1;2;3m\x1b\\\x1b[?1c").truecolor
+
+
+def test_parse_unrecognised_synchronized_output():
+    assert not Capabilities.parse("\x1b[?2026;0$y\x1b[?1c").synchronized_output
+
+
+def test_truecolor_from_environment(monkeypatch):
+    monkeypatch.setenv("COLORTERM", "truecolor")
+    assert Capabilities.parse(DA1_REPLY).truecolor
+
+
+def test_probe_writes_all_queries_at_once_and_stops_at_da1():
+    cin = StringIO(SIZE_PX_REPLY + DA1_REPLY + "left over")
+    cout = StringIO()
+    c = probe(cin, cout)
+    assert c.size_px == (600, 800)
+    assert c.graphics == "sixel"
+    assert cout.getvalue().endswith("\x1b[c")
+    assert cout.getvalue().count("\x1b[c") == 1
+    assert cin.read() == "left over"
+
+
+def test_probe_restores_style_after_truecolor_query():
+    cout = StringIO()
+    probe(StringIO(DA1_REPLY), cout)
+    sent = cout.getvalue()
+    push = sent.index("\x1b[#{")
+    pop = sent.index("\x1b[#}")
+    assert push < sent.index("\x1b[38;2;1;2;3m") < sent.index("\x1b[0m") < pop
+
+
+def test_capabilities_are_cached_until_resize():
+    cin = StringIO((SIZE_PX_REPLY + DA1_REPLY) * 2)
+    cout = StringIO()
+    first = capabilities(cin, cout)
+    assert capabilities(cin, cout) is first
+    assert cout.getvalue().count("\x1b[c") == 1
+    kill(getpid(), SIGWINCH)
+    second = capabilities(cin, cout)
+    assert second is not first
+    assert cout.getvalue().count("\x1b[c") == 2
+
+
+def test_screen_sizes_share_one_probe():
+    cin = StringIO(SIZE_PX_REPLY + CELL_SIZE_REPLY + DA1_REPLY)
+    cout = StringIO()
+    screen = Screen(cout=cout, cin=cin)
+    assert screen.size_px == (600, 800)
+    assert screen.cell_size == (20, 10)
+    assert cout.getvalue().count("\x1b[c") == 1
+
+
+def test_unanswered_probe_means_no_capabilities():
+    r, w = pipe()
+    with fdopen(r, "r") as cin:
+        c = probe(cin, StringIO(), timeout=0.01)
+    close(w)
+    assert c.graphics is None
+    assert c.size_px is None
+    assert not c.truecolor
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Copyright 2020, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from pansi.codes import sgr, pack_colour, Pen, BOLD_ATTR, FAINT_ATTR, ITALIC_ATTR
+
+
+def test_pack_palette_colour():
+    assert pack_colour(9) == 0x1000009
+
+
+def test_pack_rgb_colour():
+    assert pack_colour((0x12, 0x34, 0x56)) == 0x2123456
+
+
+def test_pen_emits_nothing_without_change():
+    pen = Pen()
+    assert pen.change(attrs=0) == ""
+
+
+def test_pen_merges_parameters():
+    pen = Pen()
+    assert pen.change(fg=pack_colour(1), bg=pack_colour((1, 2, 3)), attrs=BOLD_ATTR) == sgr(1, 31, 48, 2, 1, 2, 3)
+
+
+def test_pen_emits_only_changed_ground():
+    pen = Pen()
+    pen.change(fg=pack_colour((9, 9, 9)), bg=pack_colour((8, 8, 8)))
+    assert pen.change(bg=pack_colour((7, 7, 7))) == sgr(48, 2, 7, 7, 7)
+
+
+def test_pen_restores_attribute_sharing_off_code():
+    pen = Pen()
+    pen.change(fg=pack_colour((200, 200, 200)), attrs=BOLD_ATTR | FAINT_ATTR)
+    assert pen.change(attrs=FAINT_ATTR) == sgr(22, 2)
+
+
+def test_pen_prefers_reset_when_shorter():
+    pen = Pen()
+    pen.change(fg=pack_colour((200, 200, 200)), attrs=BOLD_ATTR | ITALIC_ATTR)
+    assert pen.reset() == sgr(0)
+
+
+def test_invalidated_pen_starts_with_reset():
+    pen = Pen()
+    pen.invalidate()
+    assert pen.change(attrs=BOLD_ATTR) == sgr(0, 1)
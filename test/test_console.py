@@ -17,9 +17,13 @@
 
 
 from io import StringIO
+from logging import INFO, LogRecord
+from threading import Event
+
+from pytest import raises
 
 from pansi import ansi
-from pansi.console import Console
+from pansi.console import AsyncLogHandler, Console, BLOCK, DROP
 
 
 def test_console_write():
@@ -62,3 +66,88 @@ def test_console_critical_output():
     con = Console(__name__, out=captured, verbosity=1)
     con.critical("hello, world")
     assert captured.getvalue() == "{RED}hello, world{_}\n".format(**ansi)
+
+
+class BlockingOutput(StringIO):
+    """ Output stream that holds up all writes until released.
+    """
+
+    def __init__(self):
+        super(BlockingOutput, self).__init__()
+        self.released = Event()
+        self.writes = 0
+
+    def write(self, s):
+        self.released.wait()
+        self.writes += 1
+        return super(BlockingOutput, self).write(s)
+
+
+def test_async_console_output():
+    captured = StringIO()
+    con = Console(__name__ + ".async", out=captured, verbosity=1, async_log=True)
+    con.info("hello")
+    con.warning("world")
+    con.log_handler.flush()
+    assert captured.getvalue() == "hello\n{yellow}world{_}\n".format(**ansi)
+    con.exit()
+
+
+def test_async_console_write_follows_earlier_log_records():
+    captured = StringIO()
+    con = Console(__name__ + ".ordered", out=captured, async_log=True)
+    con.info("first")
+    con.write("second")
+    assert captured.getvalue() == "first\nsecond\n"
+    con.exit()
+
+
+def test_async_console_batches_records():
+    out = BlockingOutput()
+    con = Console(__name__ + ".batched", out=out, async_log=True)
+    for n in range(100):
+        con.info("record %d", n)
+    out.released.set()
+    con.log_handler.flush()
+    assert out.getvalue() == "".join("record %d\n" % n for n in range(100))
+    # One write may have started before the others were queued
+    assert out.writes <= 2
+    con.exit()
+
+
+def test_async_console_drops_records_when_full():
+    out = BlockingOutput()
+    con = Console(__name__ + ".dropping", out=out, async_log=True, log_capacity=5, log_policy=DROP)
+    for n in range(20):
+        con.info("record %d", n)
+    handler = con.log_handler
+    assert handler.dropped > 0
+    assert handler.queued + handler.dropped == 20
+    out.released.set()
+    con.exit()
+    assert out.getvalue().count("\n") == handler.queued
+    assert handler.pending == 0
+
+
+def test_async_console_blocks_when_full():
+    out = BlockingOutput()
+    con = Console(__name__ + ".blocking", out=out, async_log=True, log_capacity=2, log_policy=BLOCK)
+    out.released.set()
+    for n in range(50):
+        con.info("record %d", n)
+    con.exit()
+    assert con.log_handler.dropped == 0
+    assert out.getvalue() == "".join("record %d\n" % n for n in range(50))
+
+
+def test_async_handler_drops_records_once_closed():
+    handler = AsyncLogHandler(StringIO(), capacity=1, policy=BLOCK)
+    handler.close()
+    for n in range(3):
+        handler.emit(LogRecord("test", INFO, __file__, 0, "record %d", (n,), None))
+    assert (handler.queued, handler.dropped) == (0, 3)
+
+
+def test_async_handler_rejects_unknown_policy():
+    with raises(ValueError):
+        AsyncLogHandler(StringIO(), policy="sometimes")
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Copyright 2020, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from base64 import b64decode
+from os import remove
+from re import findall
+from zlib import decompress
+
+from PIL import Image
+
+from pansi import graphics
+
+
+def commands(s):
+    return findall(r"\x1b_G([^;\x1b]*);?([^\x1b]*)\x1b\\", s)
+
+
+def test_command_without_payload():
+    assert graphics.command(a="d", i=3) == "\x1b_Ga=d,i=3\x1b\\"
+
+
+def test_direct_transmission_is_chunked():
+    image = Image.effect_noise((64, 64), 50).convert("RGB")
+    sent = commands(graphics.transmit(image, medium=graphics.DIRECT, compress=False))
+    assert len(sent) > 1
+    assert sent[0][0] == "f=24,s=64,v=64,t=d,m=1,a=T"
+    assert all(control == "m=1" for control, _ in sent[1:-1])
+    assert sent[-1][0] == "m=0"
+    assert all(len(payload) <= graphics.CHUNK_SIZE for _, payload in sent)
+    assert b64decode("".join(payload for _, payload in sent)) == image.tobytes()
+
+
+def test_direct_transmission_can_be_compressed():
+    image = Image.new("RGBA", (100, 100), (1, 2, 3, 4))
+    sent = commands(graphics.transmit(image, medium=graphics.DIRECT, compress=True))
+    assert sent == [("f=32,s=100,v=100,t=d,m=0,a=T,o=z", sent[0][1])]
+    assert decompress(b64decode(sent[0][1])) == image.tobytes()
+
+
+def test_file_transmission():
+    image = Image.new("RGB", (4, 4))
+    (control, payload), = commands(graphics.transmit(image, medium=graphics.FILE))
+    assert control == "f=100,t=t,a=T"
+    filename = b64decode(payload).decode("utf-8")
+    try:
+        assert "tty-graphics-protocol" in filename
+        assert Image.open(filename).size == (4, 4)
+    finally:
+        remove(filename)
+
+
+def test_default_medium_depends_on_locality(monkeypatch):
+    image = Image.new("RGB", (4, 4))
+    monkeypatch.setenv("SSH_CONNECTION", "10.0.0.1 22 10.0.0.2 22")
+    (control, _), = commands(graphics.transmit(image))
+    assert "t=d" in control and "o=z" in control
+
+
+def test_shared_memory_transmission():
+    from multiprocessing.shared_memory import SharedMemory
+    image = Image.effect_noise((16, 8), 50).convert("RGB")
+    (control, payload), = commands(graphics.transmit(image, medium=graphics.SHARED_MEMORY))
+    assert control == f"f=24,s=16,v=8,t=s,S={16 * 8 * 3},a=T"
+    # Play the part of the terminal, which reads then unlinks
+    shm = SharedMemory(b64decode(payload).decode("utf-8").lstrip("/"))
+    try:
+        assert bytes(shm.buf[:16 * 8 * 3]) == image.tobytes()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def test_registry_transmits_each_image_once():
+    registry = graphics.ImageRegistry(medium=graphics.DIRECT)
+    image = Image.new("RGB", (4, 4), (255, 0, 0))
+    first = commands(registry.show(image))
+    assert first[0][0].startswith("f=24,s=4,v=4,t=d,m=0,a=t,i=1,q=2")
+    assert first[-1] == ("a=p,i=1,q=2", "")
+    assert commands(registry.show(image.copy())) == [("a=p,i=1,q=2", "")]
+
+
+def test_registry_evicts_least_recently_shown():
+    registry = graphics.ImageRegistry(budget=2 * 4 * 4 * 4, medium=graphics.DIRECT)
+    red, green, blue = (Image.new("RGB", (4, 4), colour) for colour in ["red", "green", "blue"])
+    registry.show(red)
+    registry.show(green)
+    registry.show(red)
+    sent = commands(registry.show(blue))
+    assert ("a=d,d=I,i=2,q=2", "") in sent
+    assert red in registry and blue in registry and green not in registry
+    assert registry.used == 2 * 4 * 4 * 4
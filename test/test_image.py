@@ -0,0 +1,535 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Copyright 2020, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from collections import Counter
+from io import BytesIO, StringIO
+from os.path import dirname, join as path_join
+from tempfile import NamedTemporaryFile
+from threading import Event, Lock, current_thread, main_thread
+from time import sleep
+
+from PIL import Image, ImageFile
+from pytest import approx, importorskip, mark, raises
+
+from pansi import palette
+from pansi.codes import cur, sgr
+from pansi.image import BlockDelta, BlockImage, ImageLoader, ParallelRenderer, Player, RenderCache, SubCellImage, \
+    TerminalImage, FAILED, LOADED, LOADING, SEXTANT_GLYPHS, expand_sources, slice_fragments, \
+    stream_block_lines, _print_one
+
+
+ART = path_join(dirname(dirname(__file__)), "art")
+
+
+def stripes(width=8, height=8):
+    image = Image.new("RGB", (width, height), (0, 0, 0))
+    for x in range(width):
+        for y in range(height):
+            if (x // 2 + y) % 3 == 0:
+                image.putpixel((x, y), (255, 0, 0))
+            elif (x + y // 3) % 4 == 0:
+                image.putpixel((x, y), (0, 0, 255))
+    return image
+
+
+def test_block_image_lines():
+    image = Image.new("RGB", (2, 2), (255, 0, 0))
+    image.putpixel((1, 1), (0, 0, 255))
+    block_image = BlockImage(image, lines=1, cols=2, use_numpy=False)
+    assert block_image._get_line(0) == [("█▀", (255, 0, 0), (0, 0, 255))]
+
+
+@mark.parametrize("image", [
+    stripes(),
+    stripes(40, 30),
+    Image.open(path_join(ART, "pansies.png")).convert("RGB").resize((96, 64)),
+])
+@mark.parametrize("x_offset", [0, 3])
+def test_numpy_lines_match_python_lines(image, x_offset):
+    importorskip("numpy")
+    lines, cols = image.height // 2, image.width
+    expected = BlockImage(image, lines=lines, cols=cols, use_numpy=False)
+    actual = BlockImage(image, lines=lines, cols=cols, use_numpy=True)
+    expected.offset = actual.offset = (x_offset, 0)
+    assert list(actual.ansi_lines()) == list(expected.ansi_lines())
+
+
+def test_slice_fragments():
+    fragments = [("█▀", (1, 1, 1), (2, 2, 2)), ("▄▄▄", (3, 3, 3), (4, 4, 4))]
+    assert slice_fragments(fragments, 0, 5) is fragments
+    assert slice_fragments(fragments, 1, 4) == [("▀", (1, 1, 1), (2, 2, 2)), ("▄▄", (3, 3, 3), (4, 4, 4))]
+    assert slice_fragments(fragments, 2, 9) == [("▄▄▄", (3, 3, 3), (4, 4, 4))]
+    assert slice_fragments(fragments, 5, 9) == []
+
+
+@mark.parametrize("use_numpy", [False, True])
+def test_horizontal_scrolling_reuses_cached_lines(use_numpy):
+    if use_numpy:
+        importorskip("numpy")
+    image = stripes(40, 30)
+    block_image = BlockImage(image, lines=15, cols=40, use_numpy=use_numpy)
+    block_image.prefetch_lines = 0
+    block_image.view = (5, 10)
+    block_image.scroll_to(12, 4)
+    first = list(block_image.ansi_lines())
+    cached = len(block_image._fragments)
+    block_image.pan(dx=7)
+    assert block_image.offset == (19, 4)
+    block_image.pan(dx=-7)
+    assert len(block_image._fragments) == cached == 5
+    assert list(block_image.ansi_lines()) == first
+    # Each line shows the same cells as that part of the image alone
+    part = BlockImage(image.crop((12, 8, 22, 18)), lines=5, cols=10, use_numpy=use_numpy)
+    for n in range(5):
+        assert cells(block_image._get_line(n)) == cells(part._get_line(n))
+
+
+def cells(fragments):
+    # The (top, bottom) colours of each cell in a line
+    out = []
+    for text, fg, bg in fragments:
+        for ch in text:
+            out.append({"█": (fg, fg), "▀": (fg, bg), "▄": (bg, fg), " ": (bg, bg)}[ch])
+    return out
+
+
+def test_scrolling_is_bounded_by_image():
+    block_image = BlockImage(stripes(40, 30), lines=15, cols=40, use_numpy=False)
+    block_image.prefetch_lines = 0
+    block_image.view = (5, 10)
+    block_image.pan(dx=-3, dy=100)
+    assert block_image.offset == (0, 10)
+    block_image.scroll_to(100, 0)
+    assert block_image.offset == (30, 0)
+
+
+def test_line_cache_evicts_least_recently_used_lines():
+    block_image = BlockImage(Image.new("RGB", (40, 30), (255, 0, 0)), lines=15, cols=40, use_numpy=False)
+    block_image.prefetch_lines = 0
+    block_image._get_line(0)
+    block_image._fragments.budget = 3 * block_image._fragments.used
+    block_image.view = (3, 40)
+    list(block_image.ansi_lines())
+    assert len(block_image._fragments) == 3
+    block_image.pan(dy=1)
+    list(block_image.ansi_lines())
+    assert len(block_image._fragments) == 3
+    assert block_image._key(0) not in block_image._fragments
+    assert block_image._fragments.used <= block_image._fragments.budget
+
+
+def test_prefetch_caches_lines_around_viewport():
+    block_image = BlockImage(stripes(40, 30), lines=15, cols=40, use_numpy=False)
+    block_image.view = (3, 40)
+    block_image.prefetch_lines = 2
+    block_image.scroll_to(0, 5)
+    block_image._prefetching.result()
+    try:
+        cached = sorted(line_no for line_no in block_image.line_numbers
+                        if block_image._key(line_no) in block_image._fragments)
+        assert cached == [3, 4, 8, 9]
+        assert block_image.prefetch() is None
+    finally:
+        block_image.close()
+
+
+def test_zoom_keeps_centre_of_viewport():
+    block_image = BlockImage(stripes(40, 30), lines=15, cols=40, use_numpy=False)
+    block_image.prefetch_lines = 0
+    block_image.view = (5, 10)
+    block_image.scroll_to(10, 4)
+    block_image.zoom(2)
+    assert (block_image.lines, block_image.width) == (30, 80)
+    assert block_image.offset == (25, 10)
+    assert len(list(block_image.ansi_lines())) == 5
+    block_image.zoom(1)
+    assert block_image.offset == (10, 4)
+
+
+@mark.parametrize("depth", [palette.TRUECOLOR, palette.XTERM_256, palette.MONO])
+def test_parallel_lines_match_serial_lines(depth):
+    images = [BlockImage(stripes(40, 30), lines=15, cols=40, depth=depth),
+              BlockImage(stripes(), lines=3, cols=7, depth=depth, dither=palette.ORDERED)]
+    with ParallelRenderer(2, band_lines=4) as renderer:
+        assert list(renderer.render(images)) == [list(image.ansi_lines()) for image in images]
+        assert renderer.ansi_lines(images[1]) == list(images[1].ansi_lines())
+
+
+@mark.parametrize("mode", ["1", "L", "I", "F", "P", "RGBA"])
+def test_parallel_lines_match_serial_lines_in_any_mode(mode):
+    image = BlockImage(stripes(40, 30).convert(mode), lines=15, cols=40)
+    with ParallelRenderer(2, band_lines=4) as renderer:
+        assert renderer.ansi_lines(image) == list(image.ansi_lines())
+
+
+class FakeScreen:
+
+    pixel_width = 80
+    pixel_height = 80
+    cell_width = 8
+    cell_height = 16
+    char_width = 10
+
+
+def test_render_cache_round_trip(tmp_path):
+    cache = RenderCache(str(tmp_path / "render"))
+    assert cache.get("abc", (2, 3), "half") is None
+    cache.put("abc", (2, 3), "half", "\x1b[31m▀▀\x1b[0m")
+    assert cache.get("abc", (2, 3), "half") == "\x1b[31m▀▀\x1b[0m"
+    assert cache.get("abc", (2, 4), "half") is None
+    assert cache.get("abc", (2, 3), "quadrant") is None
+
+
+def test_render_cache_evicts_least_recently_used(tmp_path):
+    directory = tmp_path / "render"
+    cache = RenderCache(str(directory), budget=250)
+    for key in "aba":
+        cache.put(key, (1, 1), "half", key * 100)
+    cache.get("a", (1, 1), "half")
+    cache.put("c", (1, 1), "half", "c" * 100)
+    assert cache.used == 200
+    assert len(list(directory.iterdir())) == 2
+    assert cache.get("b", (1, 1), "half") is None
+    assert cache.get("a", (1, 1), "half") == "a" * 100
+    # A new cache, in the same directory, picks up what is there
+    other = RenderCache(str(directory), budget=250)
+    assert other.get("c", (1, 1), "half") == "c" * 100
+    assert other.used == 200
+
+
+def test_render_cache_removes_failed_writes(tmp_path, monkeypatch):
+    directory = tmp_path / "render"
+    cache = RenderCache(str(directory))
+
+    def full_disk(*args, **kwargs):
+        f = NamedTemporaryFile(*args, **kwargs)
+
+        def write(data):
+            raise OSError(28, "No space left on device")
+
+        f.write = write
+        return f
+
+    monkeypatch.setattr("pansi.image.NamedTemporaryFile", full_disk)
+    with raises(OSError):
+        cache.put("a", (1, 1), "half", "a" * 100)
+    assert list(directory.iterdir()) == []
+
+
+def test_cached_output_is_reused(tmp_path, capsys):
+    filename = str(tmp_path / "stripes.png")
+    stripes(16, 16).save(filename)
+    cache = RenderCache(str(tmp_path / "render"))
+    _print_one(filename, FakeScreen(), None, False, None, palette.TRUECOLOR, None, "half", False, None, cache)
+    rendered = capsys.readouterr().out
+    assert rendered.count("\n") == 1
+    # Prove that the second time round comes from the cache
+    term_image = TerminalImage.load(filename)
+    cache.put(term_image.content_key(), (1, 2), f"half:{palette.TRUECOLOR}:None", "cached")
+    _print_one(filename, FakeScreen(), None, False, None, palette.TRUECOLOR, None, "half", False, None, cache)
+    assert capsys.readouterr().out == "cached\n"
+
+
+def test_content_key_follows_file_content(tmp_path):
+    filename = str(tmp_path / "image.png")
+    stripes().save(filename)
+    key = TerminalImage.load(filename).content_key()
+    assert TerminalImage.load(filename).content_key() == key
+    Image.new("RGB", (8, 8)).save(filename)
+    assert TerminalImage.load(filename).content_key() != key
+
+
+def test_expand_sources(tmp_path):
+    for name in ("b.png", "a.png", "c.jpg"):
+        (tmp_path / name).touch()
+    pattern = str(tmp_path / "*.png")
+    assert expand_sources([pattern, "http://example.com/x*.png"]) == [
+        str(tmp_path / "a.png"), str(tmp_path / "b.png"), "http://example.com/x*.png"]
+    assert expand_sources([], lines=StringIO("one.png\n\ntwo.png\n")) == ["one.png", "two.png"]
+    assert expand_sources(["x.png", "-"], lines=StringIO("y.png\n")) == ["x.png", "y.png"]
+
+
+class SlowLoader(ImageLoader):
+
+    def __init__(self, delays, **kwargs):
+        super().__init__(**kwargs)
+        self.delays = delays
+        self.lock = Lock()
+        self.running = Counter()
+        self.most = Counter()
+
+    def load_one(self, source):
+        host = self.host(source)
+        with self.lock:
+            self.running[host] += 1
+            self.most[host] = max(self.most[host], self.running[host])
+        sleep(self.delays.get(source, 0.01))
+        with self.lock:
+            self.running[host] -= 1
+        if source.endswith("bad"):
+            raise OSError("bad image")
+        return source.upper()
+
+
+def test_loader_limits_requests_per_host():
+    sources = [f"http://{host}/{n}" for n in range(6) for host in ("a", "b")]
+    loader = SlowLoader({}, workers=8, per_host=2)
+    results = list(loader.load(sources))
+    assert results == [(source, source.upper()) for source in sources]
+    assert loader.most == {"a": 2, "b": 2}
+
+
+@mark.parametrize("ordered", [True, False])
+def test_loader_limits_images_not_yet_taken(ordered):
+    sources = [f"http://{host}/{n}" for n in range(10) for host in ("a", "b")]
+    loader = SlowLoader({"http://a/0": 0.1}, workers=2, per_host=1, max_pending=3)
+    started = []
+    loader.load_one = lambda source, load_one=loader.load_one: started.append(source) or load_one(source)
+    taken = []
+    for source, result in loader.load(sources, ordered=ordered):
+        assert len(started) - len(taken) <= 3
+        sleep(0.01)
+        taken.append(source)
+    assert sorted(taken) == sorted(sources)
+    assert loader.most == {"a": 1, "b": 1}
+
+
+def test_loader_results_in_order_or_as_completed():
+    sources = ["http://a/slow", "http://b/fast", "http://c/bad"]
+    delays = {"http://a/slow": 0.2}
+    ordered = list(SlowLoader(delays).load(sources))
+    assert [source for source, _ in ordered] == sources
+    assert isinstance(ordered[2][1], OSError)
+    completed = [source for source, _ in SlowLoader(delays).load(sources, ordered=False)]
+    assert completed[-1] == "http://a/slow"
+
+
+def test_loader_reports_progress_from_calling_thread():
+    calls = []
+
+    def progress(index, source, state):
+        calls.append((index, state, current_thread() is main_thread()))
+
+    list(SlowLoader({}).load(["x", "y.bad"], progress=progress))
+    assert sorted(calls) == [(0, LOADED, True), (0, LOADING, True), (1, FAILED, True), (1, LOADING, True)]
+
+
+def test_loader_decodes_local_images(tmp_path):
+    stripes().save(tmp_path / "a.png")
+    image = Image.new("RGB", (2, 2))
+    ((_, a), (_, b)) = ImageLoader().load([str(tmp_path / "a.png"), image])
+    assert a.image.getpixel((0, 0)) == stripes().getpixel((0, 0))
+    assert b.image is image
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+    def sleep(self, seconds):
+        self.time += seconds
+
+
+def test_player_shows_every_frame_when_on_time():
+    clock = FakeClock()
+    out = StringIO()
+    frames = [(str(n), 50) for n in range(4)]
+    player = Player(frames, render=lambda frame: f"{frame}\nx", out=out, clock=clock, sleep=clock.sleep)
+    player.play()
+    assert player.frames_shown == 4
+    assert player.frames_dropped == 0
+    assert clock.time == approx(0.2)
+    assert out.getvalue() == f"0\nx{cur.prevln(1)}1\nx{cur.prevln(1)}2\nx{cur.prevln(1)}3\nx\n"
+
+
+def test_player_shows_every_frame_when_decoding_is_slow():
+    clock = FakeClock()
+    shown = Event()
+    shown.set()
+
+    def slow_render(frame):
+        # Each frame takes longer to render than to show, and is only
+        # rendered once the one before is on screen.
+        shown.wait()
+        shown.clear()
+        clock.time += 0.03
+        return frame
+
+    class Output(StringIO):
+
+        def write(self, s):
+            shown.set()
+            return super().write(s)
+
+    out = Output()
+    frames = [(str(n), 20) for n in range(20)]
+    player = Player(frames, render=slow_render, out=out, clock=clock, sleep=clock.sleep)
+    player.play()
+    assert player.frames_shown == 20
+    assert player.frames_dropped == 0
+    assert [s for s in out.getvalue().replace("\r", "\n").split("\n") if s] == [str(n) for n in range(20)]
+
+
+def test_player_drops_frames_when_showing_is_slow():
+    clock = FakeClock()
+    decoded = Event()
+
+    def frames():
+        for n in range(5):
+            yield str(n), 20
+        decoded.set()
+
+    class SlowOutput(StringIO):
+
+        def write(self, s):
+            # Wait until every frame is decoded, so that the result
+            # does not depend on the decoding thread
+            decoded.wait()
+            clock.time += 0.05
+            return super().write(s)
+
+    out = SlowOutput()
+    player = Player(frames(), render=lambda frame: frame, out=out, clock=clock, sleep=clock.sleep)
+    player.play()
+    assert [s for s in out.getvalue().replace("\r", "\n").split("\n") if s] == ["0", "2", "4"]
+    assert player.frames_shown == 3
+    assert player.frames_dropped == 2
+
+
+def test_player_opens_animated_image():
+    image = BytesIO()
+    frames = [Image.new("RGB", (4, 4), colour) for colour in ["red", "green", "blue"]]
+    frames[0].save(image, format="GIF", save_all=True, append_images=frames[1:], duration=20)
+    clock = FakeClock()
+    player = Player.open(Image.open(image), lines=2, cols=4, out=StringIO(), clock=clock, sleep=clock.sleep)
+    player.play()
+    assert player.frames_shown == 3
+
+
+@mark.parametrize("use_numpy", [False, True])
+def test_block_delta_emits_only_changed_cells(use_numpy):
+    if use_numpy:
+        importorskip("numpy")
+    before = Image.new("RGB", (20, 6), (0, 0, 0))
+    after = before.copy()
+    after.putpixel((12, 2), (255, 0, 0))
+    after.putpixel((13, 2), (255, 0, 0))
+    delta = BlockDelta()
+    first = delta.encode(BlockImage(before, lines=3, cols=20, use_numpy=use_numpy))
+    assert first.count("\n") == 2
+    second = delta.encode(BlockImage(after, lines=3, cols=20, use_numpy=use_numpy))
+    assert second == f"{cur.up(1)}{cur.hpos(13)}{sgr(38, 2, 255, 0, 0, 48, 2, 0, 0, 0)}▀▀{sgr(0)}{cur.down(1)}"
+
+
+def test_block_delta_with_origin_uses_absolute_moves():
+    before = Image.new("RGB", (4, 4), (0, 0, 0))
+    after = before.copy()
+    after.putpixel((0, 0), (0, 0, 255))
+    delta = BlockDelta(origin=(5, 10))
+    delta.encode(BlockImage(before, lines=2, cols=4))
+    second = delta.encode(BlockImage(after, lines=2, cols=4))
+    assert second.startswith(cur.pos(5, 10))
+    assert second.endswith(cur.pos(6, 14))
+
+
+def test_block_delta_with_no_changes_is_empty():
+    image = Image.new("RGB", (4, 4), (0, 0, 0))
+    delta = BlockDelta()
+    delta.encode(BlockImage(image, lines=2, cols=4))
+    assert delta.encode(BlockImage(image, lines=2, cols=4)) == ""
+
+
+def test_block_image_with_16_colours_uses_indexed_sgr():
+    image = Image.new("RGB", (2, 2), (250, 0, 0))
+    image.putpixel((0, 1), (0, 0, 240))
+    block_image = BlockImage(image, lines=1, cols=2, depth=palette.XTERM_16)
+    assert list(block_image.ansi_lines()) == [f"{sgr(91, 44)}▀█{sgr(0)}"]
+
+
+def test_monochrome_block_image_uses_default_colours():
+    image = Image.new("RGB", (2, 2), (255, 255, 255))
+    image.putpixel((0, 0), (0, 0, 0))
+    block_image = BlockImage(image, lines=1, cols=2, depth=palette.MONO)
+    assert list(block_image.ansi_lines()) == [f"{sgr(7)}▀ {sgr(0)}"]
+
+
+def test_quadrant_split_finds_two_colours():
+    importorskip("numpy")
+    image = Image.new("RGB", (2, 2), (255, 0, 0))
+    image.putpixel((1, 0), (0, 0, 255))
+    sub_cell_image = SubCellImage(image, lines=1, cols=1, mode="quadrant")
+    assert list(sub_cell_image.ansi_lines()) == [f"{sgr(38, 2, 255, 0, 0, 48, 2, 0, 0, 255)}▙{sgr(0)}"]
+
+
+def test_solid_sextant_ignores_background():
+    importorskip("numpy")
+    image = Image.new("RGB", (4, 3), (0, 255, 0))
+    sub_cell_image = SubCellImage(image, lines=1, cols=2, mode="sextant")
+    assert list(sub_cell_image.ansi_lines()) == [f"{sgr(38, 2, 0, 255, 0)}██{sgr(0)}"]
+
+
+def test_sextant_glyphs():
+    assert SEXTANT_GLYPHS[1] == "\U0001FB00"
+    assert SEXTANT_GLYPHS[21] == "▌"
+    assert SEXTANT_GLYPHS[62] == "\U0001FB3B"
+
+
+@mark.parametrize("format, options", [
+    ("PPM", {}),
+    ("BMP", {}),
+    ("TIFF", {}),
+    # Several strips of 5 rows each
+    ("TIFF", {"tiffinfo": {278: 5}}),
+])
+def test_streaming_reads_raw_images_in_strips(format, options, monkeypatch):
+    image = stripes(40, 32)
+    data = BytesIO()
+    image.save(data, format=format, **options)
+    data.seek(0)
+    expected = list(BlockImage(image.resize((20, 16), Image.Resampling.BOX), lines=8, cols=20).ansi_lines())
+
+    def load(self):
+        raise AssertionError("Image should not be loaded in full")
+
+    monkeypatch.setattr(ImageFile.ImageFile, "load", load)
+    assert list(stream_block_lines(data, cols=20, strip_lines=3)) == expected
+
+
+def test_streaming_compressed_image():
+    image = stripes(40, 32)
+    data = BytesIO()
+    image.save(data, format="PNG")
+    data.seek(0)
+    lines = list(stream_block_lines(data, cols=10, strip_lines=3))
+    assert len(lines) == 4
+
+
+def test_streaming_closes_image_opened_from_file(tmp_path, monkeypatch):
+    filename = str(tmp_path / "stripes.png")
+    stripes(40, 32).save(filename)
+    opened = []
+    open_image = Image.open
+    monkeypatch.setattr(Image, "open", lambda fp: opened.append(open_image(fp)) or opened[-1])
+    lines = stream_block_lines(filename, cols=10, strip_lines=3)
+    next(lines)
+    lines.close()
+    assert opened[0].fp is None
@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Copyright 2020, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from hashlib import blake2b
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO
+from pickle import dumps, loads
+from socketserver import ThreadingMixIn
+from threading import Thread
+
+from PIL import Image
+from pytest import fixture, mark, raises
+
+from pansi import net
+from pansi.image import TerminalImage
+from pansi.net import Client, HTTPCache, Stream, URI
+
+
+def png(width=16, height=8, colour=(255, 0, 0)):
+    data = BytesIO()
+    Image.new("RGB", (width, height), colour).save(data, format="PNG")
+    return data.getvalue()
+
+
+class Server(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.files = {}
+        self.headers = {}
+        self.connections = 0
+        self.requests = []
+
+    @property
+    def base(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    # Headers and body are written separately, which would otherwise
+    # stall each reply on a kept-alive connection for a delayed ACK.
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        try:
+            body = self.server.files[self.path]
+        except KeyError:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        else:
+            headers = self.server.headers.get(self.path, {})
+            etag = headers.get("ETag")
+            if etag is not None and self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                body = b""
+            else:
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@fixture
+def server():
+    s = Server()
+    thread = Thread(target=s.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+    thread.start()
+    yield s
+    s.shutdown()
+    s.server_close()
+
+
+@fixture
+def shared_client():
+    yield net.configure()
+    net.client().close()
+
+
+@fixture(autouse=True)
+def shared_cache(tmp_path, monkeypatch):
+    # Put back whichever shared cache was there before
+    monkeypatch.setattr(net, "_http_cache", net._http_cache)
+    yield net.configure_cache(directory=str(tmp_path / "http"))
+
+
+def test_download_reads_whole_body(server, shared_client):
+    server.files["/a.bin"] = b"hello, world"
+    assert net.download(f"{server.base}/a.bin").read() == b"hello, world"
+
+
+def test_connections_are_reused(server, shared_client):
+    server.files["/a.bin"] = b"a" * 1000
+    for _ in range(5):
+        assert net.download(f"{server.base}/a.bin").read() == b"a" * 1000
+    assert server.connections == 1
+
+
+def test_unexpected_status_is_an_error(server, shared_client):
+    with raises(RuntimeError):
+        net.download(f"{server.base}/missing")
+    # The connection is still usable afterwards
+    server.files["/a.bin"] = b"a"
+    net.download(f"{server.base}/a.bin")
+    assert server.connections == 1
+
+
+def test_streamed_body_is_read_as_needed(server):
+    body = bytes(range(256)) * 1000
+    server.files["/big.bin"] = body
+    with Client() as client:
+        with client.download(f"{server.base}/big.bin", stream=True) as stream:
+            assert isinstance(stream, Stream)
+            stream.chunk_size = 1024
+            assert stream.read(10) == body[:10]
+            assert stream.received < len(body)
+            stream.seek(-5, 2)
+            assert stream.read() == body[-5:]
+            stream.seek(100)
+            assert stream.read(3) == body[100:103]
+            assert stream.hexdigest() == blake2b(body, digest_size=16).hexdigest()
+        # Closing the stream returned the connection to the pool
+        client.download(f"{server.base}/big.bin")
+        assert server.connections == 1
+
+
+def test_streamed_body_is_spooled_to_disk(server, monkeypatch):
+    monkeypatch.setattr(Stream, "spool_size", 1024)
+    body = bytes(range(256)) * 1000
+    server.files["/big.bin"] = body
+    with Client() as client:
+        with client.download(f"{server.base}/big.bin", stream=True) as stream:
+            stream.seek(-5, 2)
+            assert stream.buffer._rolled
+            stream.seek(1000)
+            assert stream.read(3) == body[1000:1003]
+
+
+def test_closing_a_partly_read_stream_leaves_the_rest(server):
+    body = bytes(range(256)) * 4000
+    server.files["/big.bin"] = body
+    with Client() as client:
+        stream = client.download(f"{server.base}/big.bin", stream=True)
+        stream.chunk_size = 1024
+        assert stream.read(10) == body[:10]
+        stream.close()
+        assert stream.received < len(body)
+        with raises(ValueError):
+            stream.hexdigest()
+        # A new connection is made in place of the one closed
+        assert client.download(f"{server.base}/big.bin").read() == body
+        assert server.connections == 2
+
+
+def test_configure_replaces_shared_client():
+    try:
+        client = net.configure(pool_size=2, connect_timeout=1.5, read_timeout=4.0)
+        assert net.client() is client
+        assert client.pool.connection_pool_kw["maxsize"] == 2
+        timeout = client.pool.connection_pool_kw["timeout"]
+        assert (timeout.connect_timeout, timeout.read_timeout) == (1.5, 4.0)
+    finally:
+        net.configure().close()
+
+
+def test_load_remote_image(server, shared_client):
+    server.files["/red.png"] = png()
+    image = TerminalImage.load(f"{server.base}/red.png")
+    assert image.image.size == (16, 8)
+    assert image.image.getpixel((0, 0)) == (255, 0, 0)
+    assert image.content_key() == TerminalImage.load(f"{server.base}/red.png").content_key()
+    assert server.connections == 1
+
+
+def test_remote_and_local_content_keys_match(server, tmp_path):
+    server.files["/red.png"] = png()
+    (tmp_path / "red.png").write_bytes(png())
+    remote = TerminalImage.load(f"{server.base}/red.png")
+    local = TerminalImage.load(str(tmp_path / "red.png"))
+    assert remote.content_key() == local.content_key()
+    streamed = TerminalImage.load(f"{server.base}/red.png", http_cache=False)
+    assert streamed.content_key() == local.content_key()
+
+
+def test_load_without_cache_downloads_every_time(server, shared_client):
+    server.files["/red.png"] = png()
+    server.headers["/red.png"] = {"Cache-Control": "max-age=3600"}
+    for _ in range(2):
+        TerminalImage.load(f"{server.base}/red.png", http_cache=False)
+    assert len(server.requests) == 2
+
+
+def test_normalized_uri():
+    assert HTTPCache.normalize("HTTP://Example.COM/a/B?x=Y#frag") == "http://example.com/a/B?x=Y"
+    assert HTTPCache.normalize("http://example.com") == "http://example.com/"
+
+
+def test_fresh_response_is_served_from_disk(server, shared_client, tmp_path):
+    server.files["/a.bin"] = b"a" * 100
+    server.headers["/a.bin"] = {"Cache-Control": "max-age=3600"}
+    cache = HTTPCache(str(tmp_path / "cache"))
+    with cache.download(f"{server.base}/a.bin") as body:
+        assert body.read() == b"a" * 100
+    # Even a new cache, in the same directory, has no need to ask again
+    for c in [cache, HTTPCache(str(tmp_path / "cache"))]:
+        with c.download(f"{server.base}/a.bin") as body:
+            assert body.read() == b"a" * 100
+    assert len(server.requests) == 1
+    assert (cache.misses, cache.hits) == (1, 1)
+
+
+def test_stale_response_is_revalidated(server, shared_client, tmp_path):
+    server.files["/a.bin"] = b"a" * 100
+    server.headers["/a.bin"] = {"ETag": '"v1"', "Cache-Control": "no-cache"}
+    cache = HTTPCache(str(tmp_path / "cache"))
+    for _ in range(3):
+        with cache.download(f"{server.base}/a.bin") as body:
+            assert body.read() == b"a" * 100
+    assert [headers.get("If-None-Match") for _, headers in server.requests] == [None, '"v1"', '"v1"']
+    assert (cache.misses, cache.revalidations) == (1, 2)
+    # A changed body is downloaded again
+    server.files["/a.bin"] = b"b" * 100
+    server.headers["/a.bin"] = {"ETag": '"v2"', "Cache-Control": "no-cache"}
+    with cache.download(f"{server.base}/a.bin") as body:
+        assert body.read() == b"b" * 100
+    assert cache.misses == 2
+
+
+def test_revalidation_failure_closes_cached_body(server, shared_client, tmp_path, monkeypatch):
+    server.files["/a.bin"] = b"a" * 100
+    server.headers["/a.bin"] = {"ETag": '"v1"', "Cache-Control": "no-cache"}
+    cache = HTTPCache(str(tmp_path / "cache"))
+    cache.download(f"{server.base}/a.bin").close()
+    opened = []
+    monkeypatch.setattr("builtins.open", lambda *args, _open=open, **kwargs:
+                        opened.append(_open(*args, **kwargs)) or opened[-1])
+
+    def refuse(*args, **kwargs):
+        raise OSError("connection refused")
+
+    monkeypatch.setattr(cache.client, "request", refuse)
+    with raises(OSError):
+        cache.download(f"{server.base}/a.bin")
+    assert opened and all(f.closed for f in opened)
+
+
+def test_uncacheable_response_is_not_stored(server, shared_client, tmp_path):
+    server.files["/a.bin"] = b"a" * 100
+    server.headers["/a.bin"] = {"Cache-Control": "no-store"}
+    cache = HTTPCache(str(tmp_path / "cache"))
+    for _ in range(2):
+        with cache.download(f"{server.base}/a.bin") as body:
+            assert body.read() == b"a" * 100
+    assert cache.misses == 2
+    assert list((tmp_path / "cache").iterdir()) == []
+
+
+def test_least_recently_used_responses_are_evicted(server, shared_client, tmp_path):
+    for name in "abc":
+        server.files[f"/{name}"] = name.encode() * 100
+        server.headers[f"/{name}"] = {"Cache-Control": "max-age=3600"}
+    cache = HTTPCache(str(tmp_path / "cache"), budget=250)
+    for name in "aba":
+        cache.download(f"{server.base}/{name}").close()
+    cache.download(f"{server.base}/c").close()
+    assert cache.used == 200
+    assert len(list((tmp_path / "cache").glob("*.body"))) == 2
+    # "b" was evicted, but "a" and "c" were not
+    for name in "acb":
+        cache.download(f"{server.base}/{name}").close()
+    assert [p for p, _ in server.requests] == ["/a", "/b", "/c", "/b"]
+
+
+def test_decoded_images_are_kept_in_memory(server, shared_client, tmp_path):
+    server.files["/red.png"] = png()
+    server.headers["/red.png"] = {"ETag": '"red"', "Cache-Control": "max-age=0"}
+    cache = HTTPCache(str(tmp_path / "cache"))
+    image, key = cache.image(f"{server.base}/red.png")
+    again, again_key = cache.image(f"{server.base}/red.png")
+    # Revalidated, but not decoded again
+    assert again is image and again_key == key
+    assert cache.revalidations == 1
+    assert cache.memory_used == 16 * 8 * 3
+
+
+@mark.parametrize("s, components", [
+    ("http://example.com/a/b?q=1#f", ("http", "example.com", "/a/b", "q=1", "f")),
+    ("//host", (None, "host", "", None, None)),
+    ("//host/", (None, "host", "/", None, None)),
+    ("file:///tmp/x.png", ("file", "", "/tmp/x.png", None, None)),
+    ("mailto:someone@example.com", ("mailto", None, "someone@example.com", None, None)),
+    ("a/b:c", (None, None, "a/b:c", None, None)),
+    ("?#", (None, None, "", "", "")),
+    ("", (None, None, "", None, None)),
+])
+def test_uri_parse(s, components):
+    uri = URI.parse(s)
+    assert (uri.scheme, uri.authority, uri.path, uri.query, uri.fragment) == components
+    assert str(uri) == s
+
+
+@mark.parametrize("s, normal", [
+    ("HTTP://Example.COM", "http://example.com/"),
+    ("http://example.com:80/", "http://example.com/"),
+    ("https://example.com:443/", "https://example.com/"),
+    ("http://example.com:8080/", "http://example.com:8080/"),
+    ("http://example.com:/", "http://example.com/"),
+    ("http://[::1]:443/", "http://[::1]:443/"),
+    ("http://example.com/a/./b/../c/.", "http://example.com/a/c/"),
+    ("http://example.com/%7euser/%2f%3A?q=%7A", "http://example.com/~user/%2F%3A?q=z"),
+    ("http://example.com/a b/é", "http://example.com/a%20b/%C3%A9"),
+    ("http://example.com/100%", "http://example.com/100%25"),
+    ("a/./b", "a/./b"),
+])
+def test_uri_normalized(s, normal):
+    assert str(URI.parse(s).normalized()) == normal
+
+
+def test_uris_compare_by_normal_form():
+    a = URI.parse("HTTP://Example.com:80/%7ex")
+    b = URI.parse("http://example.com/~x")
+    assert a == b
+    assert hash(a) == hash(b)
+    assert {a: 1}[b] == 1
+    assert a != URI.parse("http://example.com/~y")
+    assert a != "http://example.com/~x"
+
+
+def test_uri_parse_reuses_objects():
+    assert URI.parse("http://example.com/x") is URI.parse("http://example.com/x")
+    assert URI.parse("http://Example.com/x").normalized().authority is \
+        URI.parse("http://example.com/y").normalized().authority
+
+
+def test_uri_can_be_pickled():
+    uri = URI.parse("http://example.com/x")
+    assert loads(dumps(uri)) == uri
+
+
+def test_uri_cannot_be_modified():
+    uri = URI.parse("http://example.com/a")
+    with raises(AttributeError):
+        uri.path = "/b"
+    with raises(AttributeError):
+        del uri.scheme
+    assert URI.parse("http://example.com/a").path == "/a"
+    assert str(uri) == "http://example.com/a"
+
+
+def test_uri_is_a_tuple_of_components():
+    scheme, authority, path, query, fragment = URI.parse("http://example.com/a?b#c")
+    assert (scheme, authority, path, query, fragment) == ("http", "example.com", "/a", "b", "c")
+    assert URI("http", "example.com", "/a") == URI.parse("http://example.com/a")
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Copyright 2020, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from PIL import Image
+from pytest import mark
+
+from pansi import palette
+
+
+def test_xterm_colours():
+    colours = palette.xterm_colours()
+    assert len(colours) == 256
+    assert colours[16] == (0, 0, 0)
+    assert colours[196] == (255, 0, 0)
+    assert colours[255] == (238, 238, 238)
+
+
+@mark.parametrize("depth", [palette.XTERM_256, palette.XTERM_16, palette.MONO])
+@mark.parametrize("dither", [None, palette.ORDERED, palette.FLOYD_STEINBERG])
+def test_reduced_image_only_uses_palette_colours(depth, dither):
+    image = Image.effect_noise((32, 32), 64).convert("RGB")
+    reduced, colours = palette.reduce(image, depth, dither)
+    assert {colour for _, colour in reduced.getcolors()} <= set(colours)
+
+
+def test_reduce_to_256_colours_picks_nearest():
+    image = Image.new("RGB", (1, 1), (250, 5, 3))
+    reduced, colours = palette.reduce(image, palette.XTERM_256)
+    assert colours[reduced.getpixel((0, 0))] == 196
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Copyright 2020, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+from io import StringIO
+from os import close, fdopen, getpid, kill, pipe, write
+from signal import SIGWINCH
+from time import monotonic
+
+from pytest import fixture, mark
+
+from pansi.reader import InputDecoder, Key, Mouse, Paste, Reply, Resize, SequenceParser, query, unread
+from pansi.screen import Screen
+
+
+SAMPLE = "ab\x1b[4;600;800t\x1bOP\x1b_Gi=31;OK\x1b\\\x1b]11;rgb:0/0/0\x07\x1bP1$r0m\x1b\\\x1bxcd"
+SEQUENCES = ["ab", "\x1b[4;600;800t", "\x1bOP", "\x1b_Gi=31;OK\x1b\\", "\x1b]11;rgb:0/0/0\x07",
+             "\x1bP1$r0m\x1b\\", "\x1bx", "cd"]
+
+
+def test_parser_splits_sequences():
+    assert SequenceParser().feed(SAMPLE) == SEQUENCES
+
+
+@mark.parametrize("size", [1, 2, 3, 7])
+def test_parser_holds_back_incomplete_sequences(size):
+    parser = SequenceParser()
+    out = []
+    for i in range(0, len(SAMPLE), size):
+        out.extend(parser.feed(SAMPLE[i:i + size]))
+    assert "".join(out) == SAMPLE
+    assert [s for s in out if s.startswith("\x1b")] == [s for s in SEQUENCES if s.startswith("\x1b")]
+    assert parser.pending == ""
+
+
+def test_parser_reports_pending_sequence():
+    parser = SequenceParser()
+    assert parser.feed("x\x1b[1;2") == ["x"]
+    assert parser.pending == "\x1b[1;2"
+    assert parser.feed("R") == ["\x1b[1;2R"]
+
+
+def test_parser_escape_cancels_string():
+    assert SequenceParser().feed("\x1bPabc\x1b[A") == ["\x1bPabc", "\x1b[A"]
+
+
+@fixture
+def terminal():
+    # A pipe stands in for the terminal's input, to which a test can
+    # write replies.
+    r, w = pipe()
+    cin = fdopen(r, "r")
+    yield cin, w
+    cin.close()
+    close(w)
+
+
+def test_query_returns_replies_up_to_done(terminal):
+    cin, w = terminal
+    write(w, "\x1b[4;1;2t\x1b[?62c\x1b[A".encode("ascii"))
+    cout = StringIO()
+    replies = query("\x1b[14t\x1b[c", lambda reply: reply.endswith("c"), cin, cout)
+    assert cout.getvalue() == "\x1b[14t\x1b[c"
+    assert replies == ["\x1b[4;1;2t", "\x1b[?62c"]
+    # Input read after the replies is kept for the next reader
+    assert unread(cin) == "\x1b[A"
+    assert unread(cin) == ""
+
+
+def test_query_times_out_when_unanswered(terminal):
+    cin, w = terminal
+    write(w, b"\x1b[4;1;2t")
+    t0 = monotonic()
+    assert query("\x1b[14t\x1b[c", lambda reply: reply.endswith("c"), cin, StringIO(), timeout=0.05) is None
+    assert monotonic() - t0 < 0.5
+
+
+def test_query_keeps_input_when_unanswered(terminal):
+    cin, w = terminal
+    write(w, b"ab\x1b[4;1;2t\x1b[")
+    assert query("\x1b[14t\x1b[c", lambda reply: reply.endswith("c"), cin, StringIO(), timeout=0.05) is None
+    assert unread(cin) == "ab\x1b["
+
+
+def test_query_keeps_input_that_arrives_before_replies(terminal):
+    cin, w = terminal
+    write(w, "xy\x1b[B\x1b[200~\x1b[?1c\x1b[201~\x1b[?62c".encode("ascii"))
+    replies = query("\x1b[c", lambda reply: reply.endswith("c"), cin, StringIO())
+    assert replies == ["\x1b[?62c"]
+    assert unread(cin) == "xy\x1b[B\x1b[200~\x1b[?1c\x1b[201~"
+
+
+def test_query_decodes_utf8(terminal):
+    cin, w = terminal
+    write(w, "\x1b]l£\x1b\\".encode("utf-8"))
+    replies = query("", lambda reply: reply.startswith("\x1b]"), cin, StringIO())
+    assert replies == ["\x1b]l£\x1b\\"]
+
+
+@mark.parametrize("data,events", [
+    ("aZ", [Key("a"), Key("Z")]),
+    ("\r\t\x7f\x01", [Key("enter"), Key("tab"), Key("backspace"), Key("a", ctrl=True)]),
+    ("\x1b[A\x1bOB\x1b[1;5C\x1b[1;2D", [Key("up"), Key("down"), Key("right", ctrl=True),
+                                         Key("left", shift=True)]),
+    ("\x1b[3~\x1b[5;3~\x1bOP\x1b[15~\x1b[Z", [Key("delete"), Key("page-up", alt=True), Key("f1"), Key("f5"),
+                                               Key("tab", shift=True)]),
+    ("\x1bx\x1b\r", [Key("x", alt=True), Key("enter", alt=True)]),
+    ("\x1b[<0;10;5M\x1b[<0;10;5m\x1b[<65;1;2M\x1b[<35;3;4M",
+     [Mouse("press", 1, 5, 10), Mouse("release", 1, 5, 10), Mouse("scroll", 5, 2, 1), Mouse("move", 0, 4, 3)]),
+    ("\x1b[48;24;80;480;640t", [Resize(24, 80)]),
+    ("\x1b[12;34R\x1b[?62c", [Reply("\x1b[12;34R"), Reply("\x1b[?62c")]),
+    ("\x1b[200~hi\x1b[Athere\x1b[201~!", [Paste("hi\x1b[Athere"), Key("!")]),
+])
+def test_decoder_events(data, events):
+    assert InputDecoder().feed(data) == events
+
+
+def test_decoder_takes_escape_before_another_sequence_as_a_key():
+    decoder = InputDecoder()
+    assert decoder.feed(b"\x1b\x1b") == [Key("escape")]
+    assert decoder.flush() == [Key("escape")]
+    assert InputDecoder().feed(b"\x1b\x1b[A") == [Key("escape"), Key("up")]
+
+
+def test_decoder_handles_utf8_split_across_reads():
+    decoder = InputDecoder()
+    data = "é\x1b[A".encode("utf-8")
+    assert decoder.feed(data[:1]) == []
+    assert decoder.feed(data[1:4]) == [Key("é")]
+    assert decoder.pending
+    assert decoder.feed(data[4:]) == [Key("up")]
+
+
+def test_decoder_flushes_bare_escape():
+    decoder = InputDecoder()
+    assert decoder.feed("\x1b") == []
+    assert decoder.flush() == [Key("escape")]
+    assert not decoder.pending
+    decoder.feed("\x1b[")
+    assert decoder.flush() == [Key("[", alt=True)]
+
+
+def test_screen_reads_events_in_bulk():
+    screen = Screen(cout=StringIO(), cin=StringIO("ab\x1b[B\x1b"))
+    assert screen.read_event() == Key("a")
+    assert screen.read_key() == Key("b")
+    assert screen.read_key() == Key("down")
+    assert screen.read_key() == Key("escape")
+    assert screen.read_event() is None
+
+
+def test_screen_tells_bare_escape_from_sequence(terminal):
+    cin, w = terminal
+    screen = Screen(cout=StringIO(), cin=cin)
+    write(w, b"\x1b")
+    t0 = monotonic()
+    assert screen.read_event(timeout=1) == Key("escape")
+    assert monotonic() - t0 < 0.5
+    write(w, b"\x1b[")
+    write(w, b"A")
+    assert screen.read_event(timeout=1) == Key("up")
+    assert screen.read_event(timeout=0.01) is None
+
+
+def test_screen_reports_sigwinch_as_resize(terminal):
+    cin, w = terminal
+    screen = Screen(cout=StringIO(), cin=cin)
+    screen._watch_resize()
+    try:
+        kill(getpid(), SIGWINCH)
+        assert screen.read_event(timeout=1) == Resize(*screen.size)
+    finally:
+        screen._unwatch_resize()
@@ -0,0 +1,444 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Copyright 2020, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+from io import StringIO
+from os import close, fdopen, getpid, kill, pipe, write
+from signal import SIGWINCH, getsignal, signal
+
+from pytest import approx, fixture
+
+from pansi import capabilities
+from pansi.codes import CSI, cur, x, sgr, BOLD_ATTR, ITALIC_ATTR, pack_colour
+from pansi.reader import Key, Resize
+from pansi.screen import AsyncScreen, CONTINUATION, FrameScheduler, Grid, Screen, SYNC_END, SYNC_START
+
+
+def test_grid_put_clips_at_right_hand_edge():
+    grid = Grid(2, 4)
+    grid.put(1, 2, "hello")
+    assert "".join(map(chr, grid.chars[4:])) == "  he"
+
+
+def test_grid_put_gives_wide_characters_two_cells():
+    grid = Grid(1, 6)
+    grid.put(0, 0, "a日本")
+    assert list(grid.chars) == [ord("a"), ord("日"), CONTINUATION, ord("本"), CONTINUATION, ord(" ")]
+
+
+def test_grid_put_clips_wide_characters_to_whole_cells():
+    grid = Grid(1, 4)
+    grid.put(0, 1, "日本")
+    assert list(grid.chars) == [ord(" "), ord("日"), CONTINUATION, ord(" ")]
+    grid.put(0, -1, "日x")
+    assert "".join(map(chr, grid.chars)) == " x  "
+
+
+def test_grid_put_over_half_a_wide_character_blanks_the_other_half():
+    grid = Grid(1, 4)
+    grid.put(0, 0, "日本")
+    grid.put(0, 1, "xy")
+    assert "".join(map(chr, grid.chars)) == " xy "
+
+
+def test_grid_changes_absorb_short_gaps():
+    old = Grid(1, 20)
+    new = Grid(1, 20)
+    new.put(0, 0, "a")
+    new.put(0, 3, "b")
+    new.put(0, 15, "c")
+    assert list(new.changes(old)) == [(0, 0, 4), (0, 15, 16)]
+
+
+def test_grid_changes_only_look_at_dirty_lines():
+    old = Grid(3, 100)
+    new = Grid(3, 100)
+    new.clean()
+    new.put(2, 70, "x", fg=(255, 0, 0))
+    assert new.dirty_lines() == [2]
+    assert list(new.changes(old)) == [(2, 70, 71)]
+
+
+def test_grid_stores_packed_style():
+    grid = Grid(1, 2)
+    grid.put(0, 1, "z", fg=3, bg=(1, 2, 3), attrs=BOLD_ATTR | ITALIC_ATTR)
+    assert grid.fgs[1] == pack_colour(3)
+    assert grid.bgs[1] == pack_colour((1, 2, 3))
+    assert grid.attrs[1] == BOLD_ATTR | ITALIC_ATTR
+
+
+def test_first_present_paints_everything():
+    screen = Screen(cout=StringIO())
+    screen.resize(2, 3)
+    screen.present()
+    assert screen.cout.getvalue() == f"{cur.pos(1, 1)}{x}   {cur.pos(2, 1)}   "
+
+
+def test_present_emits_only_changes():
+    screen = Screen(cout=StringIO())
+    screen.resize(3, 20)
+    screen.present()
+    screen.cout = StringIO()
+    screen.buffer.put(1, 5, "hi", attrs=BOLD_ATTR)
+    screen.buffer.put(1, 15, "yo")
+    screen.present()
+    assert screen.cout.getvalue() == f"{cur.pos(2, 6)}{sgr(1)}hi{cur.hpos(16)}{sgr(0)}yo"
+
+
+def test_present_draws_wide_characters_once():
+    screen = Screen(cout=StringIO())
+    screen.resize(1, 6)
+    screen.present()
+    screen.cout = StringIO()
+    screen.buffer.put(0, 1, "日本")
+    screen.present()
+    assert screen.cout.getvalue() == f"{cur.pos(1, 2)}日本"
+    screen.cout = StringIO()
+    screen.buffer.put(0, 1, "日月")
+    screen.present()
+    assert screen.cout.getvalue() == f"{cur.pos(1, 4)}月"
+
+
+def test_frame_ends_in_default_style():
+    screen = Screen(cout=StringIO())
+    screen.synchronized = False
+    screen.resize(1, 4)
+    screen.buffer.put(0, 2, "ab", bg=(255, 0, 0))
+    screen.present()
+    assert screen.cout.getvalue().endswith(f"{sgr(48, 2, 255, 0, 0)}ab{sgr(0)}")
+    screen.cout = StringIO()
+    screen.clear()
+    screen.write("hello")
+    screen.flush()
+    assert screen.cout.getvalue() == f"{CSI}H{CSI}2Jhello"
+
+
+def test_present_with_no_changes_writes_nothing():
+    screen = Screen(cout=StringIO())
+    screen.resize(3, 20)
+    screen.buffer.put(0, 0, "hello")
+    screen.present()
+    screen.cout = StringIO()
+    screen.buffer.put(0, 0, "hello")
+    screen.present()
+    assert screen.cout.getvalue() == ""
+
+
+def test_cursor_position_skips_other_input():
+    cout = StringIO()
+    screen = Screen(cout=cout, cin=StringIO("x\x1b[A\x1b[12;34R"))
+    assert screen.cur_pos == (12, 34)
+    assert cout.getvalue() == "\x1b[6n"
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_frame_is_written_in_one_go(monkeypatch):
+    writes = []
+
+    def counting_write(fd, data):
+        writes.append(bytes(data))
+        return write(fd, data)
+
+    monkeypatch.setattr("pansi.screen.os_write", counting_write)
+    r, w = pipe()
+    with fdopen(r, "rb") as rf, fdopen(w, "w") as cout:
+        screen = Screen(cout=cout)
+        screen.synchronized = False
+        screen.resize(2, 3)
+        screen.clear()
+        screen.buffer.put(0, 0, "abc")
+        screen.buffer.put(1, 0, "def")
+        assert screen._frame()
+        assert len(writes) == 1
+        assert writes[0] == f"{CSI}H{CSI}2J{cur.pos(1, 1)}{x}abc{cur.pos(2, 1)}def".encode()
+        assert rf.read1(100) == writes[0]
+
+
+def test_frame_with_no_changes_is_skipped():
+    screen = Screen(cout=StringIO())
+    screen.synchronized = False
+    screen.resize(1, 3)
+    assert screen._frame()
+    screen.cout = StringIO()
+    assert not screen._frame()
+    assert screen.cout.getvalue() == ""
+
+
+def test_frame_is_synchronized_when_supported():
+    screen = Screen(cout=StringIO())
+    screen.synchronized = True
+    screen.resize(1, 3)
+    screen.buffer.put(0, 0, "abc")
+    screen.present()
+    out = screen.cout.getvalue()
+    assert out.startswith(SYNC_START) and out.endswith(f"abc{SYNC_END}")
+
+
+def test_scheduler_caps_frame_rate():
+    clock = FakeClock()
+    screen = Screen(cout=StringIO())
+    screen.synchronized = False
+    screen.resize(1, 3)
+    scheduler = FrameScheduler(screen, fps=10, clock=clock, sleep=clock.sleep)
+    scheduler.run(lambda s: s.buffer.put(0, 0, str(int(clock.now * 10) % 2)), frames=5)
+    assert clock.now == approx(0.5)
+    assert clock.sleeps == approx([0.1] * 5)
+
+
+def test_scheduler_coalesces_updates_and_skips_idle_frames():
+    clock = FakeClock()
+    screen = Screen(cout=CountingOutput())
+    screen.synchronized = False
+    screen.resize(1, 3)
+    scheduler = FrameScheduler(screen, fps=10, clock=clock, sleep=clock.sleep)
+
+    def render(s):
+        if clock.now < 0.15:
+            # Several updates within each of the first two frames
+            for ch in "xy" + str(round(clock.now * 10)):
+                s.buffer.put(0, 0, ch)
+                s.present()
+                s.flush()
+
+    scheduler.run(render, frames=6)
+    assert scheduler.frames_written == 2
+    assert scheduler.frames_skipped == 5
+    assert screen.cout.flushes == 2
+    assert not screen._deferred
+
+
+def test_scheduler_does_not_catch_up_when_behind():
+    clock = FakeClock()
+    screen = Screen(cout=StringIO())
+    screen.synchronized = False
+    screen.resize(1, 3)
+    scheduler = FrameScheduler(screen, fps=10, clock=clock, sleep=clock.sleep)
+
+    def render(s):
+        if clock.now == 0:
+            clock.now = 1.0     # a slow frame
+
+    scheduler.run(render, frames=3)
+    assert clock.sleeps == approx([0.1, 0.1])
+
+
+def test_scheduler_stops_when_render_returns_false():
+    screen = Screen(cout=StringIO())
+    screen.synchronized = False
+    calls = []
+
+    def render(s):
+        calls.append(1)
+        return len(calls) < 3
+
+    FrameScheduler(screen, fps=1000).run(render)
+    assert len(calls) == 3
+
+
+class CountingOutput(StringIO):
+
+    def __init__(self):
+        super().__init__()
+        self.flushes = 0
+
+    def flush(self):
+        self.flushes += 1
+
+
+@fixture
+def terminal_input():
+    r, w = pipe()
+    cin = fdopen(r, "r")
+    yield cin, w
+    cin.close()
+    close(w)
+
+
+def test_async_screen_events(terminal_input):
+    cin, w = terminal_input
+
+    async def main():
+        screen = AsyncScreen(cout=StringIO(), cin=cin)
+        screen.attach()
+        write(w, b"a\x1b[A\x1b")
+        events = [await screen.next_event(timeout=1) for _ in range(3)]
+        assert await screen.next_event(timeout=0.01) is None
+        await screen.detach()
+        return events
+
+    assert asyncio.run(main()) == [Key("a"), Key("up"), Key("escape")]
+
+
+def test_async_screen_query_takes_replies_and_leaves_keys(terminal_input):
+    cin, w = terminal_input
+
+    async def main():
+        cout = StringIO()
+        screen = AsyncScreen(cout=cout, cin=cin)
+        screen.attach()
+        asyncio.get_running_loop().call_later(0.01, write, w, b"x\x1b[12;34Ry")
+        position = await screen.cursor_position(timeout=1)
+        keys = [await screen.next_event(timeout=1) for _ in range(2)]
+        timed_out = await screen.request("\x1b[c", lambda reply: True, timeout=0.01)
+        await screen.detach()
+        return cout.getvalue(), position, keys, timed_out
+
+    sent, position, keys, timed_out = asyncio.run(main())
+    assert sent == "\x1b[6n\x1b[c"
+    assert position == (12, 34)
+    assert keys == [Key("x"), Key("y")]
+    assert timed_out is None
+
+
+def test_async_screen_cursor_position_can_also_block():
+    # Until attached to a loop, the (blocking) query of a normal screen
+    # still works
+    cout = StringIO()
+    screen = AsyncScreen(cout=cout, cin=StringIO("x\x1b[12;34R"))
+    assert screen.cur_pos == (12, 34)
+    assert cout.getvalue() == "\x1b[6n"
+
+
+def test_async_screen_passes_on_and_restores_resize_handler(terminal_input):
+    cin, w = terminal_input
+    calls = []
+
+    def handler(signum, frame):
+        calls.append(signum)
+
+    async def main():
+        screen = AsyncScreen(cout=StringIO(), cin=cin)
+        screen.attach()
+        screen._watch_resize()
+        kill(getpid(), SIGWINCH)
+        event = await screen.next_event(timeout=1)
+        screen._unwatch_resize()
+        await screen.detach()
+        return event
+
+    original = signal(SIGWINCH, handler)
+    try:
+        event = asyncio.run(main())
+        assert getsignal(SIGWINCH) is handler
+    finally:
+        signal(SIGWINCH, original)
+    assert isinstance(event, Resize)
+    assert calls == [SIGWINCH]
+
+
+@fixture
+def unwatched_capabilities(monkeypatch):
+    # As if the capabilities had never been probed, so that the next
+    # probe installs its own SIGWINCH handler
+    monkeypatch.setattr(capabilities, "_watching", False)
+    original = getsignal(SIGWINCH)
+    yield
+    signal(SIGWINCH, original)
+    capabilities.invalidate()
+
+
+def test_screen_keeps_handler_installed_by_probe_on_exit(unwatched_capabilities):
+    cout = StringIO()
+    screen = Screen(cout=cout, cin=StringIO())
+    screen._watch_resize()
+    capabilities.remember(cout, capabilities.Capabilities())
+    probe_handler = getsignal(SIGWINCH)
+    screen._unwatch_resize()
+    assert getsignal(SIGWINCH) is probe_handler
+    kill(getpid(), SIGWINCH)
+    assert capabilities.cached(cout) is None
+
+
+def test_async_screen_keeps_handler_installed_by_probe_on_exit(terminal_input, unwatched_capabilities):
+    cin, w = terminal_input
+    cout = StringIO()
+
+    async def main():
+        screen = AsyncScreen(cout=cout, cin=cin)
+        screen.attach()
+        screen._watch_resize()
+        capabilities.remember(cout, capabilities.Capabilities())
+        probe_handler = getsignal(SIGWINCH)
+        screen._unwatch_resize()
+        await screen.detach()
+        return probe_handler
+
+    probe_handler = asyncio.run(main())
+    assert getsignal(SIGWINCH) is probe_handler
+    kill(getpid(), SIGWINCH)
+    assert capabilities.cached(cout) is None
+
+
+def test_async_screen_probe_is_cached(terminal_input):
+    cin, w = terminal_input
+    capabilities.invalidate()
+
+    async def main():
+        cout = StringIO()
+        screen = AsyncScreen(cout=cout, cin=cin)
+        screen.attach()
+        asyncio.get_running_loop().call_later(0.01, write, w, b"\x1b[4;600;800t\x1b[?62;4c")
+        first = await screen.probe(timeout=1)
+        second = await screen.probe(timeout=1)
+        await screen.detach()
+        return cout.getvalue(), first, second, screen.size_px
+
+    try:
+        sent, first, second, size_px = asyncio.run(main())
+    finally:
+        capabilities.invalidate()
+    assert sent == capabilities.PROBE_QUERY
+    assert first is second
+    assert first.graphics == "sixel"
+    assert size_px == (600, 800)
+
+
+def test_async_screen_coalesces_flushes_into_frames(terminal_input):
+    cin, w = terminal_input
+
+    async def main():
+        cout = CountingOutput()
+        screen = AsyncScreen(cout=cout, cin=cin)
+        screen.frame_interval = 0.05
+        screen.resize(2, 4)
+        screen.attach()
+        for n in range(10):
+            screen.buffer.put(0, 0, str(n))
+            screen.present()
+        await screen.drain()
+        flushes = cout.flushes
+        await screen.detach()
+        return cout.getvalue(), flushes
+
+    out, flushes = asyncio.run(main())
+    # Only the last of the frames requested in between is drawn
+    assert flushes == 1
+    assert "9" in out and "8" not in out
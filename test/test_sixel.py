@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# Copyright 2020, Nigel Small
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from PIL import Image
+from pytest import importorskip
+
+from pansi import sixel
+
+
+def test_single_colour_image():
+    image = Image.new("RGB", (10, 7), (255, 0, 0))
+    assert sixel.encode(image) == '\x1bP0;1;0q"1;1;10;7#0;2;100;0;0#0!10~-#0!10@\x1b\\'
+
+
+def two_colour_band():
+    image = Image.new("P", (3, 6), 0)
+    image.putpixel((1, 0), 1)
+    image.putpixel((1, 5), 1)
+    return image
+
+
+def test_two_colour_band():
+    assert list(sixel._bands(two_colour_band())) == [[(0, b"~]~"), (1, b"?`?")]]
+
+
+def test_two_colour_band_with_numpy():
+    importorskip("numpy")
+    assert list(sixel._bands_from_array(two_colour_band())) == [[(0, b"~]~"), (1, b"?`?")]]
+
+
+def test_runs_are_compressed():
+    assert sixel._compress(b"@@@@@@AAA????~~~~??") == b"!6@AAA!4?!4~"
+
+
+def test_numpy_bands_match_python_bands():
+    importorskip("numpy")
+    image = Image.effect_noise((50, 23), 80).convert("RGB")
+    assert sixel.encode(image, use_numpy=True) == sixel.encode(image, use_numpy=False)